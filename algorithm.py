@@ -1,9 +1,14 @@
-from dataclasses import dataclass
-from datetime import datetime, timedelta
+from array import array
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
 from enum import Enum
-from typing import List, Dict, Optional, Set, Tuple
-from collections import defaultdict
+from typing import Callable, Deque, Iterable, List, Dict, Optional, Set, Tuple
+from collections import defaultdict, deque
+from collections.abc import MutableMapping
+from time import perf_counter
+import bisect
 import heapq
+import os
 import uuid
 import random
 
@@ -25,7 +30,7 @@ class BookingStatus(Enum):
     MISSED = "missed"
     COMPLETED = "completed"
 
-@dataclass
+@dataclass(slots=True)
 class User:
     id: str
     name: str
@@ -35,14 +40,14 @@ class User:
     def deduct_karma(self, points: int):
         self.karma_points = max(0, self.karma_points - points)
 
-@dataclass
+@dataclass(slots=True)
 class Resource:
     id: str
     type: ResourceType
     location: str
     desk_family: Optional[str] = None
 
-@dataclass
+@dataclass(slots=True)
 class Booking:
     id: str
     user: User
@@ -54,51 +59,908 @@ class Booking:
     check_in_deadline: datetime
     coworkers: List[User] = None
 
-class BookingSystem:
+# Reference point for the integer time columns of CompactBookingStore
+EPOCH = datetime(1970, 1, 1)
+STATUSES = list(BookingStatus)
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+def _to_epoch_micros(value: datetime) -> int:
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+class BookingRecord:
+    """Booking façade over one row of a CompactBookingStore
+
+    Attribute reads and writes go straight to the store's columns, so code written
+    against Booking works unchanged. A record is only valid while its booking is in
+    the store.
+    """
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, store: "CompactBookingStore", row: int):
+        self._store = store
+        self._row = row
+
+    def __eq__(self, other):
+        return isinstance(other, BookingRecord) and other._store is self._store and other._row == self._row
+
+    def __hash__(self):
+        return hash((id(self._store), self._row))
+
+    def __repr__(self):
+        return f"BookingRecord(id={self.id!r}, user={self.user.id!r}, resource={self.resource.id!r}, status={self.status})"
+
+    @property
+    def id(self) -> str:
+        return self._store._ids[self._row]
+
+    @property
+    def user(self) -> User:
+        return self._store._users[self._store._user_col[self._row]]
+
+    @user.setter
+    def user(self, user: User):
+        self._store._user_col[self._row] = self._store._intern_user(user)
+
+    @property
+    def resource(self) -> Resource:
+        return self._store._resources[self._store._resource_col[self._row]]
+
+    @resource.setter
+    def resource(self, resource: Resource):
+        self._store._resource_col[self._row] = self._store._intern_resource(resource)
+
+    @property
+    def start_time(self) -> datetime:
+        return self._store._shared_time(self._store._start_col[self._row])
+
+    @start_time.setter
+    def start_time(self, value: datetime):
+        self._store._start_col[self._row] = _to_epoch_micros(value)
+
+    @property
+    def end_time(self) -> datetime:
+        return self._store._shared_time(self._store._end_col[self._row])
+
+    @end_time.setter
+    def end_time(self, value: datetime):
+        self._store._end_col[self._row] = _to_epoch_micros(value)
+
+    @property
+    def status(self) -> BookingStatus:
+        return STATUSES[self._store._status_col[self._row]]
+
+    @status.setter
+    def status(self, status: BookingStatus):
+        self._store._status_col[self._row] = STATUS_CODES[status]
+
+    @property
+    def created_at(self) -> datetime:
+        return EPOCH + timedelta(microseconds=self._store._created_col[self._row])
+
+    @created_at.setter
+    def created_at(self, value: datetime):
+        self._store._created_col[self._row] = _to_epoch_micros(value)
+
+    @property
+    def check_in_deadline(self) -> datetime:
+        return self._store._shared_time(self._store._deadline_col[self._row])
+
+    @check_in_deadline.setter
+    def check_in_deadline(self, value: datetime):
+        self._store._deadline_col[self._row] = _to_epoch_micros(value)
+
+    @property
+    def coworkers(self) -> List[User]:
+        return [self._store._users[i] for i in self._store._coworkers.get(self._row, ())]
+
+    @coworkers.setter
+    def coworkers(self, coworkers: List[User]):
+        self._store._set_coworkers(self._row, coworkers)
+
+    def to_booking(self) -> Booking:
+        """Detached Booking copy of this record"""
+        return Booking(self.id, self.user, self.resource, self.start_time, self.end_time, self.status,
+                       self.created_at, self.check_in_deadline, self.coworkers)
+
+class CompactBookingStore(MutableMapping):
+    """booking_id -> booking mapping that keeps bookings as rows of typed arrays
+
+    Users and resources are interned as small ints, the status as a one byte code and
+    the start, end, created and deadline times as epoch microseconds, so any time
+    Booking takes is kept exactly. Lookups return BookingRecord façades over the
+    row. Deleted rows are reused by later inserts.
+
+    Start, end and deadline reads hand out one shared datetime per distinct value,
+    so the interval index, the schedules and the deadline heap, which all keep
+    the times they were given, hold a few thousand grid times between them rather
+    than fresh copies for every booking. With benchmark.py --memory 50000 this
+    brings a whole BookingSystem from about 1640 bytes per booking with the dict
+    store to about 1410, some 14% less; the store alone goes from about 420 to 190.
+    The rest is the indexes, which key by booking ID in both modes.
+    """
     def __init__(self):
+        self._rows: Dict[str, int] = {}  # booking_id -> row
+        self._ids: List[Optional[str]] = []  # row -> booking_id, None for a free row
+        self._free_rows: List[int] = []
+        self._users: List[User] = []
+        self._user_rows: Dict[str, int] = {}
+        self._resources: List[Resource] = []
+        self._resource_rows: Dict[str, int] = {}
+        self._user_col = array("I")
+        self._resource_col = array("I")
+        self._start_col = array("q")
+        self._end_col = array("q")
+        self._status_col = array("B")
+        self._created_col = array("q")
+        self._deadline_col = array("q")
+        self._coworkers: Dict[int, Tuple[int, ...]] = {}  # row -> interned coworkers, only for group bookings
+        self._times: Dict[int, datetime] = {}  # epoch microseconds -> shared start, end or check-in deadline
+
+    def _intern_user(self, user: User) -> int:
+        if user.id not in self._user_rows:
+            self._user_rows[user.id] = len(self._users)
+            self._users.append(user)
+        return self._user_rows[user.id]
+
+    def _intern_resource(self, resource: Resource) -> int:
+        if resource.id not in self._resource_rows:
+            self._resource_rows[resource.id] = len(self._resources)
+            self._resources.append(resource)
+        return self._resource_rows[resource.id]
+
+    def _shared_time(self, micros: int) -> datetime:
+        value = self._times.get(micros)
+        if value is None:
+            value = self._times[micros] = EPOCH + timedelta(microseconds=micros)
+        return value
+
+    def _set_coworkers(self, row: int, coworkers: Optional[List[User]]):
+        if coworkers:
+            self._coworkers[row] = tuple(self._intern_user(user) for user in coworkers)
+        else:
+            self._coworkers.pop(row, None)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __contains__(self, booking_id) -> bool:
+        return booking_id in self._rows
+
+    def __getitem__(self, booking_id: str) -> BookingRecord:
+        return BookingRecord(self, self._rows[booking_id])
+
+    def __setitem__(self, booking_id: str, booking: Booking):
+        row = self._rows.get(booking_id)
+        values = (
+            self._intern_user(booking.user), self._intern_resource(booking.resource),
+            _to_epoch_micros(booking.start_time), _to_epoch_micros(booking.end_time),
+            STATUS_CODES[booking.status], _to_epoch_micros(booking.created_at),
+            _to_epoch_micros(booking.check_in_deadline),
+        )
+        columns = (self._user_col, self._resource_col, self._start_col, self._end_col,
+                   self._status_col, self._created_col, self._deadline_col)
+        if row is None and self._free_rows:
+            row = self._free_rows.pop()
+        if row is None:
+            row = len(self._ids)
+            self._ids.append(booking_id)
+            for column, value in zip(columns, values):
+                column.append(value)
+        else:
+            self._ids[row] = booking_id
+            for column, value in zip(columns, values):
+                column[row] = value
+        self._rows[booking_id] = row
+        self._set_coworkers(row, booking.coworkers)
+
+    def __delitem__(self, booking_id: str):
+        row = self._rows.pop(booking_id)
+        self._ids[row] = None
+        self._coworkers.pop(row, None)
+        self._free_rows.append(row)
+
+    def pop(self, booking_id: str, *default):
+        """Remove a booking and return it as a detached Booking, since its row may be reused"""
+        if booking_id not in self._rows:
+            if default:
+                return default[0]
+            raise KeyError(booking_id)
+        booking = self[booking_id].to_booking()
+        del self[booking_id]
+        return booking
+
+    def column_bytes(self) -> int:
+        """Bytes held by the typed columns"""
+        columns = (self._user_col, self._resource_col, self._start_col, self._end_col,
+                   self._status_col, self._created_col, self._deadline_col)
+        return sum(column.itemsize * len(column) for column in columns)
+
+# Bookings in these states are live, holds_resource says which of them keep their resource from others
+ACTIVE_STATUSES = {BookingStatus.CONFIRMED, BookingStatus.PENDING}
+
+def holds_resource(booking: Booking) -> bool:
+    """True if the booking blocks its resource for its time range
+
+    A room request holds the room it names from the start, queued or waitlisted. A
+    desk request may be handed any free desk, so it holds nothing until one is
+    assigned, otherwise it would keep the desk it named from itself and others.
+    """
+    return booking.status == BookingStatus.CONFIRMED or (
+        booking.status == BookingStatus.PENDING and booking.resource.type != ResourceType.DESK)
+
+# Half-hour slot grid shared by get_valid_room_times and TimeSlot (9:00 - 18:00)
+DAY_START = time(hour=9)
+SLOT_LENGTH = timedelta(minutes=30)
+SLOTS_PER_DAY = 18
+
+# Grid slots covered by each TimeSlot, see BookingSystem.get_time_slot_range
+TIME_SLOT_MASKS = {
+    TimeSlot.FULL_DAY: 0b1111111111111111,   # 9:00 - 17:00
+    TimeSlot.MORNING: 0b0000000000111111,    # 9:00 - 12:00
+    TimeSlot.AFTERNOON: 0b1111111111000000,  # 12:00 - 17:00
+}
+MASK_TIME_SLOTS = {mask: slot for slot, mask in TIME_SLOT_MASKS.items()}
+HALF_DAYS = (TimeSlot.MORNING, TimeSlot.AFTERNOON)
+
+def slot_mask(day: date, start_time: datetime, end_time: datetime) -> int:
+    """Bitmask of the grid slots on `day` that overlap [start_time, end_time)"""
+    base = datetime.combine(day, DAY_START)
+    first = max(0, (start_time - base) // SLOT_LENGTH)
+    last = min(SLOTS_PER_DAY, -((base - end_time) // SLOT_LENGTH))  # ceiling division
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+def is_on_grid(start_time: datetime, end_time: datetime) -> bool:
+    """True if the range is made of whole grid slots within a single day"""
+    base = datetime.combine(start_time.date(), DAY_START)
+    return (base <= start_time < end_time <= base + SLOTS_PER_DAY * SLOT_LENGTH
+            and (start_time - base) % SLOT_LENGTH == timedelta(0)
+            and (end_time - base) % SLOT_LENGTH == timedelta(0))
+
+def booking_days(start_time: datetime, end_time: datetime):
+    """Yield every calendar day touched by [start_time, end_time)"""
+    day = start_time.date()
+    while day == start_time.date() or datetime.combine(day, time.min) < end_time:
+        yield day
+        day += timedelta(days=1)
+
+class IntervalIndex:
+    """Sorted (start, end, booking_id) intervals of a single resource, queried with bisect"""
+    def __init__(self):
+        self.intervals: List[Tuple[datetime, datetime, str]] = []
+        self.max_duration = timedelta(0)  # longest interval seen, bounds how far back an overlap can start
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def add(self, start: datetime, end: datetime, booking_id: str):
+        bisect.insort(self.intervals, (start, end, booking_id))
+        if end - start > self.max_duration:
+            self.max_duration = end - start
+
+    def add_many(self, intervals: List[Tuple[datetime, datetime, str]]):
+        """Add several intervals with one sort, which merges two sorted runs in linear time"""
+        self.intervals.extend(intervals)
+        self.intervals.sort()
+        longest = max(end - start for start, end, _ in intervals)
+        if longest > self.max_duration:
+            self.max_duration = longest
+
+    def remove(self, start: datetime, end: datetime, booking_id: str):
+        i = bisect.bisect_left(self.intervals, (start, end, booking_id))
+        if i < len(self.intervals) and self.intervals[i] == (start, end, booking_id):
+            del self.intervals[i]
+
+    def overlapping(self, start: datetime, end: datetime):
+        """Yield the booking IDs whose interval overlaps [start, end)"""
+        for interval in self.overlapping_intervals(start, end):
+            yield interval[2]
+
+    def overlapping_intervals(self, start: datetime, end: datetime):
+        """Yield the (start, end, booking_id) intervals that overlap [start, end)"""
+        lo = bisect.bisect_left(self.intervals, (start - self.max_duration,))
+        hi = bisect.bisect_left(self.intervals, (end,))
+        for i in range(lo, hi):
+            interval = self.intervals[i]
+            if interval[1] > start:
+                yield interval
+
+class WaitingList:
+    """Heap of (-karma, timestamp, booking_id) entries that also supports removal by booking ID
+
+    Removed entries are left in the heap as tombstones and skipped when they reach
+    the top; the heap is compacted once tombstones outnumber live entries.
+    """
+    COMPACT_MIN_SIZE = 64
+
+    def __init__(self):
+        self._heap: List[Tuple[int, datetime, str]] = []
+        self._entries: Dict[str, Tuple[int, datetime, str]] = {}  # booking_id -> live heap entry
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, booking_id: str) -> bool:
+        return booking_id in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries.values()))
+
+    def __getitem__(self, index: int) -> Tuple[int, datetime, str]:
+        """Entry at a position in priority order, so [0] is the next booking to be served"""
+        if index == 0:
+            return self.peek()
+        return sorted(self._entries.values())[index]
+
+    def get(self, booking_id: str) -> Optional[Tuple[int, datetime, str]]:
+        return self._entries.get(booking_id)
+
+    def push(self, karma: int, timestamp: datetime, booking_id: str):
+        self.remove(booking_id)
+        entry = (-karma, timestamp, booking_id)
+        self._entries[booking_id] = entry
+        heapq.heappush(self._heap, entry)
+
+    def peek(self) -> Tuple[int, datetime, str]:
+        self._discard_dead_top()
+        if not self._heap:
+            raise IndexError("peek from an empty waiting list")
+        return self._heap[0]
+
+    def pop(self) -> Tuple[int, datetime, str]:
+        entry = self.peek()
+        heapq.heappop(self._heap)
+        del self._entries[entry[2]]
+        return entry
+
+    def remove(self, booking_id: str) -> bool:
+        """Drop a booking from the waiting list, returns False if it was not waiting"""
+        if self._entries.pop(booking_id, None) is None:
+            return False
+        dead = len(self._heap) - len(self._entries)
+        if dead > len(self._entries) and len(self._heap) >= self.COMPACT_MIN_SIZE:
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+        return True
+
+    def _discard_dead_top(self):
+        heap = self._heap
+        while heap and self._entries.get(heap[0][2]) is not heap[0]:
+            heapq.heappop(heap)
+
+class DeskPool:
+    """Set of desk IDs with O(1) add, swap-remove and uniform random pick"""
+    def __init__(self, desk_ids=()):
+        self.items: List[str] = []
+        self.positions: Dict[str, int] = {}  # desk_id -> index in items
+        for desk_id in desk_ids:
+            self.add(desk_id)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, desk_id: str) -> bool:
+        return desk_id in self.positions
+
+    def add(self, desk_id: str):
+        if desk_id not in self.positions:
+            self.positions[desk_id] = len(self.items)
+            self.items.append(desk_id)
+
+    def discard(self, desk_id: str):
+        index = self.positions.pop(desk_id, None)
+        if index is None:
+            return
+        last = self.items.pop()
+        if index < len(self.items):
+            self.items[index] = last
+            self.positions[last] = index
+
+    def pick(self, rng=random) -> str:
+        return self.items[rng.randrange(len(self.items))]
+
+@dataclass
+class BatchReport:
+    """Outcome of one process_request_batch pass"""
+    processed: int = 0
+    confirmed: int = 0
+    waitlisted: int = 0
+    skipped: int = 0
+    groups: int = 0
+    elapsed: float = 0.0  # seconds
+
+    @property
+    def throughput(self) -> float:
+        """Requests processed per second"""
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+@dataclass(slots=True)
+class BookingRequest:
+    """One item of a bulk booking: a named resource for a time range"""
+    user_id: str
+    resource_id: str
+    start_time: datetime
+    end_time: datetime
+
+@dataclass
+class BulkReport:
+    """Outcome of one book_bulk call"""
+    booking_ids: List[Optional[str]] = field(default_factory=list)  # per request, None where nothing was booked
+    failures: Dict[int, str] = field(default_factory=dict)  # request index -> reason it could not be booked
+    committed: bool = False  # False when an atomic batch was rejected as a whole
+    elapsed: float = 0.0  # seconds
+
+    @property
+    def booked(self) -> int:
+        return sum(booking_id is not None for booking_id in self.booking_ids)
+
+def recurrence(user_id: str, resource_id: str, start_time: datetime, end_time: datetime, until: date,
+               weekdays: Set[int] = None) -> List[BookingRequest]:
+    """One BookingRequest per matching day from start_time's day through `until`
+
+    `weekdays` are datetime.weekday() numbers (Monday is 0), by default the weekday
+    of start_time, so "every Tue/Thu" is weekdays={1, 3}.
+    """
+    if weekdays is None:
+        weekdays = {start_time.weekday()}
+    requests = []
+    offset = timedelta(0)
+    while (start_time + offset).date() <= until:
+        if (start_time + offset).weekday() in weekdays:
+            requests.append(BookingRequest(user_id, resource_id, start_time + offset, end_time + offset))
+        offset += timedelta(days=1)
+    return requests
+
+@dataclass
+class CancellationReport:
+    """Outcome of one cancel_bookings or cancel_matching call"""
+    cancelled: List[str] = field(default_factory=list)
+    karma: Dict[str, int] = field(default_factory=dict)  # user_id -> points actually deducted, at most down to 0
+    promoted: List[str] = field(default_factory=list)  # waiting bookings confirmed into the freed time
+    elapsed: float = 0.0  # seconds
+
+def karma_penalty(start_time: datetime, now: datetime) -> int:
+    """Karma cost of cancelling, or missing, a booking that starts at start_time"""
+    hours_until_booking = (start_time - now).total_seconds() / 3600
+
+    if hours_until_booking >24:
+        return 0
+    elif hours_until_booking < 0:
+        return 100
+    else:
+        base_penalty = 10
+        additional_penalty = int((24-hours_until_booking) / (16/60))
+        return min(base_penalty + additional_penalty, 100)
+
+def merge_intervals(intervals: List[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
+    """Sorted union of time ranges, with overlapping and touching ranges joined"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+class DeadlineScheduler:
+    """Min-heap of (check_in_deadline, booking_id) so expired bookings come off the top in deadline order
+
+    Rescheduled and cancelled bookings leave stale heap entries behind, which are
+    skipped when popped and compacted away once they outnumber live ones.
+    """
+    COMPACT_MIN_SIZE = 64
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, str]] = []
+        self._deadlines: Dict[str, datetime] = {}  # booking_id -> live deadline
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, booking_id: str) -> bool:
+        return booking_id in self._deadlines
+
+    def schedule(self, booking_id: str, deadline: datetime):
+        self._deadlines[booking_id] = deadline
+        heapq.heappush(self._heap, (deadline, booking_id))
+        if len(self._heap) > 2 * len(self._deadlines) + self.COMPACT_MIN_SIZE:
+            self._heap = [(deadline, booking_id) for booking_id, deadline in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def cancel(self, booking_id: str):
+        self._deadlines.pop(booking_id, None)
+
+    def next_deadline(self) -> Optional[datetime]:
+        """Earliest live deadline, or None if nothing is scheduled"""
+        heap = self._heap
+        while heap and self._deadlines.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def pop_expired(self, now: datetime) -> List[str]:
+        """Remove and return every booking whose deadline is at or before `now`"""
+        expired = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, booking_id = heapq.heappop(heap)
+            if self._deadlines.get(booking_id) == deadline:
+                del self._deadlines[booking_id]
+                expired.append(booking_id)
+        return expired
+
+class AllocationPolicy:
+    """Choices BookingSystem makes when more than one outcome is valid, see BookingSystem.policy
+
+    The defaults are the built-in behaviour: a random free desk, the desk family
+    that leaves the fewest free desks behind (best fit), and waiting lists ordered
+    by karma, then by the time the booking joined. replay.ReplayPolicy has others.
+    For a half day request choose_desk is only offered desks whose other half is
+    taken, as long as there are any, so whole free days are kept for full days.
+    """
+    def choose_desk(self, system: "BookingSystem", booking: "Booking", free_desk_ids: List[str]) -> str:
+        """One of the free desk IDs for a single desk booking"""
+        return free_desk_ids[system.rng.randrange(len(free_desk_ids))]
+
+    def rank_families(self, desk_count: int, free_counts: List[Tuple[int, int, str]], limit: int = None) -> List[str]:
+        """Families to try for a group of desk_count, from (free desks, position, family) of every family that fits"""
+        best = heapq.nsmallest(limit, free_counts) if limit else sorted(free_counts)
+        return [family for _, _, family in best]
+
+    def waiting_priority(self, booking: "Booking", now: datetime) -> Tuple[int, datetime]:
+        """(priority, timestamp) a booking joins its waiting list with, higher priority first, then earlier"""
+        return booking.user.karma_points, now
+
+def _discard_index_entry(index: Dict, key, booking_id: str):
+    """Remove a booking ID from one bucket of a secondary index, dropping the bucket once empty"""
+    bucket = index.get(key)
+    if bucket is not None:
+        bucket.discard(booking_id)
+        if not bucket:
+            del index[key]
+
+class WaitingIndex:
+    """Waiting bookings bucketed by (start, end, group size)
+
+    Waiters in one bucket compete for exactly the same thing, so a freed interval
+    only has to look at the best waiter of each bucket it overlaps.
+    """
+    def __init__(self):
+        self.buckets: Dict[Tuple[datetime, datetime, int], WaitingList] = {}
+        self.ranges = IntervalIndex()  # one (start, end, group size) interval per non-empty bucket
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    @staticmethod
+    def _key(booking: Booking) -> Tuple[datetime, datetime, int]:
+        return (booking.start_time, booking.end_time, len(booking.coworkers or ()))
+
+    def add(self, booking: Booking, entry: Tuple[int, datetime, str]):
+        key = self._key(booking)
+        if key not in self.buckets:
+            self.buckets[key] = WaitingList()
+            self.ranges.add(*key)
+        self.buckets[key].push(-entry[0], entry[1], entry[2])
+
+    def remove(self, booking: Booking):
+        key = self._key(booking)
+        bucket = self.buckets.get(key)
+        if bucket is not None and bucket.remove(booking.id) and not bucket:
+            del self.buckets[key]
+            self.ranges.remove(*key)
+
+    def overlapping(self, start: datetime, end: datetime) -> List[WaitingList]:
+        """Buckets whose time range overlaps [start, end)"""
+        return [self.buckets[key] for key in self.ranges.overlapping_intervals(start, end)]
+
+class BookingSystem:
+    def __init__(self, seed: int = None, compact: bool = False):
         self.resources: Dict[str, Resource] = {}
         self.users: Dict[str, User] = {}
-        self.bookings: Dict[str, Booking] = {}
-        self.request_queue: List[str] = []  # FIFO queue of booking IDs
-        self.desk_waiting_list: List[Tuple[int, datetime, str]] = []  # (karma, timestamp, booking_id)
-        self.room_waiting_lists: Dict[str, List[Tuple[int, datetime, str]]] = defaultdict(list)  # room_id -> [(karma, timestamp, booking_id)]
+        # compact=True keeps bookings in typed array columns for very large histories, see CompactBookingStore
+        self.bookings: Dict[str, Booking] = CompactBookingStore() if compact else {}
+        self.request_queue: Deque[str] = deque()  # FIFO queue of booking IDs
+        self.desk_waiting_list = WaitingList()  # (karma, timestamp, booking_id)
+        self.room_waiting_lists: Dict[str, WaitingList] = defaultdict(WaitingList)  # room_id -> [(karma, timestamp, booking_id)]
+        # Waiting bookings by time range, so a freed interval finds the waiters it can serve
+        self.desk_waiting_index = WaitingIndex()
+        self.room_waiting_index: Dict[str, WaitingIndex] = defaultdict(WaitingIndex)
+        self.schedules: Dict[str, IntervalIndex] = defaultdict(IntervalIndex)  # resource_id -> active booking intervals
+        self._indexed: Dict[str, Tuple[str, datetime, datetime]] = {}  # booking_id -> (resource_id, start, end) it is indexed under
+        self.occupancy: Dict[Tuple[str, date], int] = {}  # (resource_id, day) -> bitmask of occupied grid slots
+        self.desk_pools: Dict[Tuple[date, TimeSlot], DeskPool] = {}  # free desks per (day, slot), built on first use
+        self.family_pools: Dict[Tuple[date, TimeSlot], Dict[str, DeskPool]] = {}  # same, split by desk family
+        # Desks free in a half day but taken in the other half, offered first so whole free days stay whole
+        self.half_used_pools: Dict[Tuple[date, TimeSlot], DeskPool] = {}
+        self.desk_families: Dict[str, List[Resource]] = defaultdict(list)  # desk_family -> desks, in the order added
+        self._pooled_days: Set[date] = set()
+        # Falls back to the module level generator so random.seed() keeps tests reproducible
+        self.rng = random.Random(seed) if seed is not None else random
+        # Secondary indexes of booking IDs, covering every booking in self.bookings
+        self.bookings_by_user: Dict[str, Set[str]] = defaultdict(set)
+        self.bookings_by_resource: Dict[str, Dict[date, Set[str]]] = defaultdict(lambda: defaultdict(set))  # resource_id -> day -> IDs
+        self.bookings_by_status: Dict[BookingStatus, Set[str]] = defaultdict(set)
+        self.bookings_by_date: Dict[date, Set[str]] = defaultdict(set)
+        self.check_in_deadlines = DeadlineScheduler()  # active bookings that have not checked in yet
+        self.checked_in: Set[str] = set()  # IDs of bookings whose holder has checked in
+        self.last_batch_report: Optional[BatchReport] = None  # set by every process_request_batch
+        self.journal = None  # optional operation log, see persistence.Journal
+        self.observers: List = []  # more objects with append(op, *args) that see every journal record
+        self.metrics = None  # optional instrumentation, see metrics.Metrics.attach
+        self.clock: Callable[[], datetime] = datetime.now  # current time, replay.VirtualClock runs it faster
+        self.policy = AllocationPolicy()
+
+    def _log(self, op: str, *args):
+        """Record a state change that has just been made, if a journal or observer is attached"""
+        if self.journal is not None:
+            self.journal.append(op, *args)
+        for observer in self.observers:
+            observer.append(op, *args)
+
+    def _add_booking(self, booking: Booking):
+        """Store a new booking and index it if it holds its resource"""
+        self.bookings[booking.id] = booking
+        booking = self.bookings[booking.id]  # in compact mode, the record over the stored row
+        self.bookings_by_user[booking.user.id].add(booking.id)
+        self.bookings_by_resource[booking.resource.id][booking.start_time.date()].add(booking.id)
+        self.bookings_by_status[booking.status].add(booking.id)
+        self.bookings_by_date[booking.start_time.date()].add(booking.id)
+        self._index_booking(booking)
+        if booking.status in ACTIVE_STATUSES and booking.id not in self.checked_in:
+            self.check_in_deadlines.schedule(booking.id, booking.check_in_deadline)
+        self._log("add", booking)
+
+    def _add_bookings(self, bookings: List[Booking]):
+        """_add_booking for many bookings, with one sort per schedule and one pool refresh per (resource, day)"""
+        stored = []
+        intervals: Dict[str, List[Tuple[datetime, datetime, str]]] = defaultdict(list)
+        touched: Set[Tuple[str, date]] = set()
+        for booking in bookings:
+            self.bookings[booking.id] = booking
+            booking = self.bookings[booking.id]
+            stored.append(booking)
+            resource_id, day = booking.resource.id, booking.start_time.date()
+            self.bookings_by_user[booking.user.id].add(booking.id)
+            self.bookings_by_resource[resource_id][day].add(booking.id)
+            self.bookings_by_status[booking.status].add(booking.id)
+            self.bookings_by_date[day].add(booking.id)
+            if holds_resource(booking) and booking.id not in self._indexed:
+                intervals[resource_id].append((booking.start_time, booking.end_time, booking.id))
+                self._indexed[booking.id] = (resource_id, booking.start_time, booking.end_time)
+                for day in booking_days(booking.start_time, booking.end_time):
+                    key = (resource_id, day)
+                    self.occupancy[key] = self.occupancy.get(key, 0) | slot_mask(day, booking.start_time, booking.end_time)
+                    touched.add(key)
+            if booking.status in ACTIVE_STATUSES and booking.id not in self.checked_in:
+                self.check_in_deadlines.schedule(booking.id, booking.check_in_deadline)
+        for resource_id, resource_intervals in intervals.items():
+            self.schedules[resource_id].add_many(resource_intervals)
+        for resource_id, day in touched:
+            self._refresh_desk_pools(resource_id, day)
+        for booking in stored:
+            self._log("add", booking)
+
+    def _forget_booking(self, booking_id: str, op: str = "forget") -> Booking:
+        """Delete a booking from self.bookings, the waiting lists and every index built over it, returns it
+
+        `op` names the journal record, "archive" when the booking moves to cold storage rather than away.
+        """
+        self._remove_from_waiting_lists(self.bookings[booking_id])
+        booking = self.bookings.pop(booking_id)
+        self._unindex_booking(booking_id)
+        self.check_in_deadlines.cancel(booking_id)
+        self.checked_in.discard(booking_id)
+        day = booking.start_time.date()
+        _discard_index_entry(self.bookings_by_user, booking.user.id, booking_id)
+        _discard_index_entry(self.bookings_by_resource[booking.resource.id], day, booking_id)
+        if not self.bookings_by_resource[booking.resource.id]:
+            del self.bookings_by_resource[booking.resource.id]
+        _discard_index_entry(self.bookings_by_status, booking.status, booking_id)
+        _discard_index_entry(self.bookings_by_date, day, booking_id)
+        self._log(op, booking_id)
+        return booking
+
+    def _index_booking(self, booking: Booking):
+        if holds_resource(booking) and booking.id not in self._indexed:
+            self.schedules[booking.resource.id].add(booking.start_time, booking.end_time, booking.id)
+            self._indexed[booking.id] = (booking.resource.id, booking.start_time, booking.end_time)
+            for day in booking_days(booking.start_time, booking.end_time):
+                key = (booking.resource.id, day)
+                self.occupancy[key] = self.occupancy.get(key, 0) | slot_mask(day, booking.start_time, booking.end_time)
+                self._refresh_desk_pools(booking.resource.id, day)
+
+    def _unindex_booking(self, booking_id: str):
+        if booking_id in self._indexed:
+            resource_id, start_time, end_time = self._indexed.pop(booking_id)
+            self.schedules[resource_id].remove(start_time, end_time, booking_id)
+            for day in booking_days(start_time, end_time):
+                self._rebuild_occupancy(resource_id, day)
+
+    def _rebuild_occupancy(self, resource_id: str, day: date):
+        """Recompute one day's bitmask from the bookings still indexed on the resource"""
+        day_start = datetime.combine(day, time.min)
+        mask = 0
+        for booking_id in self.schedules[resource_id].overlapping(day_start, day_start + timedelta(days=1)):
+            _, start_time, end_time = self._indexed[booking_id]
+            mask |= slot_mask(day, start_time, end_time)
+        if mask:
+            self.occupancy[(resource_id, day)] = mask
+        else:
+            self.occupancy.pop((resource_id, day), None)
+        self._refresh_desk_pools(resource_id, day)
+
+    def _refresh_desk_pools(self, resource_id: str, day: date):
+        """Move a desk in or out of the day's free pools after its occupancy changed"""
+        if day not in self._pooled_days:
+            return
+        resource = self.resources.get(resource_id)
+        if resource is None or resource.type != ResourceType.DESK:
+            return
+        occupied = self.occupancy.get((resource_id, day), 0)
+        for slot, mask in TIME_SLOT_MASKS.items():
+            family_pool = self.family_pools[(day, slot)].setdefault(resource.desk_family, DeskPool())
+            if occupied & mask:
+                self.desk_pools[(day, slot)].discard(resource_id)
+                family_pool.discard(resource_id)
+            else:
+                self.desk_pools[(day, slot)].add(resource_id)
+                family_pool.add(resource_id)
+        for slot in HALF_DAYS:
+            if not occupied & TIME_SLOT_MASKS[slot] and occupied & TIME_SLOT_MASKS[TimeSlot.FULL_DAY]:
+                self.half_used_pools[(day, slot)].add(resource_id)
+            else:
+                self.half_used_pools[(day, slot)].discard(resource_id)
+
+    def _slot_key(self, start_time: datetime, end_time: datetime) -> Optional[Tuple[date, TimeSlot]]:
+        """(day, TimeSlot) of a range, building that day's pools if needed, or None if the range is not a TimeSlot"""
+        if not is_on_grid(start_time, end_time):
+            return None
+        day = start_time.date()
+        slot = MASK_TIME_SLOTS.get(slot_mask(day, start_time, end_time))
+        if slot is None:
+            return None
+        if day not in self._pooled_days:
+            for time_slot, mask in TIME_SLOT_MASKS.items():
+                family_pools = {}
+                for family, desks in self.desk_families.items():
+                    family_pools[family] = DeskPool(
+                        desk.id for desk in desks if not self.occupancy.get((desk.id, day), 0) & mask
+                    )
+                self.family_pools[(day, time_slot)] = family_pools
+                self.desk_pools[(day, time_slot)] = DeskPool(
+                    desk_id for pool in family_pools.values() for desk_id in pool.items
+                )
+            whole_days = self.desk_pools[(day, TimeSlot.FULL_DAY)]
+            for time_slot in HALF_DAYS:
+                self.half_used_pools[(day, time_slot)] = DeskPool(
+                    desk_id for desk_id in self.desk_pools[(day, time_slot)].items if desk_id not in whole_days
+                )
+            self._pooled_days.add(day)
+        return (day, slot)
+
+    def _desk_pool(self, start_time: datetime, end_time: datetime) -> Optional[DeskPool]:
+        """Free desk pool for a TimeSlot range, or None if the range is not a TimeSlot"""
+        key = self._slot_key(start_time, end_time)
+        return None if key is None else self.desk_pools[key]
+
+    def _desk_choices(self, start_time: datetime, end_time: datetime, pool: DeskPool) -> List[str]:
+        """Free desks offered to the policy for a TimeSlot range, half-used desks first for a half day"""
+        half_used = self.half_used_pools.get(self._slot_key(start_time, end_time))
+        return half_used.items if half_used else pool.items
+
+    def _set_status(self, booking: Booking, status: BookingStatus):
+        """Change a booking's status, keeping the indexes in step"""
+        if booking.id in self.bookings and booking.status != status:
+            _discard_index_entry(self.bookings_by_status, booking.status, booking.id)
+            self.bookings_by_status[status].add(booking.id)
+        booking.status = status
+        if status not in ACTIVE_STATUSES:
+            self.check_in_deadlines.cancel(booking.id)
+        if holds_resource(booking):
+            self._index_booking(booking)
+        else:
+            self._unindex_booking(booking.id)
+        self._log("status", booking.id, status)
+
+    def _confirm(self, booking: Booking):
+        """Confirm a booking the allocator just placed on its resource"""
+        self._set_status(booking, BookingStatus.CONFIRMED)
+        self._count_allocations(1)
+
+    def _count_allocations(self, count: int):
+        """Report newly allocated bookings to the attached metrics, if any"""
+        if self.metrics is not None:
+            self.metrics.allocated(count)
+
+    def _assign_resource(self, booking: Booking, resource: Resource):
+        """Move a booking onto another resource, keeping the indexes in step"""
+        self._unindex_booking(booking.id)
+        if booking.id in self.bookings and booking.resource.id != resource.id:
+            day = booking.start_time.date()
+            _discard_index_entry(self.bookings_by_resource[booking.resource.id], day, booking.id)
+            if not self.bookings_by_resource[booking.resource.id]:
+                del self.bookings_by_resource[booking.resource.id]
+            self.bookings_by_resource[resource.id][day].add(booking.id)
+        booking.resource = resource
+        self._index_booking(booking)
+        self._log("assign", booking.id, resource.id)
+
+    def _overlapping_bookings(self, resource_id: str, start_time: datetime, end_time: datetime):
+        """Yield the active bookings on a resource that overlap the given time range"""
+        schedule = self.schedules.get(resource_id)
+        if schedule is None:
+            return
+        for booking_id in schedule.overlapping(start_time, end_time):
+            yield self.bookings[booking_id]
+
+    def _drop_bookings(self, booking_ids):
+        """Delete bookings without touching the request queue or waiting lists"""
+        for booking_id in booking_ids:
+            self._forget_booking(booking_id)
+
+    def _resource_booking_ids(self, resource_type: ResourceType) -> List[str]:
+        return [
+            booking_id
+            for resource_id, by_day in self.bookings_by_resource.items()
+            if self.resources[resource_id].type == resource_type
+            for booking_ids in by_day.values()
+            for booking_id in booking_ids
+        ]
+
+    def get_user_bookings(self, user_id: str, status: BookingStatus = None) -> List[Booking]:
+        """All bookings made by a user, optionally only those in one status"""
+        booking_ids = self.bookings_by_user.get(user_id, ())
+        if status is not None:
+            booking_ids = [b for b in booking_ids if b in self.bookings_by_status.get(status, ())]
+        return [self.bookings[booking_id] for booking_id in booking_ids]
+
+    def get_resource_bookings(self, resource_id: str, booking_date: datetime = None) -> List[Booking]:
+        """All bookings on a resource, optionally only those starting on one day"""
+        by_day = self.bookings_by_resource.get(resource_id, {})
+        if booking_date is not None:
+            return [self.bookings[booking_id] for booking_id in by_day.get(booking_date.date(), ())]
+        return [self.bookings[booking_id] for booking_ids in by_day.values() for booking_id in booking_ids]
+
+    def get_bookings_by_status(self, status: BookingStatus) -> List[Booking]:
+        return [self.bookings[booking_id] for booking_id in self.bookings_by_status.get(status, ())]
+
+    def get_bookings_on(self, booking_date: datetime) -> List[Booking]:
+        """All bookings starting on the given day"""
+        return [self.bookings[booking_id] for booking_id in self.bookings_by_date.get(booking_date.date(), ())]
 
     def clear_room_bookings(self, room_id: str = None):
         """Clear all bookings for a specific room"""
         if room_id is None:
             return
-        to_remove = [k for k,v in self.bookings.items() if v.resource.id == room_id]
+        to_remove = [booking.id for booking in self.get_resource_bookings(room_id)]
         for booking_id in to_remove:
             self.remove_booking(booking_id)
 
     def clear_all_room_bookings(self):
-        self.bookings = {k:v for k,v in self.bookings.items() if v.resource.type != ResourceType.ROOM}  
+        self._drop_bookings(self._resource_booking_ids(ResourceType.ROOM))
 
     def clear_desk_bookings(self, desk_id: str = None):
         """Clear all bookings for a specific desk"""
-        self.bookings = {k:v for k,v in self.bookings.items() if v.resource.id != desk_id}
+        self._drop_bookings([booking.id for booking in self.get_resource_bookings(desk_id)])
 
     def clear_all_desk_bookings(self):
-        self.bookings = {k:v for k,v in self.bookings.items() if v.resource.type != ResourceType.DESK}
+        self._drop_bookings(self._resource_booking_ids(ResourceType.DESK))
 
     def remove_booking(self, booking_id: str):
         """Remove a specific booking by ID from all data structures"""
-        if booking_id in self.bookings:
-            del self.bookings[booking_id]
-
-        # Remove from request queue if present
-        if booking_id in self.request_queue:
-            self.request_queue.remove(booking_id)
-
-        #Remove from desk waiting list if present
-        self.desk_waiting_list = [x for x in self.desk_waiting_list if x[2] != booking_id]
-        heapq.heapify(self.desk_waiting_list)
-
-        #Remove from room waiting lists if present
-        for room_id in self.room_waiting_lists:
-            self.room_waiting_lists[room_id] = [x for x in self.room_waiting_lists[room_id] if x[2] != booking_id]
-            heapq.heapify(self.room_waiting_lists[room_id])
-
+        # Queued IDs are left in the request queue and skipped once the booking is gone
+        booking = self.bookings.get(booking_id)
+        if booking is None:
+            return
+        was_holding = holds_resource(booking) and not self._is_waitlisted(booking)
+        booking = self._forget_booking(booking_id)
+        if was_holding:
+            self._promote_waiters(booking.resource.id, booking.start_time, booking.end_time)
 
     def get_time_slot_range(self, slot: TimeSlot, date: datetime) -> Tuple[datetime, datetime]:
         base_date = datetime.combine(date.date(), datetime.min.time().replace(hour=9))
@@ -113,64 +975,162 @@ class BookingSystem:
             raise ValueError(f"Invalid time slot: {slot}")
 
     def add_resource(self, resource: Resource):
+        previous = self.resources.get(resource.id)
+        if previous is not None and previous.type == ResourceType.DESK:
+            self.desk_families[previous.desk_family].remove(previous)
         self.resources[resource.id] = resource
-        
+        if resource.type == ResourceType.DESK:
+            self.desk_families[resource.desk_family].append(resource)
+        for day in self._pooled_days:
+            self._refresh_desk_pools(resource.id, day)
+        self._log("resource", resource)
+
+    def add_resources(self, resources: Iterable[Resource]):
+        """add_resource for many resources, regrouping desk families once at the end
+
+        A resource listed twice is added as its last entry. If any desk changed, the
+        free desk pools are dropped and rebuilt on first use instead of being
+        patched desk by desk.
+        """
+        latest = {resource.id: resource for resource in resources}
+        replaced: Dict[str, Set[str]] = defaultdict(set)  # desk_family -> IDs of desks leaving it
+        joined: Dict[str, List[Resource]] = defaultdict(list)  # desk_family -> desks joining it, in order
+        for resource in latest.values():
+            previous = self.resources.get(resource.id)
+            if previous is not None and previous.type == ResourceType.DESK:
+                replaced[previous.desk_family].add(previous.id)
+            self.resources[resource.id] = resource
+            if resource.type == ResourceType.DESK:
+                joined[resource.desk_family].append(resource)
+        for family, desk_ids in replaced.items():
+            self.desk_families[family] = [desk for desk in self.desk_families[family] if desk.id not in desk_ids]
+        for family, desks in joined.items():
+            self.desk_families[family].extend(desks)
+        if replaced or joined:
+            self._pooled_days.clear()
+            self.desk_pools.clear()
+            self.family_pools.clear()
+            self.half_used_pools.clear()
+        for resource in latest.values():
+            self._log("resource", resource)
+
     def add_user(self, user: User):
         self.users[user.id] = user
+        self._log("user", user)
+
+    def add_users(self, users: Iterable[User]):
+        """add_user for many users"""
+        added = {user.id: user for user in users}
+        self.users.update(added)
+        for user in added.values():
+            self._log("user", user)
+
+    def _deduct_karma(self, user: User, points: int):
+        user.deduct_karma(points)
+        self._log("karma", user.id, user.karma_points)
 
     def add_to_request_queue(self, booking_id: str):
         """Add booking request to FIFO queue"""
         self.request_queue.append(booking_id)
+        self._log("enqueue", booking_id)
+
+    def _next_request(self) -> Optional[str]:
+        """Pop the oldest queued booking ID, or None once the queue is empty"""
+        if not self.request_queue:
+            return None
+        booking_id = self.request_queue.popleft()
+        self._log("dequeue", booking_id)
+        return booking_id
 
     def add_to_waiting_list(self, booking_id: str):
         """Add to appropriate waiting list based on resource type"""
         booking = self.bookings[booking_id]
-        user = booking.user
-        timestamp = datetime.now()
-        
+        self._push_waiting(booking, *self.policy.waiting_priority(booking, self.clock()))
+
+    def _push_waiting(self, booking: Booking, karma: int, timestamp: datetime):
         if booking.resource.type == ResourceType.DESK:
-            heapq.heappush(self.desk_waiting_list, (-user.karma_points, timestamp, booking_id))
+            self.desk_waiting_list.push(karma, timestamp, booking.id)
+            self.desk_waiting_index.add(booking, self.desk_waiting_list.get(booking.id))
         else:
-            heapq.heappush(self.room_waiting_lists[booking.resource.id], 
-                          (-user.karma_points, timestamp, booking_id))
+            self.room_waiting_lists[booking.resource.id].push(karma, timestamp, booking.id)
+            self.room_waiting_index[booking.resource.id].add(booking, self.room_waiting_lists[booking.resource.id].get(booking.id))
+        self._log("wait", booking.id, karma, timestamp)
 
-    def is_desk_available(self) -> bool:
-        """Check if any desk is available"""
+    def _is_waitlisted(self, booking: Booking) -> bool:
+        if booking.resource.type == ResourceType.DESK:
+            return booking.id in self.desk_waiting_list
+        waiting_list = self.room_waiting_lists.get(booking.resource.id)
+        return waiting_list is not None and booking.id in waiting_list
+
+    def _remove_from_waiting_lists(self, booking: Booking) -> bool:
+        """Take a booking off its waiting list, returns False if it was not waiting"""
+        if booking.resource.type == ResourceType.DESK:
+            waiting_list, waiting_index = self.desk_waiting_list, self.desk_waiting_index
+        elif booking.resource.id in self.room_waiting_lists:
+            waiting_list, waiting_index = self.room_waiting_lists[booking.resource.id], self.room_waiting_index[booking.resource.id]
+        else:
+            return False
+        if not waiting_list.remove(booking.id):
+            return False
+        waiting_index.remove(booking)
+        self._log("unwait", booking.id)
+        return True
+
+    def is_desk_available(self, start_time: datetime = None, end_time: datetime = None) -> bool:
+        """Check if any desk is available, for the given time range if one is passed"""
+        if start_time is not None and end_time is not None:
+            pool = self._desk_pool(start_time, end_time)
+            if pool is not None:
+                return len(pool) > 0
         for resource in self.resources.values():
             if resource.type == ResourceType.DESK:
-                if self.is_resource_available(resource.id):
+                if self.is_resource_available(resource.id, start_time, end_time):
                     return True
         return False
 
+    def free_desks(self, booking_date: datetime, time_slot: TimeSlot) -> List[Resource]:
+        """All desks with no active booking in the given slot of the given day"""
+        pool = self._desk_pool(*self.get_time_slot_range(time_slot, booking_date))
+        return [self.resources[desk_id] for desk_id in pool.items]
+
     def assign_random_desk(self, booking_id: str):
         """Assign a random available desk to the booking"""
-        available_desks = [
-            resource for resource in self.resources.values()
-            if resource.type == ResourceType.DESK and self.is_resource_available(resource.id)
-        ]
+        booking = self.bookings[booking_id]
+        pool = self._desk_pool(booking.start_time, booking.end_time)
+        if pool is not None:
+            available_desks = self._desk_choices(booking.start_time, booking.end_time, pool)
+        else:
+            available_desks = [
+                resource.id for resource in self.resources.values()
+                if resource.type == ResourceType.DESK
+                and self.is_resource_available(resource.id, booking.start_time, booking.end_time)
+            ]
         if available_desks:
-            random_desk = random.choice(available_desks)
-            booking = self.bookings[booking_id]
-            booking.resource = random_desk
-            booking.status = BookingStatus.CONFIRMED
+            random_desk = self.resources[self.policy.choose_desk(self, booking, available_desks)]
+            self._assign_resource(booking, random_desk)
+            self._confirm(booking)
             return True
         return False
 
-    def is_resource_available(self, resource_id: str) -> bool:
-        """Check if a specific resource is available"""
-        for booking in self.bookings.values():
-            if (booking.resource.id == resource_id and 
-                booking.status in {BookingStatus.CONFIRMED, BookingStatus.PENDING}):
-                return False
-        return True
+    def is_resource_available(self, resource_id: str, start_time: datetime = None, end_time: datetime = None) -> bool:
+        """Check if a specific resource is available, for the given time range if one is passed"""
+        if start_time is None or end_time is None:
+            schedule = self.schedules.get(resource_id)
+            return schedule is None or len(schedule) == 0
+        if is_on_grid(start_time, end_time):
+            day = start_time.date()
+            return not self.occupancy.get((resource_id, day), 0) & slot_mask(day, start_time, end_time)
+        return not any(self._overlapping_bookings(resource_id, start_time, end_time))
 
     def is_room_available(self, room_id: str, start_time: datetime, end_time: datetime, exclude_booking_id: str = None) -> bool:
         """Check if room is available for specified time"""
-        for booking in self.bookings.values():
-            if (booking.resource.id == room_id and 
-                booking.status in {BookingStatus.CONFIRMED, BookingStatus.PENDING} and
-                booking.id != exclude_booking_id and 
-                not (end_time <= booking.start_time or start_time >= booking.end_time)):
+        if self.is_resource_available(room_id, start_time, end_time):
+            return True
+        if exclude_booking_id is None:
+            return False
+        # The bitmap cannot tell the excluded booking apart, so fall back to the interval index
+        for booking in self._overlapping_bookings(room_id, start_time, end_time):
+            if booking.id != exclude_booking_id:
                 return False
         return True
 
@@ -180,7 +1140,7 @@ class BookingSystem:
         resource = self.resources[resource_id]
         start_time, end_time = self.get_time_slot_range(time_slot, booking_date)
         
-        booking_id = str(uuid.uuid4())[:16]
+        booking_id = self._new_booking_id()
         assert len(booking_id) == 16, f"Booking ID {booking_id} if not 16 characters"
 
         check_in_window = timedelta(minutes=30 if resource.type == ResourceType.DESK else 15)
@@ -192,119 +1152,482 @@ class BookingSystem:
             start_time=start_time,
             end_time=end_time,
             status=BookingStatus.PENDING,
-            created_at=datetime.now(),
+            created_at=self.clock(),
             check_in_deadline=start_time + check_in_window,
             coworkers=[self.users[cw_id] for cw_id in (coworker_ids or [])]
         )
         
-        self.bookings[booking_id] = booking
+        self._add_booking(booking)
         self.add_to_request_queue(booking_id)
         
         return booking_id
 
     def process_request_queue(self):
         """Process FIFO request queue"""
-        while self.request_queue:
-            booking_id = self.request_queue.pop(0)
-            print(f"Processing booking ID: {booking_id}")
-            # Check if booking still exists
-            if booking_id not in self.bookings:
-                print(f"Warning: Booking {booking_id} not found in bookings, skipping...")
+        while (booking_id := self._next_request()) is not None:
+            booking = self.bookings.get(booking_id)
+            # Bookings removed, cancelled or expired while queued are dropped, see metrics.Metrics
+            if booking is None or booking.status != BookingStatus.PENDING:
                 continue
 
-            booking = self.bookings[booking_id]
-            
-            if booking.resource.type == ResourceType.DESK:
-                if booking.coworkers: 
-                    group_size = 1 + len(booking.coworkers)
-                    available_groups = self.find_adjacent_desks(group_size, booking.start_time, TimeSlot.FULL_DAY)
-                    if available_groups:
-                        desks = available_groups[0]
-                        booking.resource = desks[0]
-                        booking.status = BookingStatus.CONFIRMED
-                        for i, coworker in enumerate(booking.coworkers,1):
-                            coworker_booking_id = str(uuid.uuid4())[:16]
-                            assert len(coworker_booking_id) == 16, f"Booking ID {coworker_booking_id} is not 16 characters"
-                            coworker_booking = Booking(id=coworker_booking_id,user=coworker,resource=desks[i],start_time=booking.start_time,end_time=booking.end_time,status=BookingStatus.CONFIRMED,created_at=booking.created_at,check_in_deadline=booking.check_in_deadline, coworkers=[])
-                            self.bookings[coworker_booking_id] = coworker_booking
-                    else:
-                        self.add_to_waiting_list(booking_id)
-                else:
-                    if self.is_desk_available():
-                        self.assign_random_desk(booking_id)
-                    else:
-                        self.add_to_waiting_list(booking_id)
-            else:  # Room
-                if self.is_room_available(booking.resource.id, booking.start_time, booking.end_time, exclude_booking_id =booking_id):
-                    booking.status = BookingStatus.CONFIRMED
-                else:
-                    self.add_to_waiting_list(booking_id)
+            self._process_request(booking)
 
-    def calculate_karma_penalty(self, booking: Booking) -> int:
-        current_time = datetime.now()
-        hours_until_booking = (booking.start_time - current_time).total_seconds() / 3600
+    def _process_request(self, booking: Booking) -> bool:
+        """Allocate a single queued booking, returns True if it was confirmed"""
+        if booking.resource.type == ResourceType.DESK:
+            if booking.coworkers:
+                if self._allocate_group(booking):
+                    return True
+            elif self.is_desk_available(booking.start_time, booking.end_time):
+                return self.assign_random_desk(booking.id)
+        else:  # Room
+            if self.is_room_available(booking.resource.id, booking.start_time, booking.end_time, exclude_booking_id =booking.id):
+                self._confirm(booking)
+                return True
+        self.add_to_waiting_list(booking.id)
+        return False
 
-        if hours_until_booking >24:
-            return 0
-        elif hours_until_booking < 0:
-            return 100
-        else:
-            base_penalty = 10
-            additional_penalty = int((24-hours_until_booking) / (16/60))
-            return min(base_penalty + additional_penalty, 100)
+    def _allocate_group(self, booking: Booking) -> bool:
+        """Seat a booking and its coworkers in one desk family"""
+        group_size = 1 + len(booking.coworkers)
+        available_groups = self._find_desk_groups(group_size, booking.start_time, booking.end_time, limit=1)
+        if not available_groups:
+            return False
+        desks = available_groups[0]
+        self._assign_resource(booking, desks[0])
+        self._confirm(booking)
+        for i, coworker in enumerate(booking.coworkers,1):
+            coworker_booking_id = self._new_booking_id()
+            assert len(coworker_booking_id) == 16, f"Booking ID {coworker_booking_id} is not 16 characters"
+            coworker_booking = Booking(id=coworker_booking_id,user=coworker,resource=desks[i],start_time=booking.start_time,end_time=booking.end_time,status=BookingStatus.CONFIRMED,created_at=booking.created_at,check_in_deadline=booking.check_in_deadline, coworkers=[])
+            self._add_booking(coworker_booking)
+        self._count_allocations(len(booking.coworkers))
+        return True
+
+    def process_request_batch(self, max_batch: int = None) -> BatchReport:
+        """Drain the request queue and allocate it in one pass per (day, resource type) group
+
+        Free desk pools are built once per group and kept up to date as desks are handed
+        out, instead of rescanning every desk for every request. Requests inside a group
+        are served in FIFO order.
+        """
+        report = BatchReport()
+        started = perf_counter()
+        groups: Dict[Tuple[date, ResourceType], List[Booking]] = defaultdict(list)
+        while max_batch is None or report.processed + report.skipped < max_batch:
+            booking_id = self._next_request()
+            if booking_id is None:
+                break
+            booking = self.bookings.get(booking_id)
+            if booking is None or booking.status != BookingStatus.PENDING:
+                report.skipped += 1
+                continue
+            report.processed += 1
+            groups[(booking.start_time.date(), booking.resource.type)].append(booking)
+        report.groups = len(groups)
+
+        for (day, resource_type), group in groups.items():
+            if resource_type == ResourceType.DESK:
+                confirmed = self._allocate_desk_batch(day, group)
+            else:
+                confirmed = sum(self._process_request(booking) for booking in group)
+            waitlisted = sum(1 for booking in group if self._is_waitlisted(booking))
+            report.confirmed += confirmed
+            report.waitlisted += waitlisted
+            # Requests another thread cancelled or removed before their shard was locked, see ConcurrentBookingSystem
+            dropped = len(group) - confirmed - waitlisted
+            report.processed -= dropped
+            report.skipped += dropped
+
+        report.elapsed = perf_counter() - started
+        self.last_batch_report = report
+        return report
+
+    def _allocate_desk_batch(self, day: date, group: List[Booking]) -> int:
+        """Assign desks to one day's desk requests from the free desk pools, returns the number confirmed
+
+        Requests are served in arrival order. A group takes the best fitting family
+        when its turn comes, so it never jumps ahead of singles that asked earlier.
+        """
+        confirmed = 0
+        pools: Dict[Tuple[datetime, datetime], Optional[DeskPool]] = {}  # (start, end) -> free desk pool
+        for booking in group:
+            if booking.coworkers:
+                if self._allocate_group(booking):
+                    confirmed += 1
+                else:
+                    self.add_to_waiting_list(booking.id)
+                continue
+            key = (booking.start_time, booking.end_time)
+            if key not in pools:
+                pools[key] = self._desk_pool(booking.start_time, booking.end_time)
+            pool = pools[key]
+            if pool is None:
+                confirmed += self._process_request(booking)
+            elif pool:
+                free_desk_ids = self._desk_choices(booking.start_time, booking.end_time, pool)
+                self._assign_resource(booking, self.resources[self.policy.choose_desk(self, booking, free_desk_ids)])
+                self._confirm(booking)
+                confirmed += 1
+            else:
+                self.add_to_waiting_list(booking.id)
+        return confirmed
+
+    def seat_groups(self, booking_ids: List[str]) -> List[str]:
+        """Seat a batch of group bookings together, returns the IDs that were confirmed
+
+        Largest groups are seated first, each in the family that leaves the fewest
+        free desks behind (best-fit decreasing). Groups that do not fit are waitlisted.
+        """
+        return self._seat_groups([self.bookings[booking_id] for booking_id in booking_ids])
+
+    def _seat_groups(self, bookings: List[Booking]) -> List[str]:
+        order = sorted(range(len(bookings)), key=lambda i: (-len(bookings[i].coworkers or ()), i))
+        confirmed = []
+        for i in order:
+            booking = bookings[i]
+            if self._allocate_group(booking):
+                confirmed.append(booking.id)
+            else:
+                self.add_to_waiting_list(booking.id)
+        return confirmed
+
+    def calculate_karma_penalty(self, booking: Booking, now: datetime = None) -> int:
+        return karma_penalty(booking.start_time, now or self.clock())
     
     def process_cancellation(self, booking_id: str):
         booking = self.bookings[booking_id]
         penalty = self.calculate_karma_penalty(booking)
-        booking.user.deduct_karma(penalty)
-        booking.status = BookingStatus.CANCELLED
+        self._deduct_karma(booking.user, penalty)
+        self._remove_from_waiting_lists(booking)
+        self._set_status(booking, BookingStatus.CANCELLED)
+        self._promote_waiters(booking.resource.id, booking.start_time, booking.end_time)
+
+    def cancel_bookings(self, booking_ids: List[str], now: datetime = None, penalize: bool = True,
+                        promote: bool = True) -> CancellationReport:
+        """Cancel many bookings as one operation
+
+        Penalties are computed against one reference time, once per distinct start
+        time, and each user is charged their total in a single deduction. Waiting
+        lists are re-evaluated once per freed stretch of each resource after all
+        cancellations are in, instead of after every one. Pass penalize=False to
+        waive penalties, and promote=False when the freed resources are themselves
+        unavailable, e.g. a closed floor.
+        """
+        started = perf_counter()
+        now = now or self.clock()
+        report = CancellationReport()
+        by_user: Dict[str, List[Booking]] = defaultdict(list)
+        for booking_id in booking_ids:
+            booking = self.bookings.get(booking_id)
+            if booking is not None and booking.status in ACTIVE_STATUSES:
+                by_user[booking.user.id].append(booking)
+        penalties: Dict[datetime, int] = {}
+        if penalize:
+            for bookings in by_user.values():
+                for booking in bookings:
+                    if booking.start_time not in penalties:
+                        penalties[booking.start_time] = karma_penalty(booking.start_time, now)
+        freed: Dict[str, List[Tuple[datetime, datetime]]] = defaultdict(list)
+        for user_id, bookings in by_user.items():
+            total = sum(penalties.get(booking.start_time, 0) for booking in bookings)
+            if penalize:
+                user = bookings[0].user
+                karma_before = user.karma_points
+                self._deduct_karma(user, total)
+                report.karma[user_id] = karma_before - user.karma_points
+            for booking in bookings:
+                if not self._remove_from_waiting_lists(booking):
+                    freed[booking.resource.id].append((booking.start_time, booking.end_time))
+                self._set_status(booking, BookingStatus.CANCELLED)
+                report.cancelled.append(booking.id)
+        if promote:
+            for resource_id, intervals in freed.items():
+                for start_time, end_time in merge_intervals(intervals):
+                    report.promoted += self._promote_waiters(resource_id, start_time, end_time)
+        report.elapsed = perf_counter() - started
+        return report
+
+    def cancel_matching(self, booking_date: datetime = None, location: str = None, resource_type: ResourceType = None,
+                        desk_family: str = None, now: datetime = None, penalize: bool = False,
+                        promote: bool = True) -> CancellationReport:
+        """Cancel every active booking matching all the filters given, e.g. for an office closure
+
+        Penalties are waived unless penalize=True, see cancel_bookings.
+        """
+        booking_ids = self._matching_bookings(booking_date, location, resource_type, desk_family)
+        return self.cancel_bookings(booking_ids, now, penalize, promote)
+
+    def _matching_bookings(self, booking_date: datetime = None, location: str = None,
+                           resource_type: ResourceType = None, desk_family: str = None) -> List[str]:
+        if booking_date is not None:
+            candidates = self.bookings_by_date.get(booking_date.date() if isinstance(booking_date, datetime) else booking_date, ())
+        else:
+            candidates = [b for status in ACTIVE_STATUSES for b in self.bookings_by_status.get(status, ())]
+        matching = []
+        for booking_id in candidates:
+            booking = self.bookings[booking_id]
+            resource = booking.resource
+            if (booking.status in ACTIVE_STATUSES
+                    and (location is None or resource.location == location)
+                    and (resource_type is None or resource.type == resource_type)
+                    and (desk_family is None or resource.desk_family == desk_family)):
+                matching.append(booking_id)
+        return matching
 
     def start_check_in_timer(self, booking_id: str):
         booking = self.bookings[booking_id]
-        booking.check_in_deadline = datetime.now() + timedelta( minutes = 30 if booking.resource.type == ResourceType.DESK else 15)
+        self._set_check_in_deadline(booking, self.clock() + timedelta( minutes = 30 if booking.resource.type == ResourceType.DESK else 15))
+
+    def _set_check_in_deadline(self, booking: Booking, deadline: datetime):
+        booking.check_in_deadline = deadline
+        if booking.status in ACTIVE_STATUSES and booking.id not in self.checked_in:
+            self.check_in_deadlines.schedule(booking.id, deadline)
+        self._log("deadline", booking.id, deadline)
 
     def check_in_user(self, booking_id: str):
+        """Record the holder's arrival, or release the booking once its deadline has passed
+
+        Checking in leaves the status alone: a queued booking is still allocated as
+        usual and a confirmed one keeps its resource, both just stop being due for
+        expiry. Waitlisted and finished bookings hold nothing to check in to.
+        """
         booking = self.bookings[booking_id]
-        if datetime.now() <= booking.check_in_deadline:
-            booking.status = BookingStatus.CONFIRMED
+        if booking.status not in ACTIVE_STATUSES or self._is_waitlisted(booking):
+            return False
+        if self.clock() <= booking.check_in_deadline:
+            self._check_in(booking)
             return True
         else:
             self.release_resource(booking_id)
             return False
-        
-    def find_adjacent_desks(self, desk_count: int, booking_date: datetime, time_slot: TimeSlot) -> List[List[Resource]]:
-        available_groups = []
-        start_time, end_time, = self.get_time_slot_range(time_slot, booking_date)
 
-        # Group desks by family
-        families = defaultdict(list)
-        for resource in self.resources.values():
-            if resource.type == ResourceType.DESK:
-                families[resource.desk_family].append(resource)
-
-        # Check each family for enough available desks
-        for family, family_desks in families.items():
-            if len(family_desks) >= desk_count:
-                available_desks = [
-                    desk for desk in family_desks
-                    if not any(
-                        b.resource.id == desk.id and 
-                        b.status in {BookingStatus.CONFIRMED, BookingStatus.PENDING} and
-                        not (end_time <= b.start_time or start_time >= b.end_time)
-                        for b in self.bookings.values()
-                    )
-                ]
-                if len(available_desks) >= desk_count:
-                    available_groups.append(available_desks[:desk_count])
+    def _check_in(self, booking: Booking):
+        self.checked_in.add(booking.id)
+        self.check_in_deadlines.cancel(booking.id)
+        self._log("check_in", booking.id)
+
+    def release_resource(self, booking_id: str, now: datetime = None):
+        """Mark a no-show booking as MISSED, free its resource and promote waiters
+
+        Bookings that were still on a waiting list never held a resource, so they
+        are dropped from the list without a karma penalty.
+        """
+        booking = self.bookings[booking_id]
+        if booking.status not in ACTIVE_STATUSES:
+            return
+        was_waiting = self._remove_from_waiting_lists(booking)
+        if not was_waiting:
+            self._deduct_karma(booking.user, self.calculate_karma_penalty(booking, now))
+        self._set_status(booking, BookingStatus.MISSED)
+        self._promote_waiters(booking.resource.id, booking.start_time, booking.end_time)
+
+    def tick(self, now: datetime = None) -> List[str]:
+        """Expire every active booking nobody checked in to by its deadline, returns their IDs
+
+        Only bookings that are due are touched, so this is cheap enough to call
+        every few seconds.
+        """
+        now = now or self.clock()
+        expired = []
+        for booking_id in self._expired_deadlines(now):
+            booking = self.bookings.get(booking_id)
+            if booking is not None and booking.status in ACTIVE_STATUSES and booking_id not in self.checked_in:
+                self.release_resource(booking_id, now)
+                expired.append(booking_id)
+        return expired
+
+    def _expired_deadlines(self, now: datetime) -> List[str]:
+        return self.check_in_deadlines.pop_expired(now)
+
+    def _promote_waiters(self, resource_id: str, start_time: datetime, end_time: datetime) -> List[str]:
+        """Hand a freed interval on a resource to waiting bookings, returns the promoted booking IDs
+
+        Only waiters whose time range overlaps the freed interval are looked at, best
+        karma first, and every one that now fits is confirmed. Waiters that still do
+        not fit stay on their waiting list.
+        """
+        resource = self.resources[resource_id]
+        if resource.type == ResourceType.DESK:
+            waiting_index = self.desk_waiting_index
+        else:
+            waiting_index = self.room_waiting_index.get(resource_id)
+        if not waiting_index or not waiting_index.buckets:
+            return []
+        promoted = []
+        # Best waiter of every overlapping bucket, the rest of a bucket only gets a turn if its head is served
+        heads = [(bucket.peek(), i, bucket) for i, bucket in enumerate(self._waiting_buckets(waiting_index, start_time, end_time))]
+        heapq.heapify(heads)
+        freed_mask = slot_mask(start_time.date(), start_time, end_time) if is_on_grid(start_time, end_time) else 0
+
+        while heads:
+            (_, _, booking_id), i, bucket = heapq.heappop(heads)
+            waiting_booking = self.bookings[booking_id]
+            if waiting_booking.coworkers:
+                # A group only newly fits if the freed desk's family now has room for all of it
+                if (self._free_in_family(resource, waiting_booking.start_time, waiting_booking.end_time) <= len(waiting_booking.coworkers)
+                        or not self._allocate_group(waiting_booking)):
+                    continue
+            elif self._is_free_for_waiter(resource_id, waiting_booking):
+                self._assign_resource(waiting_booking, resource)
+                self._confirm(waiting_booking)
+            else:
+                continue
+            self._remove_from_waiting_lists(waiting_booking)
+            promoted.append(booking_id)
+            if bucket:
+                heapq.heappush(heads, (bucket.peek(), i, bucket))
+            if freed_mask and self._held_mask(resource_id, start_time, end_time) & freed_mask == freed_mask:
+                break  # the freed time is taken again, nobody else can use it
+        return promoted
+
+    def _waiting_buckets(self, waiting_index: WaitingIndex, start_time: datetime, end_time: datetime) -> List[WaitingList]:
+        return waiting_index.overlapping(start_time, end_time)
+
+    def _free_in_family(self, desk: Resource, start_time: datetime, end_time: datetime) -> int:
+        key = self._slot_key(start_time, end_time)
+        if key is not None:
+            return len(self.family_pools[key].get(desk.desk_family, ()))
+        return sum(
+            1 for resource in self.desk_families.get(desk.desk_family, ())
+            if self.is_resource_available(resource.id, start_time, end_time)
+        )
+
+    def _held_mask(self, resource_id: str, start_time: datetime, end_time: datetime) -> int:
+        """Grid slots of the range that are held by bookings other than waiters"""
+        day = start_time.date()
+        mask = 0
+        for other in self._overlapping_bookings(resource_id, start_time, end_time):
+            if not self._is_waitlisted(other):
+                mask |= slot_mask(day, other.start_time, other.end_time)
+        return mask
+
+    def _is_free_for_waiter(self, resource_id: str, waiting_booking: Booking) -> bool:
+        """True if nothing but other waiters holds the resource during the waiting booking's time"""
+        for other in self._overlapping_bookings(resource_id, waiting_booking.start_time, waiting_booking.end_time):
+            if other.id != waiting_booking.id and not self._is_waitlisted(other):
+                return False
+        return True
 
+    def find_adjacent_desks(self, desk_count: int, booking_date: datetime, time_slot: TimeSlot, limit: int = None) -> List[List[Resource]]:
+        """Groups of desk_count free desks sharing a family, best fitting family first
+
+        Families are ranked by how few free desks they have left (best fit), so large
+        families stay whole for large groups. `limit` keeps only the top candidates.
+        """
+        start_time, end_time, = self.get_time_slot_range(time_slot, booking_date)
+        return self._find_desk_groups(desk_count, start_time, end_time, limit)
+
+    def _find_desk_groups(self, desk_count: int, start_time: datetime, end_time: datetime, limit: int = None) -> List[List[Resource]]:
+        key = self._slot_key(start_time, end_time)
+        if key is not None:
+            family_pools = self.family_pools[key]
+            free_counts = [
+                (len(pool), i, family) for i, (family, pool) in enumerate(family_pools.items())
+                if len(pool) >= desk_count
+            ]
+        else:
+            # Not a TimeSlot range, so there are no pools to read the free counts from
+            family_pools = {}
+            for family, desks in self.desk_families.items():
+                free = [desk.id for desk in desks if self.is_resource_available(desk.id, start_time, end_time)]
+                family_pools[family] = DeskPool(free)
+            free_counts = [
+                (len(pool), i, family) for i, (family, pool) in enumerate(family_pools.items())
+                if len(pool) >= desk_count
+            ]
+        available_groups = []
+        for family in self.policy.rank_families(desk_count, free_counts, limit):
+            pool = family_pools[family]
+            desks = [desk for desk in self.desk_families[family] if desk.id in pool]
+            available_groups.append(desks[:desk_count])
         return available_groups
 
 
+    def book_bulk(self, requests: List[BookingRequest], atomic: bool = True) -> BulkReport:
+        """Confirm many bookings on the resources they name, checking every conflict in one sweep
+
+        Requests are checked against the bookings already holding their resources
+        and against each other, in one pass over the requests sorted by resource and
+        start time. With atomic=True nothing is booked unless every request passes;
+        otherwise the ones that pass are booked and the rest reported per item.
+        Bookings skip the request queue and are stored and indexed in one go.
+        """
+        started = perf_counter()
+        report = BulkReport(booking_ids=[None] * len(requests))
+        accepted = []
+        previous_resource, latest_end = None, None
+        for i in sorted(range(len(requests)), key=lambda i: (requests[i].resource_id, requests[i].start_time)):
+            request = requests[i]
+            reason = self._bulk_problem(request)
+            if reason is None and request.resource_id == previous_resource and request.start_time < latest_end:
+                reason = "overlaps another request in the batch"
+            if reason is None and not self.is_resource_available(request.resource_id, request.start_time, request.end_time):
+                reason = f"{request.resource_id} is already booked"
+            if reason is not None:
+                report.failures[i] = reason
+                continue
+            if request.resource_id != previous_resource:
+                previous_resource, latest_end = request.resource_id, request.end_time
+            else:
+                latest_end = max(latest_end, request.end_time)
+            accepted.append(i)
+
+        if not (atomic and report.failures):
+            now = self.clock()
+            bookings = []
+            for i, booking_id in zip(accepted, self._new_booking_ids(len(accepted))):
+                request = requests[i]
+                resource = self.resources[request.resource_id]
+                check_in_window = timedelta(minutes=30 if resource.type == ResourceType.DESK else 15)
+                bookings.append(Booking(booking_id, self.users[request.user_id], resource, request.start_time,
+                                        request.end_time, BookingStatus.CONFIRMED, now,
+                                        request.start_time + check_in_window, []))
+                report.booking_ids[i] = booking_id
+            self._add_bookings(bookings)
+            self._count_allocations(len(bookings))
+            report.committed = True
+        report.elapsed = perf_counter() - started
+        return report
+
+    def book_recurring(self, user_id: str, resource_id: str, start_time: datetime, end_time: datetime, until: date,
+                       weekdays: Set[int] = None, atomic: bool = True) -> BulkReport:
+        """book_bulk for every occurrence of a weekly pattern, see recurrence()"""
+        return self.book_bulk(recurrence(user_id, resource_id, start_time, end_time, until, weekdays), atomic)
+
+    def _bulk_problem(self, request: BookingRequest) -> Optional[str]:
+        """Why a bulk request can never be booked, or None"""
+        if request.user_id not in self.users:
+            return f"unknown user {request.user_id}"
+        resource = self.resources.get(request.resource_id)
+        if resource is None:
+            return f"unknown resource {request.resource_id}"
+        if request.end_time <= request.start_time:
+            return "ends before it starts"
+        if resource.type == ResourceType.ROOM:
+            try:
+                self._check_room_times(request.start_time, request.end_time)
+            except ValueError as error:
+                return str(error)
+        return None
+
+    @staticmethod
+    def _new_booking_id() -> str:
+        """Random 16 character booking ID, replay.Replay hands out sequential ones instead"""
+        return str(uuid.uuid4())[:16]
+
+    @staticmethod
+    def _new_booking_ids(count: int) -> List[str]:
+        """`count` random 16 character booking IDs from a single read of the OS random source"""
+        digits = os.urandom(8 * count).hex()
+        return [digits[i:i + 16] for i in range(0, 16 * count, 16)]
+
     def get_valid_room_times(self, date: datetime) -> List[datetime]:
         base_time = datetime.combine(date.date(), datetime.min.time().replace(hour=9))
         return [base_time + timedelta(minutes=30*i) for i in range(19)]  # 9:00 to 18:00
 
-    def request_room_booking(self, user_id: str, room_id: str, start_time: datetime, end_time: datetime) -> str:
+    @staticmethod
+    def _check_room_times(start_time: datetime, end_time: datetime):
         # Validate time slots
         if not (start_time.minute in {0, 30} and end_time.minute in {0, 30}):
             raise ValueError("Bookings must start and end on hour or half-hour")
@@ -314,10 +1637,13 @@ class BookingSystem:
     
         if (end_time - start_time).seconds > 32400:  # 9 hours (9am-6pm)
             raise ValueError("Booking cannot exceed 9 hours")
+
+    def request_room_booking(self, user_id: str, room_id: str, start_time: datetime, end_time: datetime) -> str:
+        self._check_room_times(start_time, end_time)
         
         user = self.users[user_id]
         resource = self.resources[room_id]
-        booking_id = str(uuid.uuid4())[:16]
+        booking_id = self._new_booking_id()
         assert len(booking_id) == 16, f"Booking ID {booking_id} is not 16 characters"
     
         booking = Booking(
@@ -327,46 +1653,19 @@ class BookingSystem:
             start_time=start_time,
             end_time=end_time,
             status=BookingStatus.PENDING,
-            created_at=datetime.now(),
+            created_at=self.clock(),
             check_in_deadline=start_time + timedelta(minutes=15),
             coworkers=[]
         )
     
-        self.bookings[booking_id] = booking
+        self._add_booking(booking)
         self.add_to_request_queue(booking_id)
-    
-        print(f"Created booking with ID: {booking_id}")
         return booking_id
         
     def process_room_cancellation(self, booking_id: str):
-        cancelled_booking = self.bookings[booking_id]
-        room_id = cancelled_booking.resource.id
-        cancelled_time = TimeRange(cancelled_booking.start_time, cancelled_booking.end_time)
-    
-        # Apply karma penalty and mark as cancelled
-        penalty = self.calculate_karma_penalty(cancelled_booking)
-        cancelled_booking.user.deduct_karma(penalty)
-        cancelled_booking.status = BookingStatus.CANCELLED
-    
-        # Check waiting list for this room
-        waiting_list = self.room_waiting_lists[room_id]
-    
-        while waiting_list:
-            # Get highest priority booking from waiting list
-            _, _, waiting_booking_id = heapq.heappop(waiting_list)
-            waiting_booking = self.bookings[waiting_booking_id]
-            waiting_time = TimeRange(waiting_booking.start_time, waiting_booking.end_time)
-
-            # Check if this booking's time slot is now fully available, excluding itself
-            if not any(
-                TimeRange(b.start_time, b.end_time).overlaps(waiting_time)
-                for b in self.bookings.values()
-                if b.resource.id == room_id 
-                and b.status in {BookingStatus.CONFIRMED, BookingStatus.PENDING}
-                and b.id != waiting_booking_id # Exclude self
-            ):
-                waiting_booking.status = BookingStatus.CONFIRMED
-                break
+        """Cancel a room booking, then confirm every waiting booking that now fits"""
+        self.process_cancellation(booking_id)
+
     '''     
     def print_booking_status(self):
         """Print the current status of all bookings for all resources"""
@@ -444,9 +1743,8 @@ def create_test_system():
     for i in range(1, 33):  # Create 32 users (enough for all tests)
         users.append(User(f"u{i}", f"User{i}", f"user{i}@company.com"))
 
-    for user in users:
-        system.add_user(user)
-        
+    system.add_users(users)
+
     random.seed(42)
     
     # Add 30 desks (6 desk families with 5 desks each)
@@ -466,9 +1764,8 @@ def create_test_system():
         )
     
     # Add all resources to the system
-    for resource in desks + rooms:
-        system.add_resource(resource)
-        
+    system.add_resources(desks + rooms)
+
     return system
 
 def run_tests():
@@ -601,14 +1898,304 @@ def run_tests():
     # Check all related bookings 
     family = booking.resource.desk_family
     group_bookings = [
-        b for b in system.bookings.values()
-        if b.user.id in {"u1", "u2", "u3"} and b.start_time == booking.start_time
+        b for user_id in ("u1", "u2", "u3") for b in system.get_user_bookings(user_id)
+        if b.start_time == booking.start_time
     ]
     assert len(group_bookings) == 3
     assert all(b.status == BookingStatus.CONFIRMED for b in group_bookings)
     assert all(b.resource.desk_family == family for b in group_bookings)
     print("Desk family group booking test passed!")
 
+    print("\n=== TEST 12: Interval Index Overlap Queries ===")
+    system = create_test_system()
+    room_start = datetime.combine(booking_date.date(), datetime.min.time().replace(hour=9))
+    booking_id12 = system.request_room_booking("u1", "r2", room_start + timedelta(hours=1), room_start + timedelta(hours=3))
+    system.process_request_queue()
+    assert not system.is_room_available("r2", room_start + timedelta(hours=2), room_start + timedelta(hours=4))
+    assert system.is_room_available("r2", room_start, room_start + timedelta(hours=1))
+    assert system.is_room_available("r2", room_start + timedelta(hours=3), room_start + timedelta(hours=4))
+    system.process_cancellation(booking_id12)
+    assert system.is_room_available("r2", room_start + timedelta(hours=2), room_start + timedelta(hours=4))
+    print("Interval index test passed!")
+
+    print("\n=== TEST 13: Slot Bitmap Desk Availability ===")
+    system = create_test_system()
+    morning_id = system.request_booking("u1", "d1", booking_date, TimeSlot.MORNING)
+    system.process_request_queue()
+    morning_desk = system.bookings[morning_id].resource
+    afternoon_free = system.free_desks(booking_date, TimeSlot.AFTERNOON)
+    assert morning_desk in afternoon_free
+    assert morning_desk not in system.free_desks(booking_date, TimeSlot.MORNING)
+    assert morning_desk in system.free_desks(booking_date + timedelta(days=1), TimeSlot.FULL_DAY)
+    print("Slot bitmap test passed!")
+
+    print("\n=== TEST 14: Waiting List Removal By Booking ID ===")
+    waiting_list = WaitingList()
+    waiting_list.push(900, current_time, "b1")
+    waiting_list.push(950, current_time, "b2")
+    waiting_list.push(900, current_time + timedelta(seconds=1), "b3")
+    assert waiting_list[0][2] == "b2"
+    assert waiting_list.remove("b2") and not waiting_list.remove("b2")
+    assert "b2" not in waiting_list and len(waiting_list) == 2
+    assert [waiting_list.pop()[2], waiting_list.pop()[2]] == ["b1", "b3"]
+    assert not waiting_list
+    print("Waiting list removal test passed!")
+
+    print("\n=== TEST 15: Batched Request Processing ===")
+    system = create_test_system()
+    assert system.last_batch_report is None
+    for i in range(20):
+        system.request_booking(f"u{i+1}", "d1", booking_date, TimeSlot.MORNING)
+        system.request_booking(f"u{i+1}", "d1", booking_date, TimeSlot.AFTERNOON)
+    for i in range(5):
+        system.request_booking(f"u{i+21}", "d1", booking_date, TimeSlot.FULL_DAY)
+    report = system.process_request_batch()
+    assert report.processed == 45 and report.confirmed == 45 and report.waitlisted == 0  # 30 desks fit all of them
+    assert len(system.request_queue) == 0 and system.last_batch_report is report
+    confirmed = [b for b in system.bookings.values() if b.status == BookingStatus.CONFIRMED]
+    assert len(confirmed) == report.confirmed and not system.desk_waiting_list
+    for a in confirmed:
+        for b in confirmed:
+            if a is not b and a.resource.id == b.resource.id:
+                assert not TimeRange(a.start_time, a.end_time).overlaps(TimeRange(b.start_time, b.end_time))
+    print(f"Batch of {report.processed} requests at {report.throughput:.0f} requests/s")
+    print("Batched request processing test passed!")
+
+    print("\n=== TEST 16: Seeded Free Desk Pools ===")
+    assigned = []
+    for _ in range(2):
+        system = BookingSystem(seed=7)
+        for resource in create_test_system().resources.values():
+            system.add_resource(resource)
+        system.add_user(User("u1", "User1", "user1@company.com"))
+        ids = [system.request_booking("u1", "d1", booking_date, TimeSlot.AFTERNOON) for _ in range(5)]
+        system.process_request_batch()
+        assigned.append([system.bookings[b].resource.id for b in ids])
+    assert assigned[0] == assigned[1]
+    pool = system.desk_pools[(booking_date.date(), TimeSlot.AFTERNOON)]
+    free_before = len(pool)
+    system.process_cancellation(ids[0])
+    assert len(pool) == free_before + 1 and assigned[1][0] in pool
+    # A queued request holds no desk, so the desk it names is still free for it
+    for process in ("process_request_queue", "process_request_batch"):
+        crowded = create_test_system()
+        named = [crowded.request_booking(f"u{i + 1}", "d1", booking_date, TimeSlot.FULL_DAY) for i in range(30)]
+        assert len(crowded.free_desks(booking_date, TimeSlot.FULL_DAY)) == 30
+        getattr(crowded, process)()
+        assert all(crowded.bookings[b].status == BookingStatus.CONFIRMED for b in named) and not crowded.desk_waiting_list
+        assert len({crowded.bookings[b].resource.id for b in named}) == 30
+    print("Seeded free desk pool test passed!")
+
+    print("\n=== TEST 17: Secondary Booking Indexes ===")
+    assert {b.id for b in system.get_user_bookings("u1")} == set(ids)
+    assert [b.id for b in system.get_user_bookings("u1", BookingStatus.CANCELLED)] == [ids[0]]
+    assert len(system.get_bookings_by_status(BookingStatus.CONFIRMED)) == 4
+    assert [b.id for b in system.get_resource_bookings(assigned[1][1], booking_date)] == [ids[1]]
+    assert len(system.get_bookings_on(booking_date)) == 5
+    system.clear_all_desk_bookings()
+    assert not system.bookings and not system.bookings_by_user and not system.get_bookings_on(booking_date)
+    print("Secondary index test passed!")
+
+    print("\n=== TEST 18: Check-in Deadline Expiry ===")
+    system = create_test_system()
+    no_show_id = system.request_booking("u4", "d4", booking_date, TimeSlot.MORNING)
+    late_id = system.request_booking("u5", "d5", booking_date, TimeSlot.AFTERNOON)
+    deadline = system.bookings[no_show_id].check_in_deadline
+    assert system.tick(deadline - timedelta(minutes=1)) == []
+    assert system.tick(deadline) == [no_show_id]
+    assert system.bookings[no_show_id].status == BookingStatus.MISSED
+    assert system.users["u4"].karma_points == 900
+    assert system.is_resource_available("d4", *system.get_time_slot_range(TimeSlot.MORNING, booking_date))
+    assert system.bookings[late_id].status == BookingStatus.PENDING
+    assert system.tick(system.bookings[late_id].check_in_deadline + timedelta(hours=1)) == [late_id]
+    assert len(system.check_in_deadlines) == 0
+    # Expired while still queued: the queue pass must not hand them a desk afterwards
+    system.process_request_queue()
+    assert system.bookings[no_show_id].status == BookingStatus.MISSED and system.bookings[no_show_id].resource.id == "d4"
+    assert system.bookings[late_id].status == BookingStatus.MISSED and not system.request_queue
+    # Allocated bookings keep their deadline until someone checks in
+    allocated_id = system.request_booking("u6", "d6", booking_date, TimeSlot.MORNING)
+    arrived_id = system.request_booking("u7", "d7", booking_date, TimeSlot.MORNING)
+    system.process_request_queue()
+    assert system.bookings[allocated_id].status == BookingStatus.CONFIRMED and allocated_id in system.check_in_deadlines
+    system.clock = lambda: system.bookings[arrived_id].check_in_deadline - timedelta(minutes=5)
+    assert system.check_in_user(arrived_id) and arrived_id not in system.check_in_deadlines
+    assert system.tick(deadline) == [allocated_id]
+    assert system.bookings[allocated_id].status == BookingStatus.MISSED and system.users["u6"].karma_points == 900
+    assert not system.is_resource_available(system.bookings[arrived_id].resource.id, *system.get_time_slot_range(TimeSlot.MORNING, booking_date))
+    assert system.bookings[arrived_id].status == BookingStatus.CONFIRMED and len(system.check_in_deadlines) == 0
+    print("Check-in deadline expiry test passed!")
+
+    print("\n=== TEST 19: Promoting Several Waiters From One Cancellation ===")
+    system = create_test_system()
+    room_start = datetime.combine(booking_date.date(), datetime.min.time().replace(hour=9))
+    long_id = system.request_room_booking("u1", "r3", room_start, room_start + timedelta(hours=4))
+    system.process_request_queue()
+    short_ids = [
+        system.request_room_booking(f"u{i+2}", "r3", room_start + timedelta(hours=i), room_start + timedelta(hours=i+1))
+        for i in range(3)
+    ]
+    overlapping_id = system.request_room_booking("u9", "r3", room_start, room_start + timedelta(hours=2))
+    system.users["u9"].karma_points = 500
+    system.process_request_queue()
+    assert len(system.room_waiting_lists["r3"]) == 4
+    system.process_room_cancellation(long_id)
+    assert all(system.bookings[b].status == BookingStatus.CONFIRMED for b in short_ids)
+    assert system.bookings[overlapping_id].status == BookingStatus.PENDING
+    assert system.room_waiting_lists["r3"][0][2] == overlapping_id
+
+    # Fill the desks one request at a time until full day requests start waiting
+    desk_ids = []
+    while not system.desk_waiting_list:
+        desk_ids.append(system.request_booking(f"u{len(desk_ids) % 20 + 11}", "d1", booking_date, TimeSlot.FULL_DAY))
+        system.process_request_queue()
+    desk_waiting_id = system.request_booking("u10", "d1", booking_date, TimeSlot.MORNING)
+    system.users["u10"].karma_points = 2000
+    system.process_request_queue()
+    assert desk_waiting_id in system.desk_waiting_list
+    freed_desk = system.bookings[desk_ids[0]].resource.id
+    system.process_cancellation(desk_ids[0])
+    assert system.bookings[desk_waiting_id].status == BookingStatus.CONFIRMED
+    assert system.bookings[desk_waiting_id].resource.id == freed_desk
+    # The full day waiter needs the whole day, so it only gets the desk once the morning is free again
+    assert desk_ids[-1] in system.desk_waiting_list
+    system.process_cancellation(desk_waiting_id)
+    assert system.bookings[desk_ids[-1]].status == BookingStatus.CONFIRMED
+    assert system.bookings[desk_ids[-1]].resource.id == freed_desk and not system.desk_waiting_list
+
+    # Waiters hold nothing while they wait, so a freed desk other than the one named still goes to them
+    single = system.request_booking("u12", "d1", booking_date, TimeSlot.FULL_DAY)
+    group = system.request_booking("u13", "d2", booking_date, TimeSlot.FULL_DAY, coworker_ids=["u14"])
+    system.process_request_queue()
+    assert single in system.desk_waiting_list and group in system.desk_waiting_list
+    seated = {system.bookings[b].resource.id: b for b in desk_ids if system.bookings[b].status == BookingStatus.CONFIRMED}
+    system.process_cancellation(seated["d30"])
+    assert system.bookings[single].status == BookingStatus.CONFIRMED and system.bookings[single].resource.id == "d30"
+    # The group only fits once a second desk in the same family is free
+    system.process_cancellation(seated["d21"])
+    assert group in system.desk_waiting_list
+    system.process_cancellation(seated["d22"])
+    assert system.bookings[group].status == BookingStatus.CONFIRMED and not system.desk_waiting_list
+    assert system.bookings[group].resource.id in ("d21", "d22")
+    print("Waitlist promotion test passed!")
+
+    print("\n=== TEST 20: Compact Booking Storage ===")
+    system = BookingSystem(compact=True)
+    for user in create_test_system().users.values():
+        system.add_user(user)
+    for resource in create_test_system().resources.values():
+        system.add_resource(resource)
+    compact_id = system.request_booking("u1", "d1", booking_date, TimeSlot.MORNING, coworker_ids=["u2"])
+    room_start = datetime.combine(booking_date.date(), datetime.min.time().replace(hour=9))
+    room_id = system.request_room_booking("u3", "r1", room_start, room_start + timedelta(hours=1))
+    system.process_request_queue()
+    record = system.bookings[compact_id]
+    assert isinstance(record, BookingRecord) and record.status == BookingStatus.CONFIRMED
+    assert record.start_time == room_start and [u.id for u in record.coworkers] == ["u2"]
+    assert record.start_time is system.bookings[room_id].start_time  # times are shared, not rebuilt per read
+    assert record.check_in_deadline is system.bookings[compact_id].check_in_deadline
+    assert len(system.get_resource_bookings(record.resource.id, booking_date)) == 1
+    system.process_room_cancellation(room_id)
+    assert system.bookings[room_id].status == BookingStatus.CANCELLED
+    system.remove_booking(room_id)
+    assert room_id not in system.bookings and len(system.bookings) == 2
+    # Desk times off the minute, as book_bulk and synced edits allow, are kept to the microsecond
+    odd_start = room_start.replace(second=30, microsecond=250)
+    report = system.book_bulk([BookingRequest("u4", "d5", odd_start, odd_start + timedelta(hours=2, seconds=15))])
+    odd = system.bookings[report.booking_ids[0]]
+    assert odd.start_time == odd_start and odd.end_time == odd_start + timedelta(hours=2, seconds=15)
+    odd.end_time = odd.end_time + timedelta(microseconds=1)
+    assert odd.to_booking().end_time == odd_start + timedelta(hours=2, seconds=15, microseconds=1)
+    print("Compact booking storage test passed!")
+
+    print("\n=== TEST 21: Best-fit Group Seating ===")
+    system = create_test_system()
+    # Leave family1 with 2 free desks and family2 with 4, everything else full
+    for desk_id in [f"d{i}" for i in range(1, 31) if i not in (1, 2, 6, 7, 8, 9)]:
+        system._add_booking(Booking(desk_id, system.users["u32"], system.resources[desk_id],
+                                    *system.get_time_slot_range(TimeSlot.AFTERNOON, booking_date),
+                                    BookingStatus.CONFIRMED, current_time, current_time))
+    assert [g[0].desk_family for g in system.find_adjacent_desks(2, booking_date, TimeSlot.AFTERNOON)] == ["family1", "family2"]
+    assert len(system.find_adjacent_desks(2, booking_date, TimeSlot.AFTERNOON, limit=1)) == 1
+    assert len(system.find_adjacent_desks(2, booking_date, TimeSlot.MORNING)) == 6
+    pair = system.request_booking("u1", "d30", booking_date, TimeSlot.AFTERNOON, coworker_ids=["u2"])
+    team = system.request_booking("u3", "d30", booking_date, TimeSlot.AFTERNOON, coworker_ids=["u4", "u5", "u6"])
+    report = system.process_request_batch()
+    assert report.confirmed == 2
+    assert system.bookings[team].resource.desk_family == "family2"
+    assert system.bookings[pair].resource.desk_family == "family1"
+    # A batch keeps arrival order, a single that asked first is not pushed out by a later group
+    for desk_id in [f"d{i}" for i in range(3, 31)]:
+        system._add_booking(Booking(f"m{desk_id}", system.users["u32"], system.resources[desk_id],
+                                    *system.get_time_slot_range(TimeSlot.MORNING, booking_date),
+                                    BookingStatus.CONFIRMED, current_time, current_time))
+    single = system.request_booking("u7", "d1", booking_date, TimeSlot.MORNING)
+    late_pair = system.request_booking("u8", "d1", booking_date, TimeSlot.MORNING, coworker_ids=["u9"])
+    report = system.process_request_batch()
+    assert report.confirmed == 1 and report.waitlisted == 1
+    assert system.bookings[single].status == BookingStatus.CONFIRMED and late_pair in system.desk_waiting_list
+    print("Best-fit group seating test passed!")
+
+    print("\n=== TEST 22: Bulk And Recurring Bookings ===")
+    system = create_test_system()
+    monday = datetime.combine(booking_date.date() + timedelta(days=7 - booking_date.weekday()), datetime.min.time())
+    tuesday_ten = monday + timedelta(days=1, hours=10)
+    until = (monday + timedelta(days=27)).date()
+    taken = system.request_room_booking("u2", "r4", tuesday_ten + timedelta(days=14), tuesday_ten + timedelta(days=14, hours=1))
+    report = system.book_recurring("u1", "r4", tuesday_ten, tuesday_ten + timedelta(hours=1), until, weekdays={1, 3})
+    assert not report.committed and list(report.failures) == [4] and report.booked == 0
+    assert len(system.bookings) == 1
+    report = system.book_recurring("u1", "r4", tuesday_ten, tuesday_ten + timedelta(hours=1), until, weekdays={1, 3}, atomic=False)
+    assert report.committed and report.booked == 7 and report.booking_ids[4] is None
+    assert all(system.bookings[b].status == BookingStatus.CONFIRMED for b in report.booking_ids if b)
+    assert not system.is_room_available("r4", tuesday_ten + timedelta(days=2), tuesday_ten + timedelta(days=2, hours=1))
+    assert system.bookings[taken].status == BookingStatus.PENDING
+    assignments = [BookingRequest(f"u{i}", f"d{i}", *system.get_time_slot_range(TimeSlot.FULL_DAY, monday)) for i in range(1, 26)]
+    assignments.append(BookingRequest("u26", "d1", *system.get_time_slot_range(TimeSlot.MORNING, monday)))
+    assignments.append(BookingRequest("u27", "r1", monday.replace(hour=10, minute=15), monday.replace(hour=11)))
+    report = system.book_bulk(assignments, atomic=False)
+    assert report.booked == 25 and set(report.failures) == {25, 26}
+    assert "overlaps" in report.failures[25] and "half-hour" in report.failures[26]
+    assert [desk.id for desk in system.free_desks(monday, TimeSlot.MORNING)] == ["d26", "d27", "d28", "d29", "d30"]
+    assert len(system.find_adjacent_desks(5, monday, TimeSlot.AFTERNOON)) == 1
+    print("Bulk and recurring bookings test passed!")
+
+    print("\n=== TEST 23: Bulk Cancellation By Filter ===")
+    system = create_test_system()
+    system.add_resource(Resource("r11", ResourceType.ROOM, "Floor 2"))
+    day = datetime.combine(booking_date.date() + timedelta(days=1), datetime.min.time())
+    full_day = system.get_time_slot_range(TimeSlot.FULL_DAY, day)
+    report = system.book_bulk([BookingRequest(f"u{(i - 1) % 3 + 1}", f"d{i}", *full_day) for i in range(1, 31)])
+    desk_bookings = report.booking_ids
+    rooms = [system.request_room_booking("u4", room, day.replace(hour=10), day.replace(hour=11)) for room in ("r1", "r11")]
+    waiter = system.request_booking("u5", "d30", day, TimeSlot.MORNING)
+    system.process_request_queue()
+    assert waiter in system.desk_waiting_list
+    karma_before = {user_id: user.karma_points for user_id, user in system.users.items()}
+    report = system.cancel_matching(day, location="Floor 1", resource_type=ResourceType.DESK, desk_family="family1")
+    assert sorted(report.cancelled) == sorted(desk_bookings[:5]) and not report.karma
+    assert report.promoted == [waiter] and system.bookings[waiter].resource.desk_family == "family1"
+    assert {user_id: user.karma_points for user_id, user in system.users.items()} == karma_before
+    # Charged against one reference time, 12 hours before the desks start: 55 points per desk, summed per user
+    reference = full_day[0] - timedelta(hours=12)
+    system.users["u5"].karma_points = 30
+    report = system.cancel_matching(day, location="Floor 1", now=reference, penalize=True, promote=False)
+    assert len(report.cancelled) == 27 and rooms[1] not in report.cancelled
+    # u5 only had 30 points left to lose, the report shows what was taken rather than the 55 charged
+    assert report.karma == {"u1": 440, "u2": 440, "u3": 495, "u4": 51, "u5": 30}
+    assert system.users["u3"].karma_points == 505 and system.users["u4"].karma_points == 949
+    assert system.users["u5"].karma_points == 0
+    assert system.bookings[rooms[1]].status == BookingStatus.CONFIRMED
+    # Requests still queued when the office closes stay cancelled once the queue is processed
+    queued = [system.request_room_booking("u6", "r11", day.replace(hour=14), day.replace(hour=15)),
+              system.request_booking("u6", "d1", day, TimeSlot.AFTERNOON)]
+    report = system.cancel_matching(day, promote=False)
+    assert sorted(report.cancelled) == sorted([rooms[1], *queued])
+    system.process_request_queue()
+    assert [system.bookings[booking_id].status for booking_id in queued] == [BookingStatus.CANCELLED] * 2
+    assert system.is_resource_available("r11", day.replace(hour=14), day.replace(hour=15)) and not system.request_queue
+    print("Bulk cancellation test passed!")
+
     #Print current booking status
     #system.print_booking_status()
 
@@ -0,0 +1,377 @@
+"""Hot/cold tiering: moves finished bookings out of BookingSystem into a SQLite archive.
+
+Cancelled, missed and past bookings are never looked at by allocation again, but
+while they sit in `system.bookings` every index over it keeps carrying them.
+BookingArchiver moves them to a BookingArchive once they are old enough, or
+earlier once the hot store grows past a threshold, and drops archived rows
+again when they fall out of the retention window:
+
+    archiver = BookingArchiver(system, BookingArchive("history.db"))
+    ...
+    archiver.maybe_run()              # between requests, e.g. after each tick
+
+Archived bookings are journaled as "archive" records, so a restart does not
+bring them back and a Firestore sync keeps their documents as history.
+
+The archiver also keeps a karma ledger: every karma change, with the booking
+whose cancellation or no-show caused it. history() and karma_audit() answer
+from the hot store and the archive together.
+"""
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional
+
+from algorithm import (EPOCH, Booking, BookingStatus, BookingSystem, Resource, ResourceType, TimeSlot, User,
+                       _to_epoch_micros)
+
+TERMINAL_STATUSES = (BookingStatus.CANCELLED, BookingStatus.MISSED, BookingStatus.COMPLETED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bookings (
+    id TEXT PRIMARY KEY, user_id TEXT NOT NULL, resource_id TEXT NOT NULL, resource_type TEXT NOT NULL,
+    location TEXT NOT NULL, desk_family TEXT, start INTEGER NOT NULL, "end" INTEGER NOT NULL, status TEXT NOT NULL,
+    created INTEGER NOT NULL, coworkers TEXT NOT NULL, archived INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bookings_by_user ON bookings (user_id, start);
+CREATE INDEX IF NOT EXISTS bookings_by_resource ON bookings (resource_id, start);
+CREATE INDEX IF NOT EXISTS bookings_by_end ON bookings ("end");
+CREATE TABLE IF NOT EXISTS karma (
+    user_id TEXT NOT NULL, booking_id TEXT, at INTEGER NOT NULL, delta INTEGER NOT NULL, karma INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS karma_by_user ON karma (user_id, at);
+CREATE INDEX IF NOT EXISTS karma_by_time ON karma (at);
+"""
+_BOOKING_COLUMNS = 'id, user_id, resource_id, resource_type, location, desk_family, start, "end", status, created, coworkers, archived'
+
+
+def _from_epoch_micros(value: Optional[int]) -> Optional[datetime]:
+    return None if value is None else EPOCH + timedelta(microseconds=value)
+
+
+@dataclass(slots=True)
+class ArchivedBooking:
+    """A booking as history keeps it, by IDs rather than live User and Resource objects"""
+    id: str
+    user_id: str
+    resource_id: str
+    resource_type: ResourceType
+    location: str
+    desk_family: Optional[str]
+    start_time: datetime
+    end_time: datetime
+    status: BookingStatus
+    created_at: datetime
+    coworker_ids: List[str]
+    archived_at: Optional[datetime] = None  # None while the booking is still in the hot store
+
+    @classmethod
+    def of(cls, booking: Booking, archived_at: datetime = None) -> "ArchivedBooking":
+        resource = booking.resource
+        return cls(booking.id, booking.user.id, resource.id, resource.type, resource.location, resource.desk_family,
+                   booking.start_time, booking.end_time, booking.status, booking.created_at,
+                   [coworker.id for coworker in booking.coworkers or ()], archived_at)
+
+
+@dataclass(slots=True)
+class KarmaEvent:
+    user_id: str
+    booking_id: Optional[str]  # the cancelled or missed booking that cost the karma, when known
+    at: datetime
+    delta: int
+    karma_points: int  # balance after the change
+
+
+@dataclass
+class RetentionPolicy:
+    keep_for: timedelta = timedelta(days=1)  # how long a finished booking stays hot after it ends
+    max_hot_bookings: Optional[int] = None  # above this, terminal bookings are archived early, oldest first
+    low_water: float = 0.9  # early archiving stops at this share of max_hot_bookings
+    retain_bookings_for: Optional[timedelta] = timedelta(days=730)  # archived bookings older than this are purged
+    retain_karma_for: Optional[timedelta] = None  # same for karma events, None keeps them forever
+    run_every: timedelta = timedelta(hours=1)
+
+
+@dataclass
+class ArchiveReport:
+    archived: int = 0
+    completed: int = 0  # past CONFIRMED bookings closed as COMPLETED on the way out
+    purged_bookings: int = 0
+    purged_karma: int = 0
+    karma_events: int = 0
+    elapsed: float = 0.0
+
+
+class BookingArchive:
+    """Cold store of archived bookings and karma events in one SQLite database"""
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(_SCHEMA)
+
+    def add(self, bookings: Iterable[ArchivedBooking]) -> int:
+        rows = [
+            (b.id, b.user_id, b.resource_id, b.resource_type.value, b.location, b.desk_family,
+             _to_epoch_micros(b.start_time), _to_epoch_micros(b.end_time), b.status.value, _to_epoch_micros(b.created_at),
+             ",".join(b.coworker_ids), _to_epoch_micros(b.archived_at))
+            for b in bookings
+        ]
+        with self.db:
+            self.db.executemany(f"INSERT OR REPLACE INTO bookings ({_BOOKING_COLUMNS}) VALUES ({', '.join('?' * 12)})", rows)
+        return len(rows)
+
+    def add_karma_events(self, events: Iterable[KarmaEvent]) -> int:
+        rows = [(e.user_id, e.booking_id, _to_epoch_micros(e.at), e.delta, e.karma_points) for e in events]
+        with self.db:
+            self.db.executemany("INSERT INTO karma VALUES (?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def bookings(self, user_id: str = None, resource_id: str = None, since: datetime = None, until: datetime = None,
+                 status: BookingStatus = None, limit: int = None) -> List[ArchivedBooking]:
+        """Archived bookings matching every filter given, by start time"""
+        where, params = [], []
+        for clause, value in (("user_id = ?", user_id), ("resource_id = ?", resource_id),
+                              ("start >= ?", since and _to_epoch_micros(since)),
+                              ("start < ?", until and _to_epoch_micros(until)), ("status = ?", status and status.value)):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        query = f"SELECT {_BOOKING_COLUMNS} FROM bookings"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY start"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        return [
+            ArchivedBooking(booking_id, user, resource, ResourceType(resource_type), location, family,
+                            _from_epoch_micros(start), _from_epoch_micros(end), BookingStatus(status),
+                            _from_epoch_micros(created), coworkers.split(",") if coworkers else [],
+                            _from_epoch_micros(archived))
+            for booking_id, user, resource, resource_type, location, family, start, end, status, created, coworkers, archived
+            in self.db.execute(query, params)
+        ]
+
+    def karma_history(self, user_id: str, since: datetime = None) -> List[KarmaEvent]:
+        query, params = "SELECT user_id, booking_id, at, delta, karma FROM karma WHERE user_id = ?", [user_id]
+        if since is not None:
+            query += " AND at >= ?"
+            params.append(_to_epoch_micros(since))
+        return [KarmaEvent(user, booking_id, _from_epoch_micros(at), delta, karma)
+                for user, booking_id, at, delta, karma in self.db.execute(query + " ORDER BY at, rowid", params)]
+
+    def count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM bookings").fetchone()[0]
+
+    def purge(self, bookings_before: datetime = None, karma_before: datetime = None) -> tuple:
+        """Delete bookings that ended and karma events that happened before the given times, returns both counts"""
+        purged_bookings = purged_karma = 0
+        with self.db:
+            if bookings_before is not None:
+                purged_bookings = self.db.execute('DELETE FROM bookings WHERE "end" < ?',
+                                                  (_to_epoch_micros(bookings_before),)).rowcount
+            if karma_before is not None:
+                purged_karma = self.db.execute("DELETE FROM karma WHERE at < ?", (_to_epoch_micros(karma_before),)).rowcount
+        return purged_bookings, purged_karma
+
+    def close(self):
+        self.db.close()
+
+
+class BookingArchiver:
+    """Moves finished bookings of one BookingSystem into a BookingArchive under a RetentionPolicy
+
+    Registered as an observer of the system to keep the karma ledger, which is
+    written to the archive on every run.
+    """
+    def __init__(self, system: BookingSystem, archive: BookingArchive, policy: RetentionPolicy = None):
+        self.system = system
+        self.archive = archive
+        self.policy = policy or RetentionPolicy()
+        self.last_run: Optional[datetime] = None
+        self.last_report: Optional[ArchiveReport] = None
+        self.karma_events: List[KarmaEvent] = []  # not yet written to the archive
+        self._karma: Dict[str, int] = {user.id: user.karma_points for user in system.users.values()}
+        self._unattributed: Dict[str, KarmaEvent] = {}  # user_id -> karma change waiting for its booking
+        system.observers.append(self)
+
+    def detach(self):
+        self.system.observers.remove(self)
+
+    def append(self, op: str, *args):
+        if op == "karma":
+            user_id, karma = args
+            event = KarmaEvent(user_id, None, self.system.clock(), karma - self._karma.get(user_id, karma), karma)
+            self._karma[user_id] = karma
+            self.karma_events.append(event)
+            self._unattributed[user_id] = event
+        elif op == "status" and self._unattributed:
+            # Cancellations and no-shows charge karma just before the status change they are for
+            booking = self.system.bookings.get(args[0])
+            if booking is not None:
+                event = self._unattributed.pop(booking.user.id, None)
+                if event is not None:
+                    event.booking_id = booking.id
+        elif op == "user":
+            self._karma[args[0].id] = args[0].karma_points
+
+    def _due(self, now: datetime) -> List[Booking]:
+        """Bookings that ended more than keep_for ago and are no longer waiting to be checked in or expired"""
+        system = self.system
+        cutoff = now - self.policy.keep_for
+        due = []
+        for day in sorted(day for day in system.bookings_by_date if day <= cutoff.date()):
+            for booking_id in system.bookings_by_date[day]:
+                booking = system.bookings[booking_id]
+                if booking.end_time <= cutoff and booking.status != BookingStatus.PENDING:
+                    due.append(booking)
+        return due
+
+    def _over_threshold(self, chosen: int) -> List[Booking]:
+        """Terminal bookings to archive early, oldest first, to bring the hot store under the low water mark"""
+        system, policy = self.system, self.policy
+        if policy.max_hot_bookings is None or len(system.bookings) - chosen <= policy.max_hot_bookings:
+            return []
+        excess = len(system.bookings) - chosen - int(policy.max_hot_bookings * policy.low_water)
+        terminal = set().union(*(system.bookings_by_status.get(status, ()) for status in TERMINAL_STATUSES))
+        early = []
+        for day in sorted(system.bookings_by_date):
+            for booking_id in sorted(system.bookings_by_date[day] & terminal):
+                early.append(system.bookings[booking_id])
+                if len(early) == excess:
+                    return early
+        return early
+
+    def run(self, now: datetime = None) -> ArchiveReport:
+        """Archive what the policy says is finished, write the karma ledger and apply retention"""
+        started = perf_counter()
+        now = now or self.system.clock()
+        report = ArchiveReport()
+        system = self.system
+        due = self._due(now)
+        due_ids = {booking.id for booking in due}
+        due += [booking for booking in self._over_threshold(len(due)) if booking.id not in due_ids]
+        for booking in due:
+            if booking.status == BookingStatus.CONFIRMED:
+                system._set_status(booking, BookingStatus.COMPLETED)
+                report.completed += 1
+        # Written to the archive before leaving the hot store, so a crash in between only duplicates them
+        report.archived = self.archive.add(ArchivedBooking.of(booking, now) for booking in due)
+        for booking in due:
+            system._forget_booking(booking.id, "archive")
+        events, self.karma_events = self.karma_events, []
+        report.karma_events = self.archive.add_karma_events(events)
+        policy = self.policy
+        report.purged_bookings, report.purged_karma = self.archive.purge(
+            policy.retain_bookings_for and now - policy.retain_bookings_for,
+            policy.retain_karma_for and now - policy.retain_karma_for,
+        )
+        self.last_run = now
+        report.elapsed = perf_counter() - started
+        self.last_report = report
+        return report
+
+    def maybe_run(self, now: datetime = None) -> Optional[ArchiveReport]:
+        """Run if the schedule is due or the hot store is over its threshold"""
+        now = now or self.system.clock()
+        policy = self.policy
+        if (self.last_run is None or now - self.last_run >= policy.run_every
+                or (policy.max_hot_bookings is not None and len(self.system.bookings) > policy.max_hot_bookings)):
+            return self.run(now)
+        return None
+
+    def history(self, user_id: str = None, resource_id: str = None, since: datetime = None,
+                until: datetime = None) -> List[ArchivedBooking]:
+        """Bookings of a user or a resource from the hot store and the archive together, by start time"""
+        if user_id is not None:
+            hot = self.system.get_user_bookings(user_id)
+            if resource_id is not None:
+                hot = [booking for booking in hot if booking.resource.id == resource_id]
+        elif resource_id is not None:
+            hot = self.system.get_resource_bookings(resource_id)
+        else:
+            hot = list(self.system.bookings.values())
+        rows = [
+            ArchivedBooking.of(booking) for booking in hot
+            if (since is None or booking.start_time >= since) and (until is None or booking.start_time < until)
+        ]
+        rows += self.archive.bookings(user_id=user_id, resource_id=resource_id, since=since, until=until)
+        rows.sort(key=lambda row: (row.start_time, row.id))
+        return rows
+
+    def karma_audit(self, user_id: str, since: datetime = None) -> Dict:
+        """Current karma of a user with every change that led to it"""
+        events = self.archive.karma_history(user_id, since)
+        events += [event for event in self.karma_events if event.user_id == user_id and (since is None or event.at >= since)]
+        return {
+            "user_id": user_id,
+            "karma_points": self.system.users[user_id].karma_points,
+            "penalties": -sum(event.delta for event in events if event.delta < 0),
+            "waived": sum(1 for event in events if event.delta == 0),
+            "events": events,
+        }
+
+
+def run_tests():
+    import shutil
+    import tempfile
+
+    from persistence import Persistence
+
+    print("\n=== TEST 1: Archive Finished Bookings ===")
+    system = BookingSystem(seed=1)
+    for i in range(1, 5):
+        system.add_user(User(f"u{i}", f"User{i}", f"user{i}@company.com"))
+    for i in range(1, 4):
+        system.add_resource(Resource(f"d{i}", ResourceType.DESK, "Floor 1", "family1"))
+    system.add_resource(Resource("r1", ResourceType.ROOM, "Floor 1"))
+    archive = BookingArchive()
+    archiver = BookingArchiver(system, archive)
+    now = datetime.now()
+    last_week = datetime.combine(now.date() - timedelta(days=7), datetime.min.time())
+    next_week = last_week + timedelta(days=14)
+    attended = system.request_booking("u1", "d1", last_week, TimeSlot.FULL_DAY)
+    cancelled = system.request_room_booking("u2", "r1", last_week.replace(hour=10), last_week.replace(hour=11))
+    upcoming = system.request_booking("u3", "d2", next_week, TimeSlot.MORNING)
+    future_cancelled = system.request_room_booking("u4", "r1", next_week.replace(hour=10), next_week.replace(hour=11))
+    system.process_request_queue()
+    system.process_cancellation(cancelled)
+    system.process_cancellation(future_cancelled)
+    report = archiver.run(now)
+    assert report.archived == 2 and report.completed == 1 and report.karma_events == 2
+    assert set(system.bookings) == {upcoming, future_cancelled}
+    assert [row.id for row in archive.bookings(user_id="u1")] == [attended]
+    assert archive.bookings(user_id="u1")[0].status == BookingStatus.COMPLETED
+    assert [row.id for row in archiver.history(resource_id="r1")] == [cancelled, future_cancelled]
+    audit = archiver.karma_audit("u2")
+    assert audit["penalties"] == 100 and audit["events"][0].booking_id == cancelled
+    assert archiver.karma_audit("u4")["waived"] == 1
+    assert archiver.maybe_run(now + timedelta(minutes=5)) is None
+    print("Archive finished bookings test passed!")
+
+    print("\n=== TEST 2: Threshold And Retention ===")
+    archiver.policy = RetentionPolicy(max_hot_bookings=1, low_water=1.0, retain_bookings_for=timedelta(days=3))
+    report = archiver.maybe_run(now + timedelta(minutes=5))
+    assert report.archived == 1 and set(system.bookings) == {upcoming}  # the cancelled future booking went early
+    assert report.purged_bookings == 2 and archive.count() == 1  # last week's rows are past retention
+    print("Threshold and retention test passed!")
+
+    print("\n=== TEST 3: Archived Bookings Stay Archived After Restart ===")
+    directory = tempfile.mkdtemp()
+    try:
+        persistence = Persistence(directory)
+        persistence.attach(system)
+        archiver.policy = RetentionPolicy(keep_for=timedelta(0))
+        archiver.run(next_week + timedelta(days=1))
+        persistence.close()
+        restored = Persistence(directory).open()
+        assert not restored.bookings and len(archive.bookings(user_id="u3")) == 1
+    finally:
+        shutil.rmtree(directory)
+    print("Restart test passed!")
+
+
+if __name__ == "__main__":
+    print("Starting tests...")
+    run_tests()
+    print("Tests completed successfully!")
@@ -0,0 +1,247 @@
+"""Availability queries over the half-hour grid of BookingSystem.get_valid_room_times.
+
+Answers "which rooms are free 14:00-15:30 tomorrow", "free half-hour slots in r3"
+and "how many desks of family4 are free at each slot" without queuing a request.
+Everything is read from the system's per (resource, day) occupancy bitmasks, so a
+search over a location is one mask test per resource:
+
+    availability = Availability(system)
+    availability.search(start, end, resource_type=ResourceType.ROOM, location="Floor 2")
+    availability.free_slots("r3", day)
+    availability.family_timeline("family4", day)
+
+Timelines are cached per (resource, day), and per (family, day) and (location,
+day) for the aggregates. Availability observes the same records the journal gets
+and drops exactly the entries of the resource and days a booking change touched.
+As everywhere else in BookingSystem, a queued or waitlisted room request holds
+its room, so it counts as taken, while a desk request only takes a desk once it
+is given one (see algorithm.holds_resource).
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from algorithm import (ACTIVE_STATUSES, DAY_START, SLOT_LENGTH, SLOTS_PER_DAY, Booking, BookingSystem, Resource,
+                       ResourceType, TimeSlot, User, booking_days, is_on_grid, slot_mask)
+
+FULL_GRID = (1 << SLOTS_PER_DAY) - 1
+
+Interval = Tuple[datetime, datetime]
+
+
+def _day(value) -> date:
+    return value.date() if isinstance(value, datetime) else value
+
+
+def free_intervals(day: date, free: int) -> List[Interval]:
+    """Runs of free grid slots in a mask, as (start, end) times"""
+    base = datetime.combine(day, DAY_START)
+    intervals = []
+    slot = 0
+    while free >> slot:
+        if free >> slot & 1:
+            run = slot
+            while free >> run & 1:
+                run += 1
+            intervals.append((base + slot * SLOT_LENGTH, base + run * SLOT_LENGTH))
+            slot = run
+        else:
+            slot += 1
+    return intervals
+
+
+class Availability:
+    """Cached availability of one BookingSystem, kept exact by observing its changes"""
+    def __init__(self, system: BookingSystem):
+        self.system = system
+        self._timelines: Dict[Tuple[str, date], List[Interval]] = {}  # (resource_id, day) -> free intervals
+        self._aggregates: Dict[Tuple[str, str, date], List[int]] = {}  # (kind, key, day) -> free count per slot
+        self._held: Dict[str, Tuple[str, Tuple[date, ...]]] = {}  # booking_id -> (resource_id, days) it holds
+        self._by_place: Optional[Dict[Tuple[str, ResourceType], List[Resource]]] = None  # built on first search
+        self.hits = 0
+        self.misses = 0
+        system.observers.append(self)
+
+    def detach(self):
+        self.system.observers.remove(self)
+
+    # Invalidation
+    def append(self, op: str, *args):
+        if op == "add":
+            self._track(args[0])
+        elif op in ("status", "assign"):
+            self._release(args[0])
+            booking = self.system.bookings.get(args[0])
+            if booking is not None:
+                self._track(booking)
+        elif op in ("forget", "archive"):
+            self._release(args[0])
+        elif op == "resource":
+            self._by_place = None
+            self._aggregates.clear()
+            for key in [key for key in self._timelines if key[0] == args[0].id]:
+                del self._timelines[key]
+
+    def _track(self, booking: Booking):
+        if booking.status in ACTIVE_STATUSES:
+            days = tuple(booking_days(booking.start_time, booking.end_time))
+            self._held[booking.id] = (booking.resource.id, days)
+            self._invalidate(booking.resource.id, days)
+
+    def _release(self, booking_id: str):
+        held = self._held.pop(booking_id, None)
+        if held is not None:
+            self._invalidate(*held)
+
+    def _invalidate(self, resource_id: str, days: Tuple[date, ...]):
+        resource = self.system.resources.get(resource_id)
+        for day in days:
+            self._timelines.pop((resource_id, day), None)
+            if resource is not None:
+                self._aggregates.pop(("location", resource.location, day), None)
+                if resource.desk_family is not None:
+                    self._aggregates.pop(("family", resource.desk_family, day), None)
+
+    # Single resources
+    def free_mask(self, resource_id: str, day) -> int:
+        """Grid slots of the day with nothing holding the resource, bit 0 is 9:00-9:30"""
+        return FULL_GRID & ~self.system.occupancy.get((resource_id, _day(day)), 0)
+
+    def timeline(self, resource_id: str, day) -> List[Interval]:
+        """Free stretches of a resource on a day, on the half-hour grid"""
+        day = _day(day)
+        key = (resource_id, day)
+        intervals = self._timelines.get(key)
+        if intervals is None:
+            self.misses += 1
+            if resource_id not in self.system.resources:
+                raise KeyError(resource_id)
+            intervals = self._timelines[key] = free_intervals(day, self.free_mask(resource_id, day))
+        else:
+            self.hits += 1
+        return intervals
+
+    def free_slots(self, resource_id: str, day) -> List[datetime]:
+        """Start times of the free half-hour slots of a resource on a day"""
+        return [start + i * SLOT_LENGTH for start, end in self.timeline(resource_id, day)
+                for i in range((end - start) // SLOT_LENGTH)]
+
+    def is_free(self, resource_id: str, start_time: datetime, end_time: datetime) -> bool:
+        if is_on_grid(start_time, end_time):
+            needed = slot_mask(start_time.date(), start_time, end_time)
+            return self.free_mask(resource_id, start_time) & needed == needed
+        return self.system.is_resource_available(resource_id, start_time, end_time)
+
+    # Several resources
+    def _resources_at(self, location: str = None, resource_type: ResourceType = None) -> List[Resource]:
+        """Resources at a location and of a type, either of which may be None for any"""
+        if self._by_place is None:
+            by_place = defaultdict(list)
+            for resource in self.system.resources.values():
+                by_place[(resource.location, resource.type)].append(resource)
+            self._by_place = dict(by_place)
+        return [
+            resource for (place, kind), resources in self._by_place.items()
+            if (location is None or place == location) and (resource_type is None or kind == resource_type)
+            for resource in resources
+        ]
+
+    def search(self, start_time: datetime, end_time: datetime, resource_type: ResourceType = None,
+               location: str = None, desk_family: str = None, limit: int = None) -> List[Resource]:
+        """Resources matching every filter given that are free for the whole range"""
+        if desk_family is not None:
+            candidates = self.system.desk_families.get(desk_family, [])
+            if location is not None:
+                candidates = [resource for resource in candidates if resource.location == location]
+        else:
+            candidates = self._resources_at(location, resource_type)
+        on_grid = is_on_grid(start_time, end_time)
+        day = start_time.date()
+        needed = slot_mask(day, start_time, end_time)  # tested once per resource against its bitmask
+        occupancy = self.system.occupancy
+        free = []
+        for resource in candidates:
+            if resource_type is not None and resource.type != resource_type:
+                continue
+            if (not occupancy.get((resource.id, day), 0) & needed if on_grid
+                    else self.system.is_resource_available(resource.id, start_time, end_time)):
+                free.append(resource)
+                if limit is not None and len(free) == limit:
+                    break
+        return free
+
+    def free_rooms(self, start_time: datetime, end_time: datetime, location: str = None) -> List[Resource]:
+        return self.search(start_time, end_time, ResourceType.ROOM, location)
+
+    def _aggregate(self, kind: str, key: str, day, resources: List[Resource]) -> List[int]:
+        day = _day(day)
+        cache_key = (kind, key, day)
+        counts = self._aggregates.get(cache_key)
+        if counts is None:
+            self.misses += 1
+            counts = [0] * SLOTS_PER_DAY
+            occupancy = self.system.occupancy
+            for resource in resources:
+                free = FULL_GRID & ~occupancy.get((resource.id, day), 0)
+                while free:
+                    low = free & -free
+                    counts[low.bit_length() - 1] += 1
+                    free ^= low
+            self._aggregates[cache_key] = counts
+        else:
+            self.hits += 1
+        return counts
+
+    def family_timeline(self, desk_family: str, day) -> List[int]:
+        """Free desks of a family at each half-hour slot of the day"""
+        return self._aggregate("family", desk_family, day, self.system.desk_families.get(desk_family, []))
+
+    def location_timeline(self, location: str, day) -> List[int]:
+        """Free resources, desks and rooms alike, at a location for each half-hour slot of the day"""
+        return self._aggregate("location", location, day, self._resources_at(location))
+
+    def slot_times(self, day) -> List[datetime]:
+        """Start of each grid slot, matching the positions of the timeline counts"""
+        return self.system.get_valid_room_times(datetime.combine(_day(day), DAY_START))[:-1]
+
+
+def run_tests():
+    print("\n=== TEST 1: Free Slot Timelines ===")
+    system = BookingSystem(seed=1)
+    for i in range(1, 5):
+        system.add_user(User(f"u{i}", f"User{i}", f"user{i}@company.com"))
+    for i in range(1, 5):
+        system.add_resource(Resource(f"d{i}", ResourceType.DESK, "Floor 1", "family1"))
+    system.add_resource(Resource("r1", ResourceType.ROOM, "Floor 1"))
+    system.add_resource(Resource("r2", ResourceType.ROOM, "Floor 2"))
+    system.add_resource(Resource("r3", ResourceType.ROOM, "Floor 2"))
+    availability = Availability(system)
+    day = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+    meeting = system.request_room_booking("u1", "r3", day.replace(hour=14), day.replace(hour=15))
+    system.request_booking("u2", "d1", day, TimeSlot.MORNING)
+    system.process_request_queue()
+    assert availability.timeline("r3", day) == [(day.replace(hour=9), day.replace(hour=14)), (day.replace(hour=15), day.replace(hour=18))]
+    assert len(availability.free_slots("r3", day)) == 16 and day.replace(hour=14) not in availability.free_slots("r3", day)
+    assert availability.timeline("r3", day) is availability.timeline("r3", day)
+    assert [r.id for r in availability.free_rooms(day.replace(hour=14), day.replace(hour=15, minute=30), "Floor 2")] == ["r2"]
+    counts = availability.family_timeline("family1", day)
+    assert counts[:6] == [3] * 6 and counts[6:] == [4] * 12
+    assert availability.location_timeline("Floor 2", day)[10] == 1  # r3 taken at 14:00
+    print("Free slot timelines test passed!")
+
+    print("\n=== TEST 2: Precise Invalidation ===")
+    r2_timeline = availability.timeline("r2", day)
+    system.process_cancellation(meeting)
+    assert availability.timeline("r2", day) is r2_timeline
+    assert availability.timeline("r3", day) == [(day.replace(hour=9), day.replace(hour=18))]
+    assert availability.location_timeline("Floor 2", day)[10] == 2
+    system.add_resource(Resource("d5", ResourceType.DESK, "Floor 1", "family1"))
+    assert availability.family_timeline("family1", day)[0] == 4
+    assert len(availability.search(day.replace(hour=9), day.replace(hour=12), desk_family="family1")) == 4
+    print("Precise invalidation test passed!")
+
+
+if __name__ == "__main__":
+    print("Starting tests...")
+    run_tests()
+    print("Tests completed successfully!")
@@ -0,0 +1,534 @@
+"""Benchmark harness for the booking algorithm.
+
+Builds a synthetic campus, fills it with days of booking history and then
+replays a mix of desk requests, room requests, cancellations, group bookings
+and check-ins against BookingSystem. Latency percentiles and throughput are
+reported per operation and can be written as JSON so results from different
+releases can be compared:
+
+    python benchmark.py --desks 2000 --families 200 --rooms 100 --users 5000 --days 30 --output new.json
+    python benchmark.py --desks 2000 --families 200 --rooms 100 --users 5000 --days 30 --compare old.json
+
+--memory N measures bytes per booking for N bookings, with and without the
+compact booking store. --cold-start N [N ...] measures how long a restart from
+a snapshot plus journal tail takes for each state size. --shards W [W ...] times
+the same requests on one BookingSystem and on W worker processes sharded by
+(location, date); workers only run side by side on separate cores, so the
+output notes when W exceeds the CPU count. --firestore measures how fast the generated history is
+uploaded to an in-memory Firestore and how fast app edits are pulled back.
+--bulk-import DESKS USERS times a cold start from a floor plan CSV and a user
+export, added one by one and through importer, and a re-import of a few changes.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from time import perf_counter_ns
+from typing import Callable, Dict, List, Tuple
+
+from algorithm import (Booking, BookingStatus, BookingSystem, CompactBookingStore, Resource, ResourceType,
+                       TimeSlot, User)
+from firestore_sync import BOOKINGS, FirestoreSync, InMemoryFirestore
+from importer import import_resources, import_users, read_rows
+from persistence import Persistence
+from sharding import ShardedBookingSystem
+
+
+@dataclass
+class WorkloadConfig:
+    desks: int = 300
+    families: int = 30
+    rooms: int = 40
+    users: int = 1000
+    days: int = 20                 # days of history before the measured day
+    requests_per_day: int = 400    # desk and room requests made for each history day
+    replay_requests: int = 2000    # requests replayed against the measured day
+    room_share: float = 0.3        # fraction of requests that are room bookings
+    group_share: float = 0.05      # fraction of desk requests that bring coworkers
+    cancel_share: float = 0.1      # fraction of replayed bookings that get cancelled
+    check_in_share: float = 0.5    # fraction of replayed bookings that check in
+    tick_size: int = 50            # requests queued between process_request_queue calls
+    seed: int = 42
+    compact: bool = False          # keep bookings in the compact columnar store
+
+
+class LatencyRecorder:
+    """Collects per-operation latencies in nanoseconds"""
+    def __init__(self):
+        self.samples: Dict[str, List[int]] = {}
+
+    def timed(self, operation: str, func: Callable, *args, **kwargs):
+        started = perf_counter_ns()
+        result = func(*args, **kwargs)
+        self.samples.setdefault(operation, []).append(perf_counter_ns() - started)
+        return result
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {operation: summarize(samples) for operation, samples in self.samples.items()}
+
+
+def percentile(sorted_samples: List[int], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, max(0, int(round(fraction * len(sorted_samples))) - 1))
+    return float(sorted_samples[index])
+
+
+def summarize(samples: List[int]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        "count": len(ordered),
+        "mean_us": total / len(ordered) / 1000 if ordered else 0.0,
+        "p50_us": percentile(ordered, 0.50) / 1000,
+        "p90_us": percentile(ordered, 0.90) / 1000,
+        "p99_us": percentile(ordered, 0.99) / 1000,
+        "max_us": ordered[-1] / 1000 if ordered else 0.0,
+        "ops_per_sec": len(ordered) / (total / 1e9) if total else 0.0,
+    }
+
+
+def generate_system(config: WorkloadConfig) -> BookingSystem:
+    """BookingSystem with `desks` desks spread over `families` families, `rooms` rooms and `users` users"""
+    system = BookingSystem(seed=config.seed, compact=config.compact)
+    for i in range(1, config.users + 1):
+        system.add_user(User(f"u{i}", f"User{i}", f"user{i}@company.com"))
+    for i in range(config.desks):
+        family = i % config.families + 1
+        system.add_resource(Resource(f"d{i + 1}", ResourceType.DESK, f"Floor {family % 5 + 1}", f"family{family}"))
+    for i in range(1, config.rooms + 1):
+        system.add_resource(Resource(f"r{i}", ResourceType.ROOM, f"Floor {i % 5 + 1}"))
+    return system
+
+
+def _random_request_args(config: WorkloadConfig, rng: random.Random, day: datetime) -> Tuple[str, tuple]:
+    """(BookingSystem method name, args) of one desk or room request for `day`"""
+    user_id = f"u{rng.randint(1, config.users)}"
+    if rng.random() < config.room_share:
+        start = datetime.combine(day.date(), datetime.min.time().replace(hour=rng.randint(9, 16)))
+        end = start + timedelta(minutes=30 * rng.randint(1, 4))
+        return "request_room_booking", (user_id, f"r{rng.randint(1, config.rooms)}", start, end)
+    coworkers = None
+    if rng.random() < config.group_share:
+        coworkers = [f"u{rng.randint(1, config.users)}" for _ in range(rng.randint(1, 3))]
+    slot = rng.choice(list(TimeSlot))
+    return "request_booking", (user_id, f"d{rng.randint(1, config.desks)}", day, slot, coworkers)
+
+
+def _random_request(system: BookingSystem, config: WorkloadConfig, rng: random.Random, day: datetime,
+                    recorder: LatencyRecorder = None) -> str:
+    """Queue one desk or room request for `day`, timing it when a recorder is given"""
+    operation, args = _random_request_args(config, rng, day)
+    if recorder is None:
+        return getattr(system, operation)(*args)
+    return recorder.timed(operation, getattr(system, operation), *args)
+
+
+def generate_history(system: BookingSystem, config: WorkloadConfig, first_day: datetime):
+    """Fill `days` days starting at first_day with processed bookings, some of them cancelled"""
+    rng = random.Random(config.seed + 1)
+    for offset in range(config.days):
+        day = first_day + timedelta(days=offset)
+        booking_ids = [_random_request(system, config, rng, day) for _ in range(config.requests_per_day)]
+        system.process_request_batch()
+        for booking_id in booking_ids:
+            if rng.random() < config.cancel_share:
+                system.process_cancellation(booking_id)
+
+
+def run_benchmark(config: WorkloadConfig) -> Dict:
+    rng = random.Random(config.seed)
+    recorder = LatencyRecorder()
+    started = perf_counter_ns()
+    system = generate_system(config)
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    generate_history(system, config, today - timedelta(days=config.days))
+    setup_seconds = (perf_counter_ns() - started) / 1e9
+
+    day = today + timedelta(days=1)
+    booking_ids = []
+    for i in range(config.replay_requests):
+        booking_ids.append(_random_request(system, config, rng, day, recorder))
+        if (i + 1) % config.tick_size == 0:
+            recorder.timed("process_request_queue", system.process_request_queue)
+    recorder.timed("process_request_queue", system.process_request_queue)
+
+    for _ in range(200):
+        recorder.timed("find_adjacent_desks", system.find_adjacent_desks, rng.randint(2, 6), day, rng.choice(list(TimeSlot)))
+
+    rng.shuffle(booking_ids)
+    cancel_count = int(len(booking_ids) * config.cancel_share)
+    for booking_id in booking_ids[:cancel_count]:
+        booking = system.bookings[booking_id]
+        if booking.resource.type == ResourceType.ROOM:
+            recorder.timed("process_room_cancellation", system.process_room_cancellation, booking_id)
+        else:
+            recorder.timed("process_cancellation", system.process_cancellation, booking_id)
+
+    check_in_ids = booking_ids[cancel_count:cancel_count + int(len(booking_ids) * config.check_in_share)]
+    for booking_id in check_in_ids:
+        if system.bookings[booking_id].status == BookingStatus.CANCELLED:
+            continue
+        system.start_check_in_timer(booking_id)
+        recorder.timed("check_in_user", system.check_in_user, booking_id)
+
+    for booking_id in booking_ids[cancel_count:cancel_count + 500]:
+        recorder.timed("remove_booking", system.remove_booking, booking_id)
+
+    return {
+        "config": asdict(config),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+        },
+        "setup_seconds": setup_seconds,
+        "bookings_in_memory": len(system.bookings),
+        "operations": recorder.summary(),
+    }
+
+
+def measure_booking_memory(count: int, compact: bool, seed: int = 42) -> Dict[str, float]:
+    """Bytes per booking for the booking store alone and for a whole BookingSystem holding `count` bookings"""
+    config = WorkloadConfig(desks=500, families=50, rooms=50, users=5000, seed=seed, compact=compact)
+    rng = random.Random(seed)
+    system = generate_system(config)
+    users, resources = list(system.users.values()), list(system.resources.values())
+    first_day = datetime.combine(datetime.now().date(), datetime.min.time().replace(hour=9))
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = CompactBookingStore() if compact else {}
+    for i in range(count):
+        start = first_day + timedelta(days=i % 365, minutes=30 * rng.randint(0, 15))
+        booking = Booking(f"{i:016x}", rng.choice(users), rng.choice(resources), start, start + timedelta(hours=1),
+                          BookingStatus.COMPLETED, datetime.now(), start + timedelta(minutes=15), [])
+        store[booking.id] = booking
+    store_bytes = tracemalloc.get_traced_memory()[0] - before
+    del store, booking
+
+    before = tracemalloc.get_traced_memory()[0]
+    days = max(1, count // config.requests_per_day)
+    for i in range(count):
+        _random_request(system, config, rng, first_day + timedelta(days=i % days))
+        if (i + 1) % config.requests_per_day == 0:
+            system.process_request_batch()
+    system.process_request_batch()
+    system_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return {"bookings": count, "store_bytes_per_booking": store_bytes / count,
+            "system_bytes_per_booking": system_bytes / count}
+
+
+def measure_cold_start(count: int, compact: bool = False, tail_share: float = 0.1, seed: int = 42) -> Dict[str, float]:
+    """Restart time for a journaled system holding `count` bookings
+
+    The snapshot is taken after all but `tail_share` of the requests, so the rest is
+    replayed from the journal on restart.
+    """
+    config = WorkloadConfig(desks=500, families=50, rooms=50, users=5000, seed=seed, compact=compact)
+    rng = random.Random(seed)
+    first_day = datetime.combine(datetime.now().date(), datetime.min.time().replace(hour=9))
+    days = max(1, count // config.requests_per_day)
+    directory = tempfile.mkdtemp()
+    try:
+        persistence = Persistence(directory, snapshot_every=count + 1)
+        system = generate_system(config)
+        persistence.attach(system)
+        snapshot_at = int(count * (1 - tail_share))
+        for i in range(count):
+            _random_request(system, config, rng, first_day + timedelta(days=i % days))
+            if (i + 1) % config.requests_per_day == 0:
+                system.process_request_batch()
+            if i + 1 == snapshot_at:
+                system.process_request_batch()
+                started = perf_counter_ns()
+                thread = persistence.snapshot()
+                rotate_us = (perf_counter_ns() - started) / 1e3
+        system.process_request_batch()
+        thread.join()
+        persistence.close()
+        snapshot_bytes = os.path.getsize(persistence.snapshot_path)
+
+        restarted = Persistence(directory)
+        started = perf_counter_ns()
+        system = restarted.open(compact=compact)
+        total_seconds = (perf_counter_ns() - started) / 1e9
+        restarted.close()
+        return {"bookings": len(system.bookings), "snapshot_bytes": snapshot_bytes,
+                "snapshot_pause_us": rotate_us, "total_seconds": total_seconds} | restarted.last_load
+    finally:
+        shutil.rmtree(directory)
+
+
+def measure_sharding(config: WorkloadConfig, worker_counts: List[int]) -> List[Dict[str, float]]:
+    """Time `days` x `requests_per_day` requests on one BookingSystem and on ShardedBookingSystem"""
+    rng = random.Random(config.seed)
+    first_day = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+    requests = [_random_request_args(config, rng, first_day + timedelta(days=i % config.days))
+                for i in range(config.days * config.requests_per_day)]
+
+    system = generate_system(config)
+    started = perf_counter_ns()
+    for operation, args in requests:
+        getattr(system, operation)(*args)
+    report = system.process_request_batch()
+    single_seconds = (perf_counter_ns() - started) / 1e9
+    rows = [{"workers": 0, "seconds": single_seconds, "speedup": 1.0, "confirmed": report.confirmed}]
+
+    directory = generate_system(config)  # untouched users and resources for the workers
+    for workers in worker_counts:
+        with ShardedBookingSystem(directory.users.values(), directory.resources.values(), workers, config.seed) as sharded:
+            started = perf_counter_ns()
+            sharded.submit(requests)
+            report = sharded.process_request_queue()
+            seconds = (perf_counter_ns() - started) / 1e9
+        rows.append({"workers": workers, "seconds": seconds, "speedup": single_seconds / seconds,
+                     "confirmed": report.confirmed})
+    return rows
+
+
+def measure_firestore_sync(config: WorkloadConfig) -> Dict[str, float]:
+    """Throughput of a full upload, an incremental flush and applying app cancellations"""
+    system = generate_system(config)
+    first_day = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+    generate_history(system, config, first_day)
+    backend = InMemoryFirestore()
+    sync = FirestoreSync(system, backend)
+    sync.mark_all()
+    started = perf_counter_ns()
+    uploaded = sync.flush()
+    upload_seconds = (perf_counter_ns() - started) / 1e9
+    backend.poll()
+
+    rng = random.Random(config.seed)
+    for _ in range(config.requests_per_day):
+        _random_request(system, config, rng, first_day + timedelta(days=config.days))
+    system.process_request_batch()
+    started = perf_counter_ns()
+    flushed = sync.flush()
+    flush_seconds = (perf_counter_ns() - started) / 1e9
+    backend.poll()
+
+    confirmed = [booking.id for booking in system.get_bookings_by_status(BookingStatus.CONFIRMED)]
+    for booking_id in rng.sample(confirmed, min(len(confirmed), config.requests_per_day)):
+        backend.update(f"{BOOKINGS}/{booking_id}", {"status": "cancelled"})
+    started = perf_counter_ns()
+    applied = sync.pull()
+    pull_seconds = (perf_counter_ns() - started) / 1e9
+    return {"documents": uploaded, "commits": backend.commits, "upload_seconds": upload_seconds,
+            "upload_docs_per_sec": uploaded / upload_seconds, "incremental_writes": flushed,
+            "flush_seconds": flush_seconds, "applied_changes": applied,
+            "pull_changes_per_sec": applied / pull_seconds if pull_seconds else 0.0}
+
+
+def measure_bulk_import(desks: int, users: int, days: int = 14, seed: int = 42) -> Dict[str, float]:
+    """Cold start from a floor plan CSV and a user JSON lines export, then a re-import with 1% of the desks moved
+
+    The cold start is compared with adding the parsed rows one by one without any
+    checks, the floor an import can get to. The re-import goes into a system whose
+    desk pools are warm for the next days, against reloading every row with add_resource.
+    """
+    rng = random.Random(seed)
+    families, rooms = max(1, desks // 20), max(1, desks // 50)
+    directory = tempfile.mkdtemp()
+    try:
+        floor_plan, directory_export = os.path.join(directory, "floor.csv"), os.path.join(directory, "users.jsonl")
+
+        def write_floor_plan(family_of):
+            with open(floor_plan, "w", newline="") as out:
+                out.write("id,type,location,desk_family\n")
+                for i in range(desks):
+                    out.write(f"d{i + 1},desk,Floor {i % families % 10 + 1},family{family_of(i) + 1}\n")
+                for i in range(rooms):
+                    out.write(f"r{i + 1},room,Floor {i % 10 + 1},\n")
+
+        def resources_one_by_one(system):
+            for row in read_rows(floor_plan):
+                kind = ResourceType(row["type"])
+                system.add_resource(Resource(row["id"], kind, row["location"], row["desk_family"] if kind == ResourceType.DESK else None))
+
+        def warm(system):
+            first_day = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+            for day in range(days):
+                system.free_desks(first_day + timedelta(days=day), TimeSlot.FULL_DAY)
+
+        write_floor_plan(lambda i: i % families)
+        with open(directory_export, "w") as out:
+            for i in range(1, users + 1):
+                out.write(json.dumps({"uid": f"u{i}", "firstName": "User", "lastName": str(i),
+                                      "email": f"user{i}@company.com"}) + "\n")
+
+        started = perf_counter_ns()
+        unchecked = BookingSystem(seed=seed)
+        resources_one_by_one(unchecked)
+        for row in read_rows(directory_export):
+            unchecked.add_user(User(row["uid"], f"{row['firstName']} {row['lastName']}", row["email"]))
+        unchecked_seconds = (perf_counter_ns() - started) / 1e9
+
+        started = perf_counter_ns()
+        system = BookingSystem(seed=seed)
+        resource_report = import_resources(system, read_rows(floor_plan))
+        user_report = import_users(system, read_rows(directory_export))
+        bulk_seconds = (perf_counter_ns() - started) / 1e9
+        started = perf_counter_ns()
+        warm(system)
+        warm_seconds = (perf_counter_ns() - started) / 1e9
+
+        moved = set(rng.sample(range(desks), max(1, desks // 100)))
+        write_floor_plan(lambda i: (i + (i in moved)) % families)
+        warm(unchecked)
+        started = perf_counter_ns()
+        resources_one_by_one(unchecked)
+        reload_seconds = (perf_counter_ns() - started) / 1e9
+        started = perf_counter_ns()
+        reimport = import_resources(system, read_rows(floor_plan))
+        reimport_seconds = (perf_counter_ns() - started) / 1e9
+    finally:
+        shutil.rmtree(directory)
+    return {"desks": desks, "rooms": rooms, "users": users, "unchecked_seconds": unchecked_seconds,
+            "bulk_seconds": bulk_seconds, "resources_per_sec": resource_report.rows / resource_report.elapsed,
+            "users_per_sec": user_report.rows / user_report.elapsed, "rejected": len(resource_report.rejected) + len(user_report.rejected),
+            "warm_days": days, "warm_seconds": warm_seconds, "reimported_rows": reimport.rows, "reimport_updated": reimport.updated,
+            "reload_seconds": reload_seconds, "reimport_seconds": reimport_seconds, "reimport_speedup": reload_seconds / reimport_seconds}
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Operations whose p50 or p99 grew by more than `tolerance` (0.2 = 20%) over the baseline"""
+    regressions = []
+    for operation, stats in results["operations"].items():
+        old = baseline.get("operations", {}).get(operation)
+        if old is None:
+            continue
+        for key in ("p50_us", "p99_us"):
+            if old[key] and stats[key] > old[key] * (1 + tolerance):
+                regressions.append(f"{operation} {key}: {old[key]:.1f} -> {stats[key]:.1f}")
+    return regressions
+
+
+def print_report(results: Dict):
+    print(f"Setup: {results['setup_seconds']:.2f}s, {results['bookings_in_memory']} bookings in memory")
+    print(f"{'operation':<28}{'count':>8}{'p50 us':>10}{'p90 us':>10}{'p99 us':>10}{'max us':>11}{'ops/s':>12}")
+    for operation, stats in sorted(results["operations"].items()):
+        print(f"{operation:<28}{stats['count']:>8}{stats['p50_us']:>10.1f}{stats['p90_us']:>10.1f}"
+              f"{stats['p99_us']:>10.1f}{stats['max_us']:>11.1f}{stats['ops_per_sec']:>12.0f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark BookingSystem against a synthetic workload")
+    defaults = WorkloadConfig()
+    for field, value in asdict(defaults).items():
+        if isinstance(value, bool):
+            parser.add_argument(f"--{field.replace('_', '-')}", action="store_true")
+        else:
+            parser.add_argument(f"--{field.replace('_', '-')}", type=type(value), default=value)
+    parser.add_argument("--memory", type=int, metavar="N", help="only measure memory per booking for N bookings")
+    parser.add_argument("--cold-start", type=int, nargs="+", metavar="N",
+                        help="only measure restart time from a snapshot and journal for N bookings")
+    parser.add_argument("--shards", type=int, nargs="+", metavar="W",
+                        help="only compare one BookingSystem against W worker processes sharded by (location, date)")
+    parser.add_argument("--firestore", action="store_true",
+                        help="only measure syncing the generated history with an in-memory Firestore")
+    parser.add_argument("--bulk-import", type=int, nargs=2, metavar=("DESKS", "USERS"),
+                        help="only measure a cold start from floor plan and user exports of this size")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON results to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before flagging a regression")
+    args = vars(parser.parse_args(argv))
+    output, baseline_path, tolerance = args.pop("output"), args.pop("compare"), args.pop("tolerance")
+    memory_count = args.pop("memory")
+    cold_start_counts = args.pop("cold_start")
+    shard_counts = args.pop("shards")
+    firestore = args.pop("firestore")
+    bulk_import = args.pop("bulk_import")
+
+    if memory_count:
+        results = {"memory": [measure_booking_memory(memory_count, compact) | {"compact": compact}
+                              for compact in (False, True)]}
+        for row in results["memory"]:
+            print(f"{'compact' if row['compact'] else 'dict':<8} store {row['store_bytes_per_booking']:>7.0f} B/booking"
+                  f"   whole system {row['system_bytes_per_booking']:>7.0f} B/booking")
+        if output:
+            with open(output, "w") as f:
+                json.dump(results, f, indent=2)
+        return 0
+
+    if shard_counts:
+        cpus = os.cpu_count() or 1
+        results = {"sharding": measure_sharding(WorkloadConfig(**args), shard_counts), "cpus": cpus}
+        print(f"{'workers':>8}{'seconds':>10}{'speed-up':>10}{'confirmed':>11}")
+        for row in results["sharding"]:
+            print(f"{row['workers'] or 'single':>8}{row['seconds']:>10.3f}{row['speedup']:>10.2f}{row['confirmed']:>11}")
+        if max(shard_counts) > cpus:
+            # Workers beyond the core count only add process and IPC overhead
+            print(f"note: this host has {cpus} CPU(s), so at most {cpus} worker(s) run at once and the speed-up is"
+                  f" bounded by {min(cpus, max(shard_counts))}x; measure on at least {max(shard_counts)} cores")
+        if output:
+            with open(output, "w") as f:
+                json.dump(results, f, indent=2)
+        return 0
+
+    if firestore:
+        results = {"firestore": measure_firestore_sync(WorkloadConfig(**args))}
+        row = results["firestore"]
+        print(f"upload      {row['documents']:>8} docs in {row['commits']} commits, {row['upload_seconds']:.3f}s"
+              f" ({row['upload_docs_per_sec']:.0f} docs/s)")
+        print(f"flush       {row['incremental_writes']:>8} writes, {row['flush_seconds'] * 1e3:.1f}ms")
+        print(f"pull        {row['applied_changes']:>8} changes ({row['pull_changes_per_sec']:.0f} changes/s)")
+        if output:
+            with open(output, "w") as f:
+                json.dump(results, f, indent=2)
+        return 0
+
+    if bulk_import:
+        results = {"bulk_import": measure_bulk_import(*bulk_import, seed=args["seed"])}
+        row = results["bulk_import"]
+        print(f"{row['desks']} desks, {row['rooms']} rooms, {row['users']} users")
+        print(f"unchecked   {row['unchecked_seconds']:.3f}s adding parsed rows one by one")
+        print(f"bulk        {row['bulk_seconds']:.3f}s validated ({row['resources_per_sec']:.0f} resources/s,"
+              f" {row['users_per_sec']:.0f} users/s, {row['rejected']} rejected)")
+        print(f"desk pools  {row['warm_seconds']:.3f}s for the next {row['warm_days']} days")
+        print(f"re-import   {row['reimported_rows']} rows, {row['reimport_updated']} changed: {row['reimport_seconds']:.3f}s,"
+              f" reloading one by one {row['reload_seconds']:.3f}s ({row['reimport_speedup']:.1f}x)")
+        if output:
+            with open(output, "w") as f:
+                json.dump(results, f, indent=2)
+        return 0
+
+    if cold_start_counts:
+        results = {"cold_start": [measure_cold_start(count, args["compact"]) for count in cold_start_counts]}
+        print(f"{'bookings':>9}{'snapshot MB':>13}{'pause us':>10}{'load s':>9}{'replayed':>10}{'replay s':>10}"
+              f"{'restore s':>11}{'total s':>9}")
+        for row in results["cold_start"]:
+            print(f"{row['bookings']:>9}{row['snapshot_bytes'] / 1e6:>13.2f}{row['snapshot_pause_us']:>10.0f}"
+                  f"{row['snapshot_seconds']:>9.3f}{row['replayed_records']:>10}{row['replay_seconds']:>10.3f}"
+                  f"{row['restore_seconds']:>11.3f}{row['total_seconds']:>9.3f}")
+        if output:
+            with open(output, "w") as f:
+                json.dump(results, f, indent=2)
+        return 0
+
+    results = run_benchmark(WorkloadConfig(**args))
+    print_report(results)
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(results, json.load(f), tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
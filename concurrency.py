@@ -0,0 +1,381 @@
+"""Thread-safe BookingSystem for kiosk, mobile and RFID threads sharing one instance.
+
+ConcurrentBookingSystem locks per shard instead of around the whole object. A
+shard is one room on one day, or all desks of one day, since a desk request may
+be handed any free desk of its day. Requests, cancellations, check-ins and
+promotions hold only the shard of the booking they act on, so work on other
+rooms and days proceeds in other threads.
+
+Structures shared by every shard (the booking store, the secondary indexes, the
+waiting lists, the deadline heap, karma and the journal) are only touched inside
+the short mutation helpers of BookingSystem, which run under one index lock.
+Shard locks are always taken before the index lock and several shard locks are
+taken in sorted order, so the two levels cannot deadlock.
+"""
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Tuple
+
+from algorithm import (ACTIVE_STATUSES, Booking, BookingRequest, BookingStatus, BookingSystem, BulkReport,
+                       CancellationReport, Resource, ResourceType, TimeSlot, User, WaitingIndex, WaitingList,
+                       holds_resource)
+
+ShardKey = Tuple[str, date]  # (room_id or DESK_SHARD, day)
+DESK_SHARD = "desks"
+
+
+def _locked(method):
+    """Run a BookingSystem helper under the index lock"""
+    def wrapper(self, *args, **kwargs):
+        with self._index_lock:
+            return method(self, *args, **kwargs)
+    wrapper.__name__, wrapper.__doc__ = method.__name__, method.__doc__
+    return wrapper
+
+
+class ConcurrentBookingSystem(BookingSystem):
+    def __init__(self, seed: int = None, compact: bool = False):
+        super().__init__(seed=seed, compact=compact)
+        self._index_lock = threading.RLock()
+        self._shard_locks: Dict[ShardKey, threading.RLock] = {}
+        self._shard_locks_guard = threading.Lock()
+
+    @staticmethod
+    def shard_of(resource: Resource, start_time: datetime) -> ShardKey:
+        return (DESK_SHARD if resource.type == ResourceType.DESK else resource.id, start_time.date())
+
+    def _shard_lock(self, key: ShardKey) -> threading.RLock:
+        lock = self._shard_locks.get(key)
+        if lock is None:
+            with self._shard_locks_guard:
+                lock = self._shard_locks.setdefault(key, threading.RLock())
+        return lock
+
+    @contextmanager
+    def shards(self, *keys: ShardKey):
+        """Hold the locks of the given shards, taken in sorted order"""
+        locks = [self._shard_lock(key) for key in sorted(set(keys))]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def _booking_shard(self, booking_id: str) -> ShardKey:
+        booking = self.bookings[booking_id]
+        return self.shard_of(booking.resource, booking.start_time)
+
+    # Helpers that change structures shared across shards
+    _add_booking = _locked(BookingSystem._add_booking)
+    _add_bookings = _locked(BookingSystem._add_bookings)
+    _forget_booking = _locked(BookingSystem._forget_booking)
+    _set_status = _locked(BookingSystem._set_status)
+    _assign_resource = _locked(BookingSystem._assign_resource)
+    _push_waiting = _locked(BookingSystem._push_waiting)
+    _remove_from_waiting_lists = _locked(BookingSystem._remove_from_waiting_lists)
+    _deduct_karma = _locked(BookingSystem._deduct_karma)
+    _set_check_in_deadline = _locked(BookingSystem._set_check_in_deadline)
+    _check_in = _locked(BookingSystem._check_in)
+    _count_allocations = _locked(BookingSystem._count_allocations)
+    _next_request = _locked(BookingSystem._next_request)
+    _expired_deadlines = _locked(BookingSystem._expired_deadlines)
+    _drop_bookings = _locked(BookingSystem._drop_bookings)
+    add_to_request_queue = _locked(BookingSystem.add_to_request_queue)
+    add_user = _locked(BookingSystem.add_user)
+    add_users = _locked(BookingSystem.add_users)
+    add_resource = _locked(BookingSystem.add_resource)
+    add_resources = _locked(BookingSystem.add_resources)
+    # Journal and observers see one record at a time, also from callers outside the helpers above
+    _log = _locked(BookingSystem._log)
+
+    # Reads that walk structures other shards may be changing
+    get_user_bookings = _locked(BookingSystem.get_user_bookings)
+    get_resource_bookings = _locked(BookingSystem.get_resource_bookings)
+    get_bookings_by_status = _locked(BookingSystem.get_bookings_by_status)
+    get_bookings_on = _locked(BookingSystem.get_bookings_on)
+    _resource_booking_ids = _locked(BookingSystem._resource_booking_ids)
+    _matching_bookings = _locked(BookingSystem._matching_bookings)
+
+    def _overlapping_bookings(self, resource_id: str, start_time: datetime, end_time: datetime):
+        with self._index_lock:
+            return list(super()._overlapping_bookings(resource_id, start_time, end_time))
+
+    def _waiting_buckets(self, waiting_index: WaitingIndex, start_time: datetime, end_time: datetime) -> List[WaitingList]:
+        with self._index_lock:
+            return super()._waiting_buckets(waiting_index, start_time, end_time)
+
+    # Public operations, each under the shard of the booking or resource it acts on
+    def request_booking(self, user_id: str, resource_id: str, booking_date: datetime,
+                        time_slot: TimeSlot, coworker_ids: List[str] = None) -> str:
+        with self.shards(self.shard_of(self.resources[resource_id], booking_date)):
+            return super().request_booking(user_id, resource_id, booking_date, time_slot, coworker_ids)
+
+    def request_room_booking(self, user_id: str, room_id: str, start_time: datetime, end_time: datetime) -> str:
+        with self.shards(self.shard_of(self.resources[room_id], start_time)):
+            return super().request_room_booking(user_id, room_id, start_time, end_time)
+
+    def _still_queued(self, booking: Booking) -> bool:
+        """True if a dequeued booking was not cancelled, expired or removed before its shard was locked"""
+        return booking.id in self.bookings and booking.status == BookingStatus.PENDING
+
+    def _process_request(self, booking: Booking) -> bool:
+        with self.shards(self.shard_of(booking.resource, booking.start_time)):
+            if not self._still_queued(booking):
+                return False
+            return super()._process_request(booking)
+
+    def _allocate_desk_batch(self, day: date, group: List[Booking]) -> int:
+        with self.shards((DESK_SHARD, day)):
+            return super()._allocate_desk_batch(day, [booking for booking in group if self._still_queued(booking)])
+
+    def seat_groups(self, booking_ids: List[str]) -> List[str]:
+        with self.shards(*(self._booking_shard(booking_id) for booking_id in booking_ids)):
+            return super().seat_groups(booking_ids)
+
+    def book_bulk(self, requests: List[BookingRequest], atomic: bool = True) -> BulkReport:
+        keys = [self.shard_of(self.resources[request.resource_id], request.start_time)
+                for request in requests if request.resource_id in self.resources]
+        with self.shards(*keys):
+            return super().book_bulk(requests, atomic)
+
+    def process_cancellation(self, booking_id: str):
+        with self.shards(self._booking_shard(booking_id)):
+            return super().process_cancellation(booking_id)
+
+    def cancel_bookings(self, booking_ids: List[str], now: datetime = None, penalize: bool = True,
+                        promote: bool = True) -> CancellationReport:
+        with self.shards(*(self._booking_shard(booking_id) for booking_id in booking_ids if booking_id in self.bookings)):
+            return super().cancel_bookings(booking_ids, now, penalize, promote)
+
+    def start_check_in_timer(self, booking_id: str):
+        with self.shards(self._booking_shard(booking_id)):
+            return super().start_check_in_timer(booking_id)
+
+    def check_in_user(self, booking_id: str):
+        with self.shards(self._booking_shard(booking_id)):
+            return super().check_in_user(booking_id)
+
+    def release_resource(self, booking_id: str, now: datetime = None):
+        with self.shards(self._booking_shard(booking_id)):
+            return super().release_resource(booking_id, now)
+
+    def remove_booking(self, booking_id: str):
+        booking = self.bookings.get(booking_id)
+        if booking is None:
+            return
+        with self.shards(self.shard_of(booking.resource, booking.start_time)):
+            return super().remove_booking(booking_id)
+
+    def is_desk_available(self, start_time: datetime = None, end_time: datetime = None) -> bool:
+        if start_time is None or end_time is None:
+            return super().is_desk_available(start_time, end_time)
+        with self.shards((DESK_SHARD, start_time.date())):
+            return super().is_desk_available(start_time, end_time)
+
+    def free_desks(self, booking_date: datetime, time_slot: TimeSlot) -> List[Resource]:
+        with self.shards((DESK_SHARD, booking_date.date())):
+            return super().free_desks(booking_date, time_slot)
+
+    def find_adjacent_desks(self, desk_count: int, booking_date: datetime, time_slot: TimeSlot, limit: int = None) -> List[List[Resource]]:
+        with self.shards((DESK_SHARD, booking_date.date())):
+            return super().find_adjacent_desks(desk_count, booking_date, time_slot, limit)
+
+
+def double_bookings(system: BookingSystem) -> List[Tuple[str, str]]:
+    """Pairs of confirmed bookings that overlap on the same resource, which must never happen"""
+    clashes = []
+    by_resource: Dict[str, List[Booking]] = {}
+    for booking in system.get_bookings_by_status(BookingStatus.CONFIRMED):
+        by_resource.setdefault(booking.resource.id, []).append(booking)
+    for bookings in by_resource.values():
+        bookings.sort(key=lambda booking: booking.start_time)
+        for i, booking in enumerate(bookings):
+            for other in bookings[i + 1:]:
+                if other.start_time >= booking.end_time:
+                    break
+                clashes.append((booking.id, other.id))
+    return clashes
+
+
+def run_tests():
+    print("\n=== TEST 1: Concurrent Stress ===")
+    system = ConcurrentBookingSystem(seed=3)
+    for i in range(1, 41):
+        system.add_user(User(f"u{i}", f"User{i}", f"user{i}@company.com"))
+    for i in range(1, 21):
+        system.add_resource(Resource(f"d{i}", ResourceType.DESK, "Floor 1", f"family{(i - 1) // 5 + 1}"))
+    for i in range(1, 6):
+        system.add_resource(Resource(f"r{i}", ResourceType.ROOM, "Floor 1"))
+    first_day = datetime.combine(datetime.now().date() + timedelta(days=2), datetime.min.time())
+    errors = []
+
+    class Recorder:
+        """Observer that notices two threads appending records at once"""
+        def __init__(self):
+            self.inside, self.records, self.overlaps = 0, 0, 0
+
+        def append(self, op: str, *args):
+            self.inside += 1
+            time.sleep(0)  # give other threads the chance to append at the same time
+            self.overlaps += self.inside > 1
+            self.records += 1
+            self.inside -= 1
+
+    recorder = Recorder()
+    system.observers.append(recorder)
+
+    def worker(thread_number: int):
+        rng = random.Random(thread_number)
+        mine = []
+        try:
+            for _ in range(150):
+                user_id = f"u{rng.randint(1, 40)}"
+                day = first_day + timedelta(days=rng.randint(0, 2))
+                action = rng.random()
+                if action < 0.45:
+                    mine.append(system.request_booking(user_id, f"d{rng.randint(1, 20)}", day, rng.choice(list(TimeSlot))))
+                elif action < 0.65:
+                    start = day.replace(hour=rng.randint(9, 15))
+                    mine.append(system.request_room_booking(user_id, f"r{rng.randint(1, 5)}", start, start + timedelta(hours=1)))
+                elif action < 0.75:
+                    system.process_request_queue()
+                elif action < 0.85 and mine:
+                    booking_id = mine.pop(rng.randrange(len(mine)))
+                    if system.bookings[booking_id].status in ACTIVE_STATUSES:
+                        system.process_cancellation(booking_id)
+                elif mine:
+                    booking_id = rng.choice(mine)
+                    if system.bookings[booking_id].status == BookingStatus.CONFIRMED:
+                        system.check_in_user(booking_id)
+        except Exception as error:
+            errors.append(error)
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # switch threads as often as possible to shake out races
+    try:
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        system.process_request_queue()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert not errors, errors
+    assert not double_bookings(system)
+    assert sum(len(ids) for ids in system.bookings_by_status.values()) == len(system.bookings)
+    assert set(system._indexed) == {b.id for b in system.bookings.values() if holds_resource(b)}
+    assert len(system.get_bookings_by_status(BookingStatus.CONFIRMED)) > 0
+    assert recorder.records > 0 and recorder.overlaps == 0 and system.checked_in
+    print("Concurrent stress test passed!")
+
+    print("\n=== TEST 2: Independent Shards ===")
+    room_day = first_day + timedelta(days=5)
+    held, done = threading.Event(), threading.Event()
+
+    def hold_r1():
+        with system.shards(system.shard_of(system.resources["r1"], room_day)):
+            held.set()
+            done.wait(5)
+
+    blocker = threading.Thread(target=hold_r1)
+    blocker.start()
+    held.wait(5)
+    booking_id = system.request_room_booking("u1", "r2", room_day.replace(hour=10), room_day.replace(hour=11))
+    assert booking_id in system.bookings  # r2 is not blocked while r1 is busy
+    done.set()
+    blocker.join()
+    print("Independent shards test passed!")
+
+    print("\n=== TEST 3: Cancel Against Allocate ===")
+    gap_day = first_day + timedelta(days=6)
+
+    def in_the_gap(process, change, room: bool) -> str:
+        """Run `change` on a queued booking while `process` waits for the shard it checked the booking outside of"""
+        if room:
+            booking_id = system.request_room_booking("u2", "r3", gap_day.replace(hour=10), gap_day.replace(hour=11))
+        else:
+            booking_id = system.request_booking("u2", "d1", gap_day, TimeSlot.MORNING)
+        with system.shards(system._booking_shard(booking_id)):
+            processor = threading.Thread(target=process)
+            processor.start()
+            while system.request_queue:
+                time.sleep(0.001)
+            time.sleep(0.05)  # the processor has dequeued the booking and now waits for this shard
+            change(booking_id)
+        processor.join()
+        return booking_id
+
+    for process in (system.process_request_queue, system.process_request_batch):
+        for room in (False, True):
+            cancelled = in_the_gap(process, system.process_cancellation, room)
+            assert system.bookings[cancelled].status == BookingStatus.CANCELLED
+            assert cancelled in system.bookings_by_status[BookingStatus.CANCELLED] and cancelled not in system._indexed
+            removed = in_the_gap(process, system.remove_booking, room)
+            assert removed not in system.bookings and removed not in system._indexed
+    later = system.request_room_booking("u3", "r3", gap_day.replace(hour=10), gap_day.replace(hour=11))
+    system.process_request_batch()
+    assert system.bookings[later].status == BookingStatus.CONFIRMED  # nothing left behind on r3 by the removals
+
+    cancelled_ids, errors = [], []
+
+    def requester(thread_number: int):
+        rng = random.Random(100 + thread_number)
+        try:
+            for _ in range(200):
+                day = gap_day + timedelta(days=rng.randint(1, 2))
+                if rng.random() < 0.5:
+                    booking_id = system.request_booking(f"u{rng.randint(1, 40)}", f"d{rng.randint(1, 20)}", day,
+                                                        rng.choice(list(TimeSlot)))
+                else:
+                    start = day.replace(hour=rng.randint(9, 15))
+                    booking_id = system.request_room_booking(f"u{rng.randint(1, 40)}", f"r{rng.randint(1, 5)}", start,
+                                                             start + timedelta(hours=1))
+                if rng.random() < 0.5:
+                    time.sleep(0)  # let an allocator dequeue it first
+                    system.process_cancellation(booking_id)
+                    cancelled_ids.append(booking_id)
+        except Exception as error:
+            errors.append(error)
+
+    def allocator(batch: bool):
+        try:
+            while not stop.is_set():
+                system.process_request_batch() if batch else system.process_request_queue()
+        except Exception as error:
+            errors.append(error)
+
+    stop = threading.Event()
+    sys.setswitchinterval(1e-6)
+    try:
+        allocators = [threading.Thread(target=allocator, args=(batch,)) for batch in (False, True, False, True)]
+        requesters = [threading.Thread(target=requester, args=(n,)) for n in range(8)]
+        for thread in allocators + requesters:
+            thread.start()
+        for thread in requesters:
+            thread.join()
+        stop.set()
+        for thread in allocators:
+            thread.join()
+        system.process_request_queue()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert not errors, errors
+    assert cancelled_ids and all(system.bookings[b].status == BookingStatus.CANCELLED for b in cancelled_ids)
+    assert not double_bookings(system)
+    assert set(system._indexed) == {b.id for b in system.bookings.values() if holds_resource(b)}
+    print("Cancel against allocate test passed!")
+
+
+if __name__ == "__main__":
+    print("Starting tests...")
+    run_tests()
+    print("Tests completed successfully!")
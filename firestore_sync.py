@@ -0,0 +1,572 @@
+"""Two-way sync between BookingSystem and the Firestore collections the Flutter app reads.
+
+FirestoreSync watches the same state changes a persistence.Journal records and
+remembers which bookings, users and spaces they touched. flush() turns only
+those into Firestore documents, in the shapes the app uses:
+
+    bookings/{booking_id}                           one per booking
+    users/{user_id}                                 one per user
+    spaces/hotdesks/hotdesk_bookings/{desk_id}      one per desk, with its current holder
+    spaces/{room_id}                                one per room, with its current holder
+
+and commits them in batches that stay inside Firestore's limits (500 writes
+and 10 MiB per commit). An object changed many times between two flushes is
+written once, and a document that comes out the same as last time is not
+written at all.
+
+pull() applies the other direction: edits the app made (cancelled or checked-in
+bookings, deleted bookings, new booking requests, new users and spaces) arrive
+as document deltas and are replayed through the usual BookingSystem operations,
+so waiters are promoted and karma charged exactly as for local calls. The sync's
+own writes come back on the change feed too and are recognized and skipped.
+
+    backend = InMemoryFirestore()     # or CloudFirestore() against a real project
+    sync = FirestoreSync(system, backend)
+    sync.mark_all()                   # first full upload
+    ...
+    sync.flush()                      # e.g. after each tick
+    sync.pull()
+"""
+import json
+import queue
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Deque, Dict, Iterable, List, Optional, Set
+
+from algorithm import (ACTIVE_STATUSES, Booking, BookingStatus, BookingSystem, Resource, ResourceType, TimeSlot,
+                       User)
+
+MAX_BATCH_WRITES = 500
+MAX_BATCH_BYTES = 10 * 1024 * 1024
+BOOKINGS, USERS, SPACES = "bookings", "users", "spaces"
+HOTDESKS = "hotdesks"
+DESK_COLLECTION = f"{SPACES}/{HOTDESKS}/hotdesk_bookings"
+TIME_LABELS = {TimeSlot.FULL_DAY: "Allday", TimeSlot.MORNING: "Morning", TimeSlot.AFTERNOON: "Afternoon"}
+# Holder fields of a space nobody holds, as the app resets them
+EMPTY_HOLDER = {"is_booked": "false", "booking_id": "empty", "user_id": "empty", "time": "", "status": "empty",
+                "timeout": 0, "date_booked": ""}
+
+
+@dataclass(slots=True)
+class DocumentWrite:
+    """One document set, or deleted when data is None, on its way to or from Firestore"""
+    path: str
+    data: Optional[dict]
+
+
+def _as_datetime(value) -> Optional[datetime]:
+    """Naive local datetime, as BookingSystem uses, from a Firestore timestamp or an ISO string"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+
+def _timestamp(value: datetime) -> datetime:
+    """Local time made explicit, since Firestore would take a naive datetime for UTC"""
+    return value.astimezone()
+
+
+def _encode_value(value):
+    return _as_datetime(value).isoformat() if isinstance(value, datetime) else str(value)
+
+
+def _encode(data: dict) -> str:
+    """Canonical form of a document, equal for what was written and what the change feed returns"""
+    return json.dumps(data, sort_keys=True, default=_encode_value)
+
+
+class FirestoreBackend:
+    """Where FirestoreSync sends its batches and reads the change feed from"""
+    def commit(self, writes: List[DocumentWrite]):
+        """Apply one batch of writes atomically"""
+        raise NotImplementedError
+
+    def poll(self) -> List[DocumentWrite]:
+        """Document changes seen since the last poll, by anyone, oldest first"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class InMemoryFirestore(FirestoreBackend):
+    """Firestore stand-in for tests and benchmarks, keeping documents in a dict by path
+
+    Commits are checked against the same limits as the real service. set(),
+    update() and delete() play the part of the app writing directly.
+    """
+    def __init__(self, max_batch_writes: int = MAX_BATCH_WRITES):
+        self.documents: Dict[str, dict] = {}
+        self.max_batch_writes = max_batch_writes
+        self.commits = 0
+        self.writes = 0
+        self._feed: List[DocumentWrite] = []
+
+    def commit(self, writes: List[DocumentWrite]):
+        if len(writes) > self.max_batch_writes:
+            raise ValueError(f"A batch holds at most {self.max_batch_writes} writes, got {len(writes)}")
+        for write in writes:
+            self._apply(write)
+        self.commits += 1
+        self.writes += len(writes)
+
+    def _apply(self, write: DocumentWrite):
+        if write.data is None:
+            self.documents.pop(write.path, None)
+        else:
+            self.documents[write.path] = dict(write.data)
+        self._feed.append(DocumentWrite(write.path, None if write.data is None else dict(write.data)))
+
+    def poll(self) -> List[DocumentWrite]:
+        feed, self._feed = self._feed, []
+        return feed
+
+    def set(self, path: str, data: dict):
+        self._apply(DocumentWrite(path, data))
+
+    def update(self, path: str, fields: dict):
+        self._apply(DocumentWrite(path, {**self.documents[path], **fields}))
+
+    def delete(self, path: str):
+        self._apply(DocumentWrite(path, None))
+
+    def collection(self, path: str) -> Dict[str, dict]:
+        """Documents directly under a collection path, by document ID"""
+        prefix = path + "/"
+        return {
+            doc_path[len(prefix):]: data for doc_path, data in self.documents.items()
+            if doc_path.startswith(prefix) and "/" not in doc_path[len(prefix):]
+        }
+
+
+class CloudFirestore(FirestoreBackend):
+    """A real Firestore database through the google-cloud-firestore client
+
+    Listens to the bookings, users and spaces collections and the desk booking
+    subcollection, and queues every change the listeners report until poll().
+    """
+    def __init__(self, client=None):
+        if client is None:
+            try:
+                from google.cloud import firestore
+            except ImportError as error:
+                raise ImportError("CloudFirestore needs the google-cloud-firestore package") from error
+            client = firestore.Client()
+        self.client = client
+        self._changes: "queue.SimpleQueue[DocumentWrite]" = queue.SimpleQueue()
+        self._watches = [client.collection(name).on_snapshot(self._on_snapshot) for name in (BOOKINGS, USERS, SPACES)]
+        self._watches.append(client.collection_group(DESK_COLLECTION.rsplit("/", 1)[1]).on_snapshot(self._on_snapshot))
+
+    def _on_snapshot(self, snapshots, changes, read_time):
+        for change in changes:
+            document = change.document
+            data = None if change.type.name == "REMOVED" else document.to_dict()
+            self._changes.put(DocumentWrite(document.reference.path, data))
+
+    def commit(self, writes: List[DocumentWrite]):
+        batch = self.client.batch()
+        for write in writes:
+            reference = self.client.document(write.path)
+            if write.data is None:
+                batch.delete(reference)
+            else:
+                batch.set(reference, write.data)
+        batch.commit()
+
+    def poll(self) -> List[DocumentWrite]:
+        changes = []
+        while True:
+            try:
+                changes.append(self._changes.get_nowait())
+            except queue.Empty:
+                return changes
+
+    def close(self):
+        for watch in self._watches:
+            watch.unsubscribe()
+
+
+class FirestoreSync:
+    """Keeps one BookingSystem and one FirestoreBackend in step
+
+    Registered as an observer of the system, so it sees every journal record
+    without replacing an attached journal. flush() and pull() are meant to be
+    called from the thread that drives the system, between operations.
+    """
+    def __init__(self, system: BookingSystem, backend: FirestoreBackend,
+                 max_batch_writes: int = MAX_BATCH_WRITES, max_batch_bytes: int = MAX_BATCH_BYTES):
+        self.system = system
+        self.backend = backend
+        self.max_batch_writes = max_batch_writes
+        self.max_batch_bytes = max_batch_bytes
+        self.dirty_bookings: Set[str] = set()
+        self.dirty_users: Set[str] = set()
+        self.dirty_resources: Set[str] = set()
+        self._resource_of: Dict[str, str] = {}  # booking_id -> resource_id, to find the space a change touches
+        self._written: Dict[str, str] = {}  # path -> encoded document last written, to skip no-op writes
+        self._echoes: Dict[str, Deque[Optional[str]]] = {}  # path -> writes not yet seen on the change feed
+        self._unsent: Dict[str, DocumentWrite] = {}  # writes of a failed flush, retried by the next one
+        self.rejected: List[DocumentWrite] = []  # incoming changes that could not be applied
+        system.observers.append(self)
+
+    def detach(self):
+        self.system.observers.remove(self)
+
+    def append(self, op: str, *args):
+        """Mark what a journal record touched as dirty"""
+        if op == "add":
+            booking = args[0]
+            self._resource_of[booking.id] = booking.resource.id
+            self._touch_booking(booking.id)
+        elif op in ("status", "wait", "unwait", "deadline", "check_in"):
+            self._touch_booking(args[0])
+        elif op == "assign":
+            self._touch_booking(args[0])
+            self._resource_of[args[0]] = args[1]
+            self.dirty_resources.add(args[1])
+        elif op == "forget":
+            self._touch_booking(args[0])
+            self._resource_of.pop(args[0], None)
+        elif op == "archive":
+            self._resource_of.pop(args[0], None)  # history stays in Firestore
+        elif op == "karma":
+            self.dirty_users.add(args[0])
+        elif op == "user":
+            self.dirty_users.add(args[0].id)
+        elif op == "resource":
+            self.dirty_resources.add(args[0].id)
+
+    def _touch_booking(self, booking_id: str):
+        self.dirty_bookings.add(booking_id)
+        resource_id = self._resource_of.get(booking_id)
+        if resource_id is not None:
+            self.dirty_resources.add(resource_id)
+
+    def mark_all(self):
+        """Mark every booking, user and space dirty, for a first upload or a full resync"""
+        for booking in self.system.bookings.values():
+            self._resource_of[booking.id] = booking.resource.id
+        self.dirty_bookings.update(self.system.bookings)
+        self.dirty_users.update(self.system.users)
+        self.dirty_resources.update(self.system.resources)
+
+    # Outgoing
+    def booking_document(self, booking: Booking) -> dict:
+        return {
+            "user_id": booking.user.id,
+            "booking_type": booking.resource.type.value,
+            "resource_id": booking.resource.id,
+            "time": self._time_label(booking),
+            "start": _timestamp(booking.start_time),
+            "end": _timestamp(booking.end_time),
+            "status": booking.status.value,
+            "waitlisted": self.system._is_waitlisted(booking),
+            "checked_in": booking.id in self.system.checked_in,
+            "timeout": (booking.check_in_deadline - booking.start_time) // timedelta(minutes=1),
+            "date_booked": _timestamp(booking.created_at),
+            "coworkers": [coworker.id for coworker in booking.coworkers or ()],
+        }
+
+    def _time_label(self, booking: Booking) -> str:
+        for slot, label in TIME_LABELS.items():
+            if self.system.get_time_slot_range(slot, booking.start_time) == (booking.start_time, booking.end_time):
+                return label
+        return booking.start_time.strftime("%H:%M")
+
+    @staticmethod
+    def user_document(user: User) -> dict:
+        first_name, _, last_name = user.name.partition(" ")
+        return {"uid": user.id, "email": user.email, "firstName": first_name, "lastName": last_name,
+                "karma_points": user.karma_points}
+
+    def space_document(self, resource: Resource, now: datetime = None) -> dict:
+        """The resource plus the booking holding it now, or next if it is free now"""
+        document = {"resource_id": resource.id, "type": resource.type.value, "location": resource.location}
+        if resource.type == ResourceType.DESK:
+            document["desk_family"] = resource.desk_family
+        holder = self._holder(resource.id, now or self.system.clock())
+        if holder is None:
+            return document | EMPTY_HOLDER
+        return document | {
+            "is_booked": "true",
+            "booking_id": holder.id,
+            "user_id": holder.user.id,
+            "time": self._time_label(holder),
+            "status": holder.status.value,
+            "timeout": (holder.check_in_deadline - holder.start_time) // timedelta(minutes=1),
+            "date_booked": _timestamp(holder.created_at),
+        }
+
+    def _holder(self, resource_id: str, now: datetime) -> Optional[Booking]:
+        schedule = self.system.schedules.get(resource_id)
+        if not schedule:
+            return None
+        for _, end_time, booking_id in schedule.overlapping_intervals(now, datetime.max):
+            booking = self.system.bookings[booking_id]
+            if not self.system._is_waitlisted(booking):
+                return booking
+        return None
+
+    @staticmethod
+    def space_path(resource: Resource) -> str:
+        return f"{DESK_COLLECTION}/{resource.id}" if resource.type == ResourceType.DESK else f"{SPACES}/{resource.id}"
+
+    def _pending_writes(self, now: datetime) -> List[DocumentWrite]:
+        writes = self._unsent
+        self._unsent = {}
+        dirty_bookings, self.dirty_bookings = self.dirty_bookings, set()
+        dirty_users, self.dirty_users = self.dirty_users, set()
+        dirty_resources, self.dirty_resources = self.dirty_resources, set()
+        for booking_id in dirty_bookings:
+            booking = self.system.bookings.get(booking_id)
+            path = f"{BOOKINGS}/{booking_id}"
+            writes[path] = DocumentWrite(path, None if booking is None else self.booking_document(booking))
+        for user_id in dirty_users:
+            user = self.system.users.get(user_id)
+            if user is not None:
+                path = f"{USERS}/{user_id}"
+                writes[path] = DocumentWrite(path, self.user_document(user))
+        for resource_id in dirty_resources:
+            resource = self.system.resources.get(resource_id)
+            if resource is not None:
+                path = self.space_path(resource)
+                writes[path] = DocumentWrite(path, self.space_document(resource, now))
+        return list(writes.values())
+
+    def flush(self, now: datetime = None) -> int:
+        """Write every dirty document that changed, returns the number of writes committed"""
+        batch, batch_bytes, committed = [], 0, 0
+        encoded_batch = []
+        writes = self._pending_writes(now or self.system.clock())
+        for i, write in enumerate(writes):
+            encoded = None if write.data is None else _encode(write.data)
+            if encoded is None and write.path not in self._written and write.path.startswith(BOOKINGS):
+                continue  # never written, nothing to delete
+            if encoded is not None and self._written.get(write.path) == encoded:
+                continue
+            size = len(write.path) + (len(encoded) if encoded else 0)
+            if batch and (len(batch) == self.max_batch_writes or batch_bytes + size > self.max_batch_bytes):
+                committed += self._commit(batch, encoded_batch, writes[i:])
+                batch, batch_bytes, encoded_batch = [], 0, []
+            batch.append(write)
+            encoded_batch.append(encoded)
+            batch_bytes += size
+        if batch:
+            committed += self._commit(batch, encoded_batch, [])
+        return committed
+
+    def _commit(self, batch: List[DocumentWrite], encoded_batch: List[Optional[str]], rest: List[DocumentWrite]) -> int:
+        try:
+            self.backend.commit(batch)
+        except Exception:
+            self._unsent = {write.path: write for write in batch + rest}
+            raise
+        for write, encoded in zip(batch, encoded_batch):
+            if encoded is None:
+                self._written.pop(write.path, None)
+            else:
+                self._written[write.path] = encoded
+            self._echoes.setdefault(write.path, deque()).append(encoded)
+        return len(batch)
+
+    # Incoming
+    def pull(self) -> int:
+        """Apply the change feed, returns the number of changes that altered the system"""
+        return self.apply_changes(self.backend.poll())
+
+    def apply_changes(self, changes: Iterable[DocumentWrite]) -> int:
+        applied = 0
+        for change in changes:
+            if self._is_echo(change):
+                continue
+            parts = change.path.split("/")
+            if parts[0] == BOOKINGS and len(parts) == 2:
+                done = self._apply_booking(parts[1], change.data)
+            elif parts[0] == USERS and len(parts) == 2:
+                done = self._apply_user(parts[1], change.data)
+            elif change.path.startswith(DESK_COLLECTION + "/") and len(parts) == 4:
+                done = self._apply_space(parts[3], ResourceType.DESK, change.data)
+            elif parts[0] == SPACES and len(parts) == 2 and parts[1] != HOTDESKS:
+                done = self._apply_space(parts[1], ResourceType.ROOM, change.data)
+            else:
+                done = False
+            applied += done
+        return applied
+
+    def _is_echo(self, change: DocumentWrite) -> bool:
+        """True for one of our own writes coming back
+
+        The feed may skip intermediate versions of a document, so a match also
+        drops the older writes still expected for that path.
+        """
+        expected = self._echoes.get(change.path)
+        if not expected:
+            return False
+        encoded = None if change.data is None else _encode(change.data)
+        if encoded not in expected:
+            return False
+        while expected.popleft() != encoded:
+            pass
+        if not expected:
+            del self._echoes[change.path]
+        return True
+
+    def _apply_booking(self, booking_id: str, data: Optional[dict]) -> bool:
+        system = self.system
+        booking = system.bookings.get(booking_id)
+        if data is None:
+            if booking is None:
+                return False
+            system.remove_booking(booking_id)
+            return True
+        if booking is None:
+            return self._add_requested_booking(booking_id, data)
+        try:
+            status = BookingStatus(data.get("status"))
+        except ValueError:
+            self.rejected.append(DocumentWrite(f"{BOOKINGS}/{booking_id}", data))
+            return False
+        if booking.status not in ACTIVE_STATUSES:
+            return False
+        if status == BookingStatus.CANCELLED:
+            system.process_cancellation(booking_id)
+        elif status == BookingStatus.MISSED:
+            system.release_resource(booking_id)
+        elif ((data.get("checked_in") or status == BookingStatus.CONFIRMED and booking.status == BookingStatus.PENDING)
+              and booking_id not in system.checked_in and not system._is_waitlisted(booking)):
+            system.check_in_user(booking_id)
+        else:
+            return False
+        return True
+
+    def _add_requested_booking(self, booking_id: str, data: dict) -> bool:
+        """Queue a booking the app created, like request_booking does"""
+        system = self.system
+        user = system.users.get(data.get("user_id"))
+        resource = system.resources.get(data.get("resource_id"))
+        try:
+            start_time, end_time = _as_datetime(data.get("start")), _as_datetime(data.get("end"))
+        except (TypeError, ValueError):
+            start_time = end_time = None
+        if user is None or resource is None or start_time is None or end_time is None or end_time <= start_time:
+            self.rejected.append(DocumentWrite(f"{BOOKINGS}/{booking_id}", data))
+            return False
+        check_in_window = timedelta(minutes=30 if resource.type == ResourceType.DESK else 15)
+        system._add_booking(Booking(
+            id=booking_id,
+            user=user,
+            resource=resource,
+            start_time=start_time,
+            end_time=end_time,
+            status=BookingStatus.PENDING,
+            created_at=_as_datetime(data.get("date_booked")) or system.clock(),
+            check_in_deadline=start_time + check_in_window,
+            coworkers=[system.users[user_id] for user_id in data.get("coworkers") or () if user_id in system.users],
+        ))
+        system.add_to_request_queue(booking_id)
+        return True
+
+    def _apply_user(self, user_id: str, data: Optional[dict]) -> bool:
+        """New users are added, and name, email and karma edits copied onto existing ones
+
+        BookingSystem never deletes users, so a deleted user document is ignored.
+        """
+        if data is None:
+            return False
+        name = " ".join(part for part in (data.get("firstName", ""), data.get("lastName", "")) if part)
+        user = self.system.users.get(user_id)
+        if user is None:
+            self.system.add_user(User(user_id, name, data.get("email", ""), data.get("karma_points", 1000)))
+            return True
+        changed = False
+        if (name and name != user.name) or data.get("email", user.email) != user.email:
+            user.name, user.email = name or user.name, data.get("email", user.email)
+            self.system._log("user", user)
+            changed = True
+        karma = data.get("karma_points")
+        if karma is not None and karma != user.karma_points:
+            user.karma_points = karma
+            self.system._log("karma", user.id, karma)
+            changed = True
+        return changed
+
+    def _apply_space(self, resource_id: str, resource_type: ResourceType, data: Optional[dict]) -> bool:
+        """Spaces are added from the app, their holder fields are only ever written by the sync"""
+        if data is None or resource_id in self.system.resources:
+            return False
+        family = data.get("desk_family") if resource_type == ResourceType.DESK else None
+        self.system.add_resource(Resource(resource_id, resource_type, data.get("location", ""), family))
+        return True
+
+
+def run_tests():
+    def build():
+        system = BookingSystem(seed=1)
+        for i in range(1, 6):
+            system.add_user(User(f"u{i}", f"User {i}", f"user{i}@company.com"))
+        for i in range(1, 4):
+            system.add_resource(Resource(f"d{i}", ResourceType.DESK, "Floor 1", "family1"))
+        system.add_resource(Resource("r1", ResourceType.ROOM, "Floor 1"))
+        return system
+
+    print("\n=== TEST 1: Dirty Tracking And Batched Flush ===")
+    system = build()
+    backend = InMemoryFirestore()
+    sync = FirestoreSync(system, backend, max_batch_writes=3)
+    sync.mark_all()
+    assert sync.flush() == 9 and backend.commits == 3
+    assert backend.collection(USERS)["u2"]["firstName"] == "User"
+    assert backend.collection(DESK_COLLECTION)["d1"]["is_booked"] == "false"
+    assert sync.flush() == 0
+
+    now = datetime.now()
+    day = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    holder = system.request_room_booking("u1", "r1", day.replace(hour=10), day.replace(hour=11))
+    system.process_request_queue()
+    waiter = system.request_room_booking("u2", "r1", day.replace(hour=10), day.replace(hour=11))
+    desk = system.request_booking("u3", "d1", day, TimeSlot.MORNING)
+    system.process_request_queue()
+    assert sync.flush() == 5  # three bookings, the room and the desk that was handed out
+    documents = backend.collection(BOOKINGS)
+    assert documents[holder]["status"] == "confirmed" and documents[holder]["booking_type"] == "room"
+    assert documents[waiter]["waitlisted"] and documents[desk]["time"] == "Morning"
+    assert backend.collection(SPACES)["r1"]["booking_id"] == holder
+    desk_id = system.bookings[desk].resource.id
+    assert backend.collection(DESK_COLLECTION)[desk_id]["user_id"] == "u3"
+    print("Dirty tracking and batched flush test passed!")
+
+    print("\n=== TEST 2: Change Feed ===")
+    assert sync.pull() == 0  # only our own writes so far
+    backend.update(f"{BOOKINGS}/{holder}", {"status": "cancelled"})
+    backend.set(f"{USERS}/u6", {"uid": "u6", "email": "user6@company.com", "firstName": "New", "lastName": "User"})
+    backend.set(f"{BOOKINGS}/app-booking-0001", {"user_id": "u6", "resource_id": "d2", "booking_type": "desk",
+                                                 "start": day.replace(hour=12), "end": day.replace(hour=17)})
+    backend.delete(f"{BOOKINGS}/{desk}")
+    backend.set(f"{BOOKINGS}/app-booking-0002", {"user_id": "nobody", "resource_id": "d2"})
+    assert sync.pull() == 4
+    assert system.bookings[holder].status == BookingStatus.CANCELLED
+    assert system.bookings[waiter].status == BookingStatus.CONFIRMED  # promoted by the cancellation
+    assert system.users["u6"].name == "New User"
+    assert list(system.request_queue) == ["app-booking-0001"]
+    assert desk not in system.bookings
+    assert [change.path for change in sync.rejected] == [f"{BOOKINGS}/app-booking-0002"]
+    sync.flush()
+    assert backend.collection(SPACES)["r1"]["booking_id"] == waiter
+    assert backend.collection(DESK_COLLECTION)[desk_id]["booking_id"] != desk
+    assert backend.collection(USERS)["u1"]["karma_points"] == system.users["u1"].karma_points
+    assert sync.pull() == 0
+    backend.update(f"{BOOKINGS}/{waiter}", {"checked_in": True})
+    assert sync.pull() == 1 and waiter in system.checked_in and waiter not in system.check_in_deadlines
+    assert sync.flush() == 1 and backend.collection(BOOKINGS)[waiter]["checked_in"]
+    print("Change feed test passed!")
+
+
+if __name__ == "__main__":
+    print("Starting tests...")
+    run_tests()
+    print("Tests completed successfully!")
@@ -0,0 +1,327 @@
+"""Metrics for BookingSystem: latency histograms, queue and waitlist gauges, scan counts and outcome rates.
+
+Metrics are off unless attached, and then cost nothing on a system without them:
+attach() wraps the timed operations on that one instance and registers as an
+observer of its journal records, and detach() removes both again.
+
+    metrics = Metrics.attach(system, profile_every=100)
+    ...
+    metrics.snapshot()                # plain dict, e.g. for JSON
+    metrics.prometheus()              # text exposition format for a /metrics endpoint
+    metrics.profile_report()          # cProfile stats of every 100th request queue tick
+
+What is recorded:
+- a latency histogram per operation (OPERATIONS)
+- the request queue depth at the start of every tick, as a histogram and a gauge
+- waitlist sizes for desks and for every room, read when exported
+- scans: bookings walked by interval lookups and waiting buckets looked at by promotion
+- outcomes: confirmed, waitlisted, cancelled, missed, and dropped requests
+  (queued IDs whose booking was removed or closed before their turn). Confirmed
+  counts bookings as the allocator hands them out, including the coworkers of a
+  group and book_bulk, so a later check-in is not counted again
+"""
+import bisect
+import cProfile
+import contextlib
+import io
+import pstats
+from collections import Counter
+from time import perf_counter, perf_counter_ns
+from typing import Callable, Dict, List, Optional
+
+# BookingSystem methods timed once metrics are attached
+OPERATIONS = (
+    "request_booking", "request_room_booking", "process_request_queue", "process_request_batch", "_process_request",
+    "process_cancellation", "cancel_bookings", "check_in_user", "release_resource", "tick", "book_bulk",
+    "find_adjacent_desks", "free_desks", "is_room_available",
+)
+TICKS = ("process_request_queue", "process_request_batch")
+# Upper bounds in seconds, the last bucket is everything slower
+LATENCY_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2,
+                   5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEPTH_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+OUTCOMES = ("confirmed", "waitlisted", "cancelled", "missed", "dropped")
+
+
+class Histogram:
+    """Cumulative-bucket histogram as Prometheus exposes it, with quantiles estimated from the buckets"""
+    __slots__ = ("bounds", "counts", "count", "total")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def quantile(self, fraction: float) -> float:
+        """Upper bound of the bucket holding the given quantile, inf if it is past the last bound"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def cumulative(self) -> List[int]:
+        running, counts = 0, []
+        for count in self.counts:
+            running += count
+            counts.append(running)
+        return counts
+
+    def summary(self) -> Dict[str, float]:
+        return {"count": self.count, "sum": self.total, "mean": self.total / self.count if self.count else 0.0,
+                "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99)}
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    def __init__(self, profile_every: int = 0, profile_hook: Callable[[], contextlib.AbstractContextManager] = None):
+        self.system = None
+        self.latency: Dict[str, Histogram] = {}
+        self.queue_depth = Histogram(DEPTH_BUCKETS)
+        self.max_queue_depth = 0
+        self.scans: Counter = Counter()
+        self.outcomes: Counter = Counter({outcome: 0 for outcome in OUTCOMES})
+        self.ticks = 0
+        # Every profile_every-th tick runs inside profile_hook(), by default a shared cProfile.Profile
+        self.profile_every = profile_every
+        self.profile_hook = profile_hook or self._cprofile
+        self.profile: Optional[cProfile.Profile] = None
+        self.started = perf_counter()
+
+    @classmethod
+    def attach(cls, system, **options) -> "Metrics":
+        metrics = cls(**options)
+        metrics.system = system
+        for name in OPERATIONS:
+            setattr(system, name, metrics._timed(name, getattr(system, name)))
+        system._overlapping_bookings = metrics._counted("interval", system._overlapping_bookings)
+        system._waiting_buckets = metrics._counted("waiting_bucket", system._waiting_buckets)
+        system.observers.append(metrics)
+        system.metrics = metrics
+        return metrics
+
+    def detach(self):
+        system = self.system
+        for name in (*OPERATIONS, "_overlapping_bookings", "_waiting_buckets"):
+            system.__dict__.pop(name, None)
+        system.observers.remove(self)
+        system.metrics = None
+        self.system = None
+
+    def _timed(self, name: str, method):
+        histogram = self.latency[name] = Histogram(LATENCY_BUCKETS)
+        observe = histogram.observe
+        if name in TICKS:
+            def tick(*args, **kwargs):
+                depth = len(self.system.request_queue)
+                self.queue_depth.observe(depth)
+                self.max_queue_depth = max(self.max_queue_depth, depth)
+                self.ticks += 1
+                started = perf_counter_ns()
+                try:
+                    if self.profile_every and self.ticks % self.profile_every == 0:
+                        with self.profile_hook():
+                            return method(*args, **kwargs)
+                    return method(*args, **kwargs)
+                finally:
+                    observe((perf_counter_ns() - started) / 1e9)
+            return tick
+
+        def timed(*args, **kwargs):
+            started = perf_counter_ns()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                observe((perf_counter_ns() - started) / 1e9)
+        return timed
+
+    def _counted(self, kind: str, method):
+        scans = self.scans
+
+        def counted(*args, **kwargs):
+            items = method(*args, **kwargs)
+            if isinstance(items, list):
+                scans[kind] += len(items)
+                return items
+            return self._count_items(kind, items)
+        return counted
+
+    def _count_items(self, kind: str, items):
+        for item in items:
+            self.scans[kind] += 1
+            yield item
+
+    @contextlib.contextmanager
+    def _cprofile(self):
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+        self.profile.enable()
+        try:
+            yield
+        finally:
+            self.profile.disable()
+
+    def allocated(self, count: int = 1):
+        """Called by BookingSystem for every booking it confirms on a resource"""
+        self.outcomes["confirmed"] += count
+
+    def append(self, op: str, *args):
+        """Count the other request outcomes from the system's journal records"""
+        if op == "status":
+            status = args[1].value
+            if status in ("cancelled", "missed"):
+                self.outcomes[status] += 1
+        elif op == "wait":
+            self.outcomes["waitlisted"] += 1
+        elif op == "dequeue":
+            booking = self.system.bookings.get(args[0])
+            if booking is None or booking.status.value != "pending":
+                self.outcomes["dropped"] += 1
+
+    # Export
+    def waitlists(self) -> Dict[str, int]:
+        sizes = {"desks": len(self.system.desk_waiting_list)}
+        for room_id, waiting_list in self.system.room_waiting_lists.items():
+            sizes[room_id] = len(waiting_list)
+        return sizes
+
+    def snapshot(self) -> Dict:
+        elapsed = perf_counter() - self.started
+        return {
+            "uptime_seconds": elapsed,
+            "operations": {name: histogram.summary() for name, histogram in self.latency.items() if histogram.count},
+            "queue_depth": len(self.system.request_queue),
+            "max_queue_depth": self.max_queue_depth,
+            "tick_queue_depth": self.queue_depth.summary(),
+            "waitlists": self.waitlists(),
+            "scans": dict(self.scans),
+            "outcomes": dict(self.outcomes),
+            "outcome_rates": {outcome: count / elapsed for outcome, count in self.outcomes.items()},
+            "bookings": len(self.system.bookings),
+        }
+
+    def prometheus(self, prefix: str = "booking") -> str:
+        """Every metric in the Prometheus text exposition format"""
+        lines = [f"# TYPE {prefix}_operation_seconds histogram"]
+        for name, histogram in sorted(self.latency.items()):
+            for bound, count in zip((*histogram.bounds, "+Inf"), histogram.cumulative()):
+                lines.append(f'{prefix}_operation_seconds_bucket{{operation="{name}",le="{bound}"}} {count}')
+            lines.append(f'{prefix}_operation_seconds_sum{{operation="{name}"}} {histogram.total}')
+            lines.append(f'{prefix}_operation_seconds_count{{operation="{name}"}} {histogram.count}')
+        lines.append(f"# TYPE {prefix}_tick_queue_depth histogram")
+        for bound, count in zip((*self.queue_depth.bounds, "+Inf"), self.queue_depth.cumulative()):
+            lines.append(f'{prefix}_tick_queue_depth_bucket{{le="{bound}"}} {count}')
+        lines.append(f"{prefix}_tick_queue_depth_sum {self.queue_depth.total}")
+        lines.append(f"{prefix}_tick_queue_depth_count {self.queue_depth.count}")
+        lines.append(f"# TYPE {prefix}_queue_depth gauge")
+        lines.append(f"{prefix}_queue_depth {len(self.system.request_queue)}")
+        lines.append(f"# TYPE {prefix}_waitlist_size gauge")
+        for resource, size in self.waitlists().items():
+            lines.append(f'{prefix}_waitlist_size{{resource="{_label(resource)}"}} {size}')
+        lines.append(f"# TYPE {prefix}_scans_total counter")
+        for kind, count in sorted(self.scans.items()):
+            lines.append(f'{prefix}_scans_total{{kind="{kind}"}} {count}')
+        lines.append(f"# TYPE {prefix}_requests_total counter")
+        for outcome, count in self.outcomes.items():
+            lines.append(f'{prefix}_requests_total{{outcome="{outcome}"}} {count}')
+        lines.append(f"# TYPE {prefix}_bookings gauge")
+        lines.append(f"{prefix}_bookings {len(self.system.bookings)}")
+        return "\n".join(lines) + "\n"
+
+    def profile_report(self, limit: int = 20, sort: str = "cumulative") -> str:
+        """Top functions of the profiled ticks, empty if none was profiled"""
+        if self.profile is None:
+            return ""
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+def run_tests():
+    from datetime import datetime, timedelta
+
+    from algorithm import BookingSystem, Resource, ResourceType, TimeSlot, User
+
+    print("\n=== TEST 1: Metrics Snapshot ===")
+    system = BookingSystem(seed=1)
+    for i in range(1, 6):
+        system.add_user(User(f"u{i}", f"User{i}", f"user{i}@company.com"))
+    for i in range(1, 3):
+        system.add_resource(Resource(f"d{i}", ResourceType.DESK, "Floor 1", "family1"))
+    system.add_resource(Resource("r1", ResourceType.ROOM, "Floor 1"))
+    metrics = Metrics.attach(system, profile_every=2)
+    day = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+    first = system.request_room_booking("u1", "r1", day.replace(hour=10), day.replace(hour=11))
+    system.process_request_queue()
+    second = system.request_room_booking("u2", "r1", day.replace(hour=10), day.replace(hour=11))
+    gone = system.request_booking("u3", "d1", day, TimeSlot.MORNING)
+    system.remove_booking(gone)
+    system.process_request_queue()
+    system.process_cancellation(first)
+    snapshot = metrics.snapshot()
+    assert snapshot["outcomes"] == {"confirmed": 2, "waitlisted": 1, "cancelled": 1, "missed": 0, "dropped": 1}
+    assert snapshot["operations"]["request_room_booking"]["count"] == 2
+    assert snapshot["operations"]["process_request_queue"]["count"] == 2 and snapshot["max_queue_depth"] == 2
+    assert snapshot["waitlists"] == {"desks": 0, "r1": 0} and system.bookings[second].status.value == "confirmed"
+    assert snapshot["scans"]["interval"] > 0 and snapshot["scans"]["waiting_bucket"] == 1
+    text = metrics.prometheus()
+    assert 'booking_requests_total{outcome="dropped"} 1' in text
+    assert 'booking_operation_seconds_count{operation="process_cancellation"} 1' in text
+    assert "process_request_queue" in metrics.profile_report()
+    print("Metrics snapshot test passed!")
+
+    print("\n=== TEST 2: Confirmed Counts Allocations ===")
+    office = BookingSystem(seed=1)
+    for i in range(1, 6):
+        office.add_user(User(f"u{i}", f"User{i}", f"user{i}@company.com"))
+    for i in range(1, 6):
+        office.add_resource(Resource(f"d{i}", ResourceType.DESK, "Floor 1", "family1"))
+    counted = Metrics.attach(office)
+    group = office.request_booking("u1", "d1", day, TimeSlot.MORNING, coworker_ids=["u2", "u3"])
+    single = office.request_booking("u4", "d1", day, TimeSlot.MORNING)
+    office.process_request_queue()
+    office.clock = lambda: office.bookings[single].start_time
+    assert office.check_in_user(single) and office.check_in_user(group)
+    assert counted.outcomes["confirmed"] == 4 and counted.outcomes["cancelled"] == 0
+    print("Confirmed counts allocations test passed!")
+
+    print("\n=== TEST 3: Failing Tick ===")
+    def broken():
+        raise RuntimeError("queue unavailable")
+
+    office._next_request = broken
+    try:
+        office.process_request_batch()
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("the tick should have raised")
+    assert counted.latency["process_request_batch"].count == 1 and counted.ticks == 2
+    del office._next_request
+    print("Failing tick test passed!")
+
+    print("\n=== TEST 4: Detach ===")
+    metrics.detach()
+    assert "request_booking" not in vars(system) and not system.observers and system.metrics is None
+    system.request_booking("u4", "d2", day, TimeSlot.AFTERNOON)
+    assert metrics.latency["request_booking"].count == 1
+    print("Detach test passed!")
+
+
+if __name__ == "__main__":
+    print("Starting tests...")
+    run_tests()
+    print("Tests completed successfully!")
@@ -0,0 +1,511 @@
+"""Asyncio booking service in front of BookingSystem.
+
+Clients talk newline-delimited JSON over TCP, one request object per line with an
+"op" and an optional "id" that is echoed back in the response:
+
+    {"id": 1, "op": "book_desk", "user_id": "u1", "desk_id": "d4", "date": "2024-11-05", "slot": "morning"}
+    {"id": 1, "ok": true, "booking_id": "3f2c...", "status": "confirmed"}
+
+Booking requests are queued right away but answered only after the next tick,
+which runs process_request_batch over everything queued since the last one, so
+concurrent callers share one allocation pass. If that pass raises, every
+booking waiting on it is answered with an internal error. Room timelines and "search"
+queries come from availability.Availability, which is kept exact as bookings
+change. Free desk lists are served from a cache whose entries live for
+`cache_ttl` seconds and are dropped by any tick, cancellation or check-in, so
+they are never staler than the last change. "metrics" returns the snapshot, or
+with "format": "prometheus" the text dump, of metrics.Metrics if attached. Once `max_pending` requests wait for
+a tick, new bookings are turned away with a "busy" error, and every connection
+has at most `max_in_flight` requests being handled before its reads pause.
+
+    python service.py --port 8765                      # serve a synthetic campus
+    python service.py --load-test --clients 50 --requests 200
+    python service.py                                  # run the tests
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+from datetime import datetime, timedelta
+from time import perf_counter_ns
+from typing import Dict, List, Optional, Tuple
+
+from algorithm import BookingStatus, BookingSystem, ResourceType, TimeSlot
+from availability import Availability
+from benchmark import WorkloadConfig, generate_system, summarize
+from metrics import Metrics
+
+
+class ServiceError(Exception):
+    """Error reported back to the client instead of closing the connection"""
+
+
+class BookingService:
+    def __init__(self, system: BookingSystem, tick_interval: float = 0.005, max_batch: int = 500,
+                 max_pending: int = 5000, max_in_flight: int = 64, cache_ttl: float = 0.5):
+        self.system = system
+        self.tick_interval = tick_interval  # seconds a booking may wait for other requests to share its tick
+        self.max_batch = max_batch  # queued bookings that trigger a tick straight away
+        self.max_pending = max_pending
+        self.max_in_flight = max_in_flight
+        self.cache_ttl = cache_ttl
+        self._pending: Dict[str, asyncio.Future] = {}  # booking_id -> future resolved by the next tick
+        self._tick_handle: Optional[asyncio.Handle] = None
+        self._cache: Dict[Tuple, Tuple[float, object]] = {}  # key -> (expires at, value)
+        self.availability = Availability(system)
+        self.stats = {"requests": 0, "ticks": 0, "busy": 0, "cache_hits": 0, "errors": 0}
+        self._handlers = {
+            "book_desk": self._book_desk,
+            "book_room": self._book_room,
+            "cancel": self._cancel,
+            "check_in": self._check_in,
+            "availability": self._availability,
+            "search": self._search,
+            "my_bookings": self._my_bookings,
+            "metrics": self._metrics,
+        }
+
+    async def handle(self, request) -> Dict:
+        """Answer one decoded request, with an error response for anything that is not a valid one"""
+        self.stats["requests"] += 1
+        if not isinstance(request, dict):
+            self.stats["errors"] += 1
+            return {"id": None, "ok": False, "error": "bad request: expected a JSON object"}
+        response = {"id": request.get("id")}
+        try:
+            handler = self._handlers.get(request.get("op"))
+            if handler is None:
+                raise ServiceError(f"unknown op {request.get('op')!r}")
+            response.update(await handler(request))
+            response["ok"] = True
+        except ServiceError as error:
+            response.update(ok=False, error=str(error))
+        except (KeyError, ValueError, TypeError) as error:
+            self.stats["errors"] += 1
+            response.update(ok=False, error=f"bad request: {error!r}")
+        except Exception as error:  # the client still gets an answer, and the connection stays open
+            self.stats["errors"] += 1
+            response.update(ok=False, error=f"internal error: {error!r}")
+        return response
+
+    # Ticks
+    def _queue_booking(self, booking_id: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._pending[booking_id] = future
+        if len(self._pending) >= self.max_batch:
+            self._schedule_tick(0)
+        elif self._tick_handle is None:
+            self._schedule_tick(self.tick_interval)
+        return future
+
+    def _schedule_tick(self, delay: float):
+        if self._tick_handle is not None:
+            self._tick_handle.cancel()
+        self._tick_handle = asyncio.get_running_loop().call_later(delay, self.tick)
+
+    def tick(self):
+        """Allocate everything queued so far and answer the bookings waiting on it"""
+        self._tick_handle = None
+        self.stats["ticks"] += 1
+        pending, self._pending = self._pending, {}
+        self._cache.clear()
+        try:
+            self.system.process_request_batch()
+        except Exception as error:  # every waiting client gets an internal error instead of hanging
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for booking_id, future in pending.items():
+            if not future.done():
+                booking = self.system.bookings.get(booking_id)
+                future.set_result(booking.status.value if booking is not None else "removed")
+
+    def _check_capacity(self):
+        if len(self._pending) >= self.max_pending:
+            self.stats["busy"] += 1
+            raise ServiceError("busy")
+
+    # Operations
+    async def _book_desk(self, request: Dict) -> Dict:
+        self._check_capacity()
+        booking_id = self.system.request_booking(
+            request["user_id"], request["desk_id"], _parse_day(request["date"]), TimeSlot(request.get("slot", "full_day")),
+            request.get("coworkers") or None,
+        )
+        return {"booking_id": booking_id, "status": await self._queue_booking(booking_id)}
+
+    async def _book_room(self, request: Dict) -> Dict:
+        self._check_capacity()
+        booking_id = self.system.request_room_booking(
+            request["user_id"], request["room_id"], datetime.fromisoformat(request["start"]),
+            datetime.fromisoformat(request["end"]),
+        )
+        return {"booking_id": booking_id, "status": await self._queue_booking(booking_id)}
+
+    async def _cancel(self, request: Dict) -> Dict:
+        booking = self._booking(request["booking_id"])
+        if booking.status not in (BookingStatus.PENDING, BookingStatus.CONFIRMED):
+            raise ServiceError(f"booking is {booking.status.value}")
+        self.system.process_cancellation(booking.id)
+        self._cache.clear()
+        return {"status": booking.status.value}
+
+    async def _check_in(self, request: Dict) -> Dict:
+        booking = self._booking(request["booking_id"])
+        checked_in = self.system.check_in_user(booking.id)
+        self._cache.clear()
+        return {"checked_in": checked_in, "status": booking.status.value}
+
+    async def _availability(self, request: Dict) -> Dict:
+        day = _parse_day(request["date"])
+        room_id = request.get("room_id")
+        if room_id is not None:
+            if room_id not in self.system.resources:
+                raise ServiceError(f"unknown room {room_id!r}")
+            return {"free_starts": [start.isoformat() for start in self.availability.free_slots(room_id, day)]}
+        key = ("desk", day, TimeSlot(request.get("slot", "full_day")))
+        now = asyncio.get_running_loop().time()
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > now:
+            self.stats["cache_hits"] += 1
+            return cached[1]
+        value = {"free_desks": [desk.id for desk in self.system.free_desks(day, key[2])]}
+        self._cache[key] = (now + self.cache_ttl, value)
+        return value
+
+    async def _search(self, request: Dict) -> Dict:
+        resource_type = request.get("type")
+        resources = self.availability.search(
+            datetime.fromisoformat(request["start"]), datetime.fromisoformat(request["end"]),
+            ResourceType(resource_type) if resource_type is not None else None,
+            request.get("location"), request.get("family"), request.get("limit"),
+        )
+        return {"resources": [resource.id for resource in resources]}
+
+    async def _metrics(self, request: Dict) -> Dict:
+        if self.system.metrics is None:
+            raise ServiceError("metrics are not enabled")
+        if request.get("format") == "prometheus":
+            return {"text": self.system.metrics.prometheus()}
+        return {"metrics": self.system.metrics.snapshot(), "service": dict(self.stats)}
+
+    async def _my_bookings(self, request: Dict) -> Dict:
+        bookings = self.system.get_user_bookings(request["user_id"])
+        return {"bookings": [
+            {"booking_id": booking.id, "resource_id": booking.resource.id, "start": booking.start_time.isoformat(),
+             "end": booking.end_time.isoformat(), "status": booking.status.value}
+            for booking in sorted(bookings, key=lambda booking: booking.start_time)
+        ]}
+
+    def _booking(self, booking_id: str):
+        booking = self.system.bookings.get(booking_id)
+        if booking is None:
+            raise ServiceError(f"unknown booking {booking_id!r}")
+        return booking
+
+    # Transport
+    async def serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answer newline-delimited JSON requests from one client, out of order if they finish out of order"""
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+
+        async def answer(line: bytes):
+            try:
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    response = {"ok": False, "error": "invalid JSON"}
+                else:
+                    response = await self.handle(request)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+            finally:
+                in_flight.release()
+
+        try:
+            while True:
+                await in_flight.acquire()  # stop reading once this client has max_in_flight requests open
+                line = await reader.readline()
+                if not line:
+                    in_flight.release()
+                    break
+                task = asyncio.create_task(answer(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self.serve_connection, host, port)
+
+
+def _parse_day(value: str) -> datetime:
+    return datetime.combine(datetime.fromisoformat(value).date(), datetime.min.time())
+
+
+async def load_test(system: BookingSystem, config: WorkloadConfig, clients: int, requests_per_client: int,
+                    window: int, **service_options) -> Dict:
+    """Run a service on a local port and drive it with `clients` concurrent connections"""
+    service = BookingService(system, **service_options)
+    server = await service.start()
+    port = server.sockets[0].getsockname()[1]
+    first_day = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+    latencies: Dict[str, List[int]] = {}
+    outcomes: Dict[str, int] = {}
+
+    async def client(number: int):
+        rng = random.Random(config.seed + number)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        sent: Dict[int, Tuple[str, int]] = {}  # request id -> (op, sent at)
+        booked: List[str] = []
+
+        def next_request(request_id: int) -> Dict:
+            day = (first_day + timedelta(days=rng.randrange(5))).date().isoformat()
+            user_id = f"u{rng.randint(1, config.users)}"
+            roll = rng.random()
+            if roll < 0.4:
+                return {"op": "book_desk", "user_id": user_id, "desk_id": f"d{rng.randint(1, config.desks)}",
+                        "date": day, "slot": rng.choice(list(TimeSlot)).value}
+            if roll < 0.55:
+                start = datetime.fromisoformat(day).replace(hour=rng.randint(9, 16))
+                return {"op": "book_room", "user_id": user_id, "room_id": f"r{rng.randint(1, config.rooms)}",
+                        "start": start.isoformat(), "end": (start + timedelta(hours=1)).isoformat()}
+            if roll < 0.7:
+                return {"op": "availability", "date": day, "slot": rng.choice(list(TimeSlot)).value}
+            if roll < 0.8:
+                return {"op": "availability", "date": day, "room_id": f"r{rng.randint(1, config.rooms)}"}
+            if roll < 0.85:
+                start = datetime.fromisoformat(day).replace(hour=rng.randint(9, 16))
+                return {"op": "search", "type": "room", "start": start.isoformat(),
+                        "end": (start + timedelta(minutes=90)).isoformat(), "location": f"Floor {rng.randint(1, 5)}"}
+            if roll < 0.95 and booked:
+                return {"op": "cancel", "booking_id": booked.pop(rng.randrange(len(booked)))}
+            return {"op": "my_bookings", "user_id": user_id}
+
+        async def send(request_id: int):
+            request = next_request(request_id) | {"id": request_id}
+            sent[request_id] = (request["op"], perf_counter_ns())
+            writer.write(json.dumps(request).encode() + b"\n")
+            await writer.drain()
+
+        next_id = 0
+        while next_id < min(window, requests_per_client):
+            await send(next_id)
+            next_id += 1
+        for _ in range(requests_per_client):
+            response = json.loads(await reader.readline())
+            op, started = sent.pop(response["id"])
+            latencies.setdefault(op, []).append(perf_counter_ns() - started)
+            outcome = response.get("status", "ok") if response["ok"] else response["error"].split(":")[0]
+            outcomes[f"{op}:{outcome}"] = outcomes.get(f"{op}:{outcome}", 0) + 1
+            if response["ok"] and op in ("book_desk", "book_room") and response["status"] != "removed":
+                booked.append(response["booking_id"])
+            if next_id < requests_per_client:
+                await send(next_id)
+                next_id += 1
+        writer.close()
+
+    started = perf_counter_ns()
+    await asyncio.gather(*(client(number) for number in range(clients)))
+    elapsed = (perf_counter_ns() - started) / 1e9
+    server.close()
+    await server.wait_closed()
+    total = clients * requests_per_client
+    return {
+        "requests": total,
+        "seconds": elapsed,
+        "requests_per_sec": total / elapsed,
+        "operations": {op: summarize(samples) for op, samples in latencies.items()},
+        "outcomes": dict(sorted(outcomes.items())),
+        "service": service.stats,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve BookingSystem over TCP, or load test it locally")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--desks", type=int, default=300)
+    parser.add_argument("--rooms", type=int, default=40)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--tick-interval", type=float, default=0.005)
+    parser.add_argument("--max-pending", type=int, default=5000)
+    parser.add_argument("--cache-ttl", type=float, default=0.5)
+    parser.add_argument("--metrics", action="store_true", help="attach metrics.Metrics to the system")
+    parser.add_argument("--load-test", action="store_true", help="drive an in-process server instead of serving")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200, help="requests sent by each load test client")
+    parser.add_argument("--window", type=int, default=8, help="requests each load test client keeps open")
+    args = parser.parse_args(argv)
+
+    config = WorkloadConfig(desks=args.desks, families=max(1, args.desks // 10), rooms=args.rooms, users=args.users)
+    system = generate_system(config)
+    if args.metrics:
+        Metrics.attach(system)
+    options = {"tick_interval": args.tick_interval, "max_pending": args.max_pending, "cache_ttl": args.cache_ttl}
+    if args.load_test:
+        results = asyncio.run(load_test(system, config, args.clients, args.requests, args.window, **options))
+        print(f"{results['requests']} requests in {results['seconds']:.2f}s, {results['requests_per_sec']:.0f} req/s")
+        print(f"{'operation':<16}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}")
+        for op, stats in sorted(results["operations"].items()):
+            print(f"{op:<16}{stats['count']:>8}{stats['p50_us'] / 1000:>10.2f}{stats['p90_us'] / 1000:>10.2f}"
+                  f"{stats['p99_us'] / 1000:>10.2f}")
+        print("outcomes:", ", ".join(f"{key}={count}" for key, count in results["outcomes"].items()))
+        print("service:", ", ".join(f"{key}={count}" for key, count in results["service"].items()))
+        if system.metrics is not None:
+            print(system.metrics.prometheus(), end="")
+        return 0
+
+    async def serve():
+        service = BookingService(system, **options)
+        server = await service.start(args.host, args.port)
+        print(f"Serving {len(system.resources)} resources on {args.host}:{args.port}")
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+    return 0
+
+
+def run_tests():
+    from algorithm import Resource, User
+
+    def build():
+        system = BookingSystem(seed=1)
+        for i in range(1, 6):
+            system.add_user(User(f"u{i}", f"User{i}", f"user{i}@company.com"))
+        for i in range(1, 4):
+            system.add_resource(Resource(f"d{i}", ResourceType.DESK, "Floor 1", "family1"))
+        system.add_resource(Resource("r1", ResourceType.ROOM, "Floor 1"))
+        return system
+
+    day = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+    date = day.date().isoformat()
+    meeting = {"start": day.replace(hour=10).isoformat(), "end": day.replace(hour=11).isoformat()}
+
+    async def operations():
+        service = BookingService(build(), tick_interval=0.01)
+        desks = await asyncio.gather(*(
+            service.handle({"id": i, "op": "book_desk", "user_id": f"u{i}", "desk_id": "d1", "date": date,
+                            "slot": "morning"})
+            for i in range(1, 5)
+        ))
+        assert [response["id"] for response in desks] == [1, 2, 3, 4] and all(response["ok"] for response in desks)
+        assert service.stats["ticks"] == 1  # the four bookings shared one allocation pass
+        assert sorted(response["status"] for response in desks) == ["confirmed"] * 3 + ["pending"]
+        room = await service.handle({"op": "book_room", "user_id": "u4", "room_id": "r1", **meeting})
+        assert room["ok"] and room["status"] == "confirmed" and service.stats["ticks"] == 2
+
+        free = await service.handle({"op": "availability", "date": date, "slot": "afternoon"})
+        assert free["free_desks"] == ["d1", "d2", "d3"]
+        assert await service.handle({"op": "availability", "date": date, "slot": "afternoon"}) == free
+        assert service.stats["cache_hits"] == 1
+        slots = await service.handle({"op": "availability", "date": date, "room_id": "r1"})
+        assert slots["ok"] and meeting["start"] not in slots["free_starts"] and slots["free_starts"]
+        found = await service.handle({"op": "search", "type": "room", **meeting})
+        assert found["ok"] and found["resources"] == []
+        mine = await service.handle({"op": "my_bookings", "user_id": "u4"})
+        assert [booking["booking_id"] for booking in mine["bookings"]][1:] == [room["booking_id"]]  # after the desk
+
+        checked = await service.handle({"op": "check_in", "booking_id": room["booking_id"]})
+        assert checked["ok"] and checked["checked_in"] and checked["status"] == "confirmed"
+        cancelled = await service.handle({"op": "cancel", "booking_id": room["booking_id"]})
+        assert cancelled["ok"] and cancelled["status"] == "cancelled"
+        again = await service.handle({"op": "cancel", "booking_id": room["booking_id"]})
+        assert not again["ok"] and again["error"] == "booking is cancelled"
+        found = await service.handle({"op": "search", "type": "room", **meeting})
+        assert found["resources"] == ["r1"]
+
+        disabled = await service.handle({"op": "metrics"})
+        assert not disabled["ok"] and disabled["error"] == "metrics are not enabled"
+        Metrics.attach(service.system)
+        await service.handle({"op": "book_desk", "user_id": "u5", "desk_id": "d2", "date": date, "slot": "afternoon"})
+        snapshot = await service.handle({"op": "metrics"})
+        assert snapshot["ok"] and snapshot["metrics"]["outcomes"]["confirmed"] == 1
+        text = await service.handle({"op": "metrics", "format": "prometheus"})
+        assert 'booking_requests_total{outcome="confirmed"} 1' in text["text"]
+
+    print("\n=== TEST 1: Operations And Coalescing ===")
+    asyncio.run(operations())
+    print("Operations and coalescing test passed!")
+
+    async def backpressure():
+        service = BookingService(build(), tick_interval=0.01, max_pending=1)
+        first = asyncio.create_task(service.handle(
+            {"op": "book_desk", "user_id": "u1", "desk_id": "d1", "date": date, "slot": "morning"}))
+        await asyncio.sleep(0)  # let the first booking queue up for the tick
+        busy = await service.handle({"op": "book_room", "user_id": "u2", "room_id": "r1", **meeting})
+        assert not busy["ok"] and busy["error"] == "busy" and service.stats["busy"] == 1
+        assert (await first)["status"] == "confirmed"
+        assert (await service.handle({"op": "book_room", "user_id": "u2", "room_id": "r1", **meeting}))["ok"]
+
+    print("\n=== TEST 2: Backpressure ===")
+    asyncio.run(backpressure())
+    print("Backpressure test passed!")
+
+    async def malformed():
+        service = BookingService(build(), tick_interval=0.01)
+        assert await service.handle([]) == {"id": None, "ok": False, "error": "bad request: expected a JSON object"}
+        unknown = await service.handle({"id": 7, "op": "teleport"})
+        assert unknown == {"id": 7, "ok": False, "error": "unknown op 'teleport'"}
+        unhashable = await service.handle({"id": 8, "op": ["book_desk"]})
+        assert unhashable["id"] == 8 and not unhashable["ok"] and unhashable["error"].startswith("bad request")
+        missing = await service.handle({"op": "book_desk", "user_id": "u1"})
+        assert not missing["ok"] and missing["error"].startswith("bad request: KeyError")
+        bad_date = await service.handle({"op": "availability", "date": "tomorrow"})
+        assert not bad_date["ok"] and bad_date["error"].startswith("bad request: ValueError")
+        assert service.stats["errors"] == 4 and not service.system.bookings
+
+        server = await service.start()
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+        writer.write(b"{not json\n[]\n" + json.dumps({"id": 1, "op": "my_bookings", "user_id": "u1"}).encode() + b"\n")
+        await writer.drain()
+        responses = [json.loads(await reader.readline()) for _ in range(3)]
+        assert {"ok": False, "error": "invalid JSON"} in responses
+        assert {"id": None, "ok": False, "error": "bad request: expected a JSON object"} in responses
+        assert {"id": 1, "ok": True, "bookings": []} in responses
+        writer.write_eof()
+        assert await reader.read() == b""  # the server closes the connection once the client is done
+        writer.close()
+        server.close()
+        await server.wait_closed()
+
+    print("\n=== TEST 3: Malformed Requests ===")
+    asyncio.run(malformed())
+    print("Malformed requests test passed!")
+
+    async def failing_tick():
+        service = BookingService(build(), tick_interval=0.01)
+
+        def broken():
+            raise RuntimeError("allocator down")
+
+        service.system.process_request_batch = broken
+        failed = await asyncio.gather(*(
+            service.handle({"op": "book_desk", "user_id": f"u{i}", "desk_id": "d1", "date": date, "slot": "morning"})
+            for i in range(1, 3)
+        ))
+        assert all(response == {"id": None, "ok": False, "error": "internal error: RuntimeError('allocator down')"}
+                   for response in failed)
+        assert not service._pending and service.stats["ticks"] == 1 and service.stats["errors"] == 2
+        del service.system.process_request_batch
+        booked = await service.handle({"op": "book_desk", "user_id": "u3", "desk_id": "d1", "date": date, "slot": "morning"})
+        assert booked["ok"] and booked["status"] == "confirmed" and service.stats["ticks"] == 2
+
+    print("\n=== TEST 4: Failing Tick ===")
+    asyncio.run(failing_tick())
+    print("Failing tick test passed!")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        raise SystemExit(main())
+    print("Starting tests...")
+    run_tests()
+    print("Tests completed successfully!")
@@ -0,0 +1,370 @@
+"""Multi-process BookingSystem partitioned by (location, date).
+
+A router in the calling process hashes every request by the location of its
+resource and the day it is for, and forwards it to one of `workers` worker
+processes. Each worker keeps one BookingSystem per location it serves, holding
+only that location's resources, so a day at a location is owned by exactly one
+worker and can never be double-booked from two of them. Desk requests are
+therefore seated within the location of the desk they name.
+
+Operations that span shards scatter to every worker and gather the answers:
+get_user_bookings, utilization and user_karma. Karma penalties are applied by the
+worker that handled the booking. sync_karma, which process_request_queue runs
+first, adds up every shard's penalties on the router and hands the merged karma
+back to every worker. Waiting list priority therefore sees the penalties of all
+shards as of the last tick, and user_karma is always exact.
+
+Every request pays for a round trip to a worker process, so sharding only pays
+off when there are cores for the workers to run on: on a single core it measures
+at about the speed of one BookingSystem (benchmark.py --shards reports the CPU
+count with its timings).
+
+    with ShardedBookingSystem(users, resources, workers=4) as system:
+        booking_ids = system.submit([("request_booking", ("u1", "d4", day, TimeSlot.MORNING))])
+        system.process_request_queue()
+"""
+import multiprocessing
+import os
+import zlib
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from algorithm import BatchReport, Booking, BookingStatus, BookingSystem, Resource, ResourceType, TimeSlot, User
+
+# Opening hours used for utilization, see get_time_slot_range and get_valid_room_times
+OPEN_HOURS = {ResourceType.DESK: 8, ResourceType.ROOM: 9}
+SUBMITTED_OPERATIONS = {"request_booking", "request_room_booking"}
+
+
+class ShardWorker:
+    """State of one worker process: a BookingSystem per location it has been sent requests for"""
+    def __init__(self, users: List[User], resources: List[Resource], seed: int = None):
+        self.users = {user.id: user for user in users}
+        self.initial_karma = {user.id: user.karma_points for user in users}
+        self.location_resources: Dict[str, List[Resource]] = defaultdict(list)
+        for resource in resources:
+            self.location_resources[resource.location].append(resource)
+        self.seed = seed
+        self.partitions: Dict[str, BookingSystem] = {}  # location -> its BookingSystem
+
+    def _partition(self, location: str) -> BookingSystem:
+        system = self.partitions.get(location)
+        if system is None:
+            system = BookingSystem(seed=self.seed)
+            system.users = self.users  # shared by every partition of the worker, so karma is per worker
+            for resource in self.location_resources[location]:
+                system.add_resource(resource)
+            self.partitions[location] = system
+        return system
+
+    def _owner(self, booking_id: str) -> BookingSystem:
+        for system in self.partitions.values():
+            if booking_id in system.bookings:
+                return system
+        raise KeyError(booking_id)
+
+    def submit(self, requests: List[Tuple[str, str, tuple]]) -> List[object]:
+        """Run (operation, location, args) requests, returns a booking ID or the raised exception for each"""
+        results = []
+        for operation, location, args in requests:
+            try:
+                results.append(getattr(self._partition(location), operation)(*args))
+            except Exception as error:
+                results.append(error)
+        return results
+
+    def process(self) -> BatchReport:
+        total = BatchReport()
+        for system in self.partitions.values():
+            report = system.process_request_batch()
+            total.processed += report.processed
+            total.confirmed += report.confirmed
+            total.waitlisted += report.waitlisted
+            total.skipped += report.skipped
+            total.groups += report.groups
+        return total
+
+    def has_booking(self, booking_id: str) -> bool:
+        return any(booking_id in system.bookings for system in self.partitions.values())
+
+    def on_booking(self, booking_id: str, operation: str, args: tuple):
+        return getattr(self._owner(booking_id), operation)(booking_id, *args)
+
+    def booking(self, booking_id: str) -> Booking:
+        record = self._owner(booking_id).bookings[booking_id]
+        return record.to_booking() if hasattr(record, "to_booking") else record
+
+    def user_bookings(self, user_id: str) -> List[Booking]:
+        return [booking for system in self.partitions.values() for booking in system.get_user_bookings(user_id)]
+
+    def booked_hours(self, booking_date: Optional[date]) -> Dict[Tuple[str, date], Dict[str, float]]:
+        """Confirmed hours per (location, day) and resource type"""
+        hours: Dict[Tuple[str, date], Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        for location, system in self.partitions.items():
+            for booking in system.get_bookings_by_status(BookingStatus.CONFIRMED):
+                day = booking.start_time.date()
+                if booking_date is None or day == booking_date:
+                    hours[(location, day)][booking.resource.type.value] += (booking.end_time - booking.start_time).total_seconds() / 3600
+        return {key: dict(by_type) for key, by_type in hours.items()}
+
+    def karma_deductions(self) -> Dict[str, int]:
+        return {user_id: self.initial_karma[user_id] - user.karma_points
+                for user_id, user in self.users.items() if user.karma_points != self.initial_karma[user_id]}
+
+    def set_karma(self, karma: Dict[str, int]):
+        """Adopt karma merged across shards, later deductions are counted from it"""
+        for user_id, points in karma.items():
+            self.users[user_id].karma_points = points
+            self.initial_karma[user_id] = points
+
+    def karma(self, user_id: str) -> int:
+        return self.users[user_id].karma_points
+
+
+def _worker_main(connection, users: List[User], resources: List[Resource], seed: int = None):
+    worker = ShardWorker(users, resources, seed)
+    while True:
+        method, args = connection.recv()
+        if method is None:
+            break
+        try:
+            connection.send((True, getattr(worker, method)(*args)))
+        except Exception as error:
+            connection.send((False, error))
+    connection.close()
+
+
+class ShardedBookingSystem:
+    def __init__(self, users: Iterable[User], resources: Iterable[Resource], workers: int = None, seed: int = None):
+        self.users = {user.id: user for user in users}
+        self.resources = {resource.id: resource for resource in resources}
+        self.workers = workers or os.cpu_count() or 1
+        self._booking_shards: Dict[str, int] = {}  # booking_id -> worker, for bookings made through the router
+        self._connections = []
+        self._processes = []
+        context = multiprocessing.get_context()
+        for number in range(self.workers):
+            parent, child = context.Pipe()
+            process = context.Process(
+                target=_worker_main, name=f"booking-shard-{number}", daemon=True,
+                args=(child, list(self.users.values()), list(self.resources.values()),
+                      None if seed is None else seed + number),
+            )
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for connection, process in zip(self._connections, self._processes):
+            if process.is_alive():
+                connection.send((None, ()))
+            process.join()
+            connection.close()
+        self._connections, self._processes = [], []
+
+    def shard_of(self, resource_id: str, when: datetime) -> int:
+        """Worker that owns the resource's location on the given day"""
+        key = f"{self.resources[resource_id].location}|{when.date().isoformat()}"
+        return zlib.crc32(key.encode()) % self.workers
+
+    # Messaging
+    def _call(self, worker: int, method: str, *args):
+        self._connections[worker].send((method, args))
+        ok, result = self._connections[worker].recv()
+        if not ok:
+            raise result
+        return result
+
+    def _scatter(self, method: str, *args) -> List[object]:
+        """Run a method on every worker at once and gather the results in worker order"""
+        for connection in self._connections:
+            connection.send((method, args))
+        results = [connection.recv() for connection in self._connections]
+        for ok, result in results:
+            if not ok:
+                raise result
+        return [result for _, result in results]
+
+    def _worker_for_booking(self, booking_id: str) -> int:
+        worker = self._booking_shards.get(booking_id)
+        if worker is None:
+            # Made inside a worker, e.g. a coworker's booking from a group request
+            owners = [number for number, found in enumerate(self._scatter("has_booking", booking_id)) if found]
+            if not owners:
+                raise KeyError(booking_id)
+            worker = self._booking_shards[booking_id] = owners[0]
+        return worker
+
+    # Requests
+    def submit(self, requests: List[Tuple[str, tuple]]) -> List[object]:
+        """Send many ("request_booking" | "request_room_booking", args) requests in one round trip per worker
+
+        Returns the booking ID of each request, or the exception it raised.
+        """
+        by_worker: Dict[int, List[int]] = defaultdict(list)
+        payloads: Dict[int, List[tuple]] = defaultdict(list)
+        for i, (operation, args) in enumerate(requests):
+            if operation not in SUBMITTED_OPERATIONS:
+                raise ValueError(f"Cannot submit {operation!r}")
+            resource_id, when = args[1], args[2]
+            worker = self.shard_of(resource_id, when)
+            by_worker[worker].append(i)
+            payloads[worker].append((operation, self.resources[resource_id].location, args))
+        for worker, payload in payloads.items():
+            self._connections[worker].send(("submit", (payload,)))
+        results: List[object] = [None] * len(requests)
+        for worker, indexes in by_worker.items():
+            ok, answers = self._connections[worker].recv()
+            if not ok:
+                raise answers
+            for i, answer in zip(indexes, answers):
+                results[i] = answer
+                if isinstance(answer, str):
+                    self._booking_shards[answer] = worker
+        return results
+
+    def request_booking(self, user_id: str, resource_id: str, booking_date: datetime,
+                        time_slot: TimeSlot, coworker_ids: List[str] = None) -> str:
+        return self._single("request_booking", (user_id, resource_id, booking_date, time_slot, coworker_ids))
+
+    def request_room_booking(self, user_id: str, room_id: str, start_time: datetime, end_time: datetime) -> str:
+        return self._single("request_room_booking", (user_id, room_id, start_time, end_time))
+
+    def _single(self, operation: str, args: tuple) -> str:
+        result = self.submit([(operation, args)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def process_request_queue(self) -> BatchReport:
+        """Allocate every worker's queued requests, all workers at once, with karma merged across shards"""
+        started = perf_counter()
+        self.sync_karma()
+        total = BatchReport()
+        for report in self._scatter("process"):
+            total.processed += report.processed
+            total.confirmed += report.confirmed
+            total.waitlisted += report.waitlisted
+            total.skipped += report.skipped
+            total.groups += report.groups
+        total.elapsed = perf_counter() - started
+        return total
+
+    def _on_booking(self, booking_id: str, operation: str, *args):
+        return self._call(self._worker_for_booking(booking_id), "on_booking", booking_id, operation, args)
+
+    def process_cancellation(self, booking_id: str):
+        return self._on_booking(booking_id, "process_cancellation")
+
+    def check_in_user(self, booking_id: str) -> bool:
+        return self._on_booking(booking_id, "check_in_user")
+
+    def release_resource(self, booking_id: str, now: datetime = None):
+        return self._on_booking(booking_id, "release_resource", now)
+
+    def remove_booking(self, booking_id: str):
+        self._on_booking(booking_id, "remove_booking")
+        self._booking_shards.pop(booking_id, None)
+
+    def get_booking(self, booking_id: str) -> Booking:
+        """Copy of a booking as its worker holds it"""
+        return self._call(self._worker_for_booking(booking_id), "booking", booking_id)
+
+    # Scatter-gather queries
+    def get_user_bookings(self, user_id: str) -> List[Booking]:
+        """Copies of every booking the user holds on any shard, earliest first"""
+        bookings = [booking for part in self._scatter("user_bookings", user_id) for booking in part]
+        return sorted(bookings, key=lambda booking: booking.start_time)
+
+    def utilization(self, booking_date: datetime = None) -> Dict[Tuple[str, date], Dict[str, float]]:
+        """Booked share of opening hours per (location, day), for one day or every day with bookings"""
+        capacity: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        for resource in self.resources.values():
+            capacity[resource.location][resource.type.value] += OPEN_HOURS[resource.type]
+        day = booking_date.date() if booking_date is not None else None
+        report = {}
+        for part in self._scatter("booked_hours", day):
+            for (location, booked_day), by_type in part.items():
+                row = {}
+                for resource_type, hours in by_type.items():
+                    row[f"{resource_type}_hours"] = hours
+                    row[f"{resource_type}_utilization"] = hours / capacity[location][resource_type]
+                report[(location, booked_day)] = row
+        return dict(sorted(report.items()))
+
+    def user_karma(self, user_id: str) -> int:
+        """The user's karma with the penalties of every shard applied"""
+        deducted = sum(part.get(user_id, 0) for part in self._scatter("karma_deductions"))
+        return max(0, self.users[user_id].karma_points - deducted)
+
+    def sync_karma(self) -> Dict[str, int]:
+        """Apply the karma penalties of every shard on every shard, returns the merged karma of users that changed"""
+        deducted: Dict[str, int] = defaultdict(int)
+        for part in self._scatter("karma_deductions"):
+            for user_id, points in part.items():
+                deducted[user_id] += points
+        merged = {}
+        for user_id, points in deducted.items():
+            user = self.users[user_id]
+            user.karma_points = max(0, user.karma_points - points)
+            merged[user_id] = user.karma_points
+        if merged:
+            self._scatter("set_karma", merged)
+        return merged
+
+
+def run_tests():
+    print("\n=== TEST 1: Sharded Routing ===")
+    users = [User(f"u{i}", f"User{i}", f"user{i}@company.com") for i in range(1, 11)]
+    resources = [Resource(f"d{i}", ResourceType.DESK, f"Floor {(i - 1) // 4 + 1}", f"family{(i - 1) // 2 + 1}")
+                 for i in range(1, 13)]
+    resources += [Resource(f"r{i}", ResourceType.ROOM, f"Floor {i}") for i in range(1, 4)]
+    day = datetime.combine(datetime.now().date(), datetime.min.time())
+    with ShardedBookingSystem(users, resources, workers=3, seed=1) as system:
+        tomorrow = day + timedelta(days=1)
+        desk_ids = system.submit([("request_booking", (f"u{i}", "d1", tomorrow, TimeSlot.FULL_DAY)) for i in range(1, 6)])
+        group = system.request_booking("u6", "d5", tomorrow, TimeSlot.MORNING, ["u7"])
+        late = day.replace(hour=23)
+        room = system.request_room_booking("u8", "r2", late, late + timedelta(minutes=30))
+        report = system.process_request_queue()
+        assert report.processed == 7
+        clash = system.request_room_booking("u9", "r2", late, late + timedelta(minutes=30))
+        system.process_request_queue()
+        # Floor 1 has four desks, so four are seated and the fifth waits instead of taking another floor's desk
+        statuses = [system.get_booking(booking_id).status for booking_id in desk_ids]
+        assert statuses.count(BookingStatus.CONFIRMED) == 4
+        assert all(system.get_booking(booking_id).resource.location == "Floor 1" for booking_id in desk_ids)
+        assert system.get_booking(group).resource.location == "Floor 2"
+        assert system.get_booking(room).status == BookingStatus.CONFIRMED
+        assert system.get_booking(clash).status == BookingStatus.PENDING
+
+        assert [b.resource.id for b in system.get_user_bookings("u7")] != []
+        system.process_cancellation(room)
+        assert system.get_booking(clash).status == BookingStatus.CONFIRMED
+        penalised = system.user_karma("u8")
+        assert penalised < 1000  # cancelled less than a day ahead, penalised by r2's worker
+        assert system.user_karma("u9") == 1000
+        assert len(set(system._scatter("karma", "u8"))) == 2  # only r2's worker knows so far
+        system.process_request_queue()
+        assert system._scatter("karma", "u8") == [penalised] * 3 and system.user_karma("u8") == penalised
+        assert system.sync_karma() == {}  # nothing new to merge
+
+        utilization = system.utilization(tomorrow)
+        assert utilization[("Floor 1", tomorrow.date())]["desk_utilization"] == 1.0
+        assert system.utilization(day)[("Floor 2", day.date())]["room_hours"] == 0.5
+    print("Sharded routing test passed!")
+
+
+if __name__ == "__main__":
+    print("Starting tests...")
+    run_tests()
+    print("Tests completed successfully!")